@@ -1,58 +1,129 @@
-from pysensaphone import sensaphone_auth
-from pysensaphone import set_sensaphone
-from pysensaphone import get_sensaphone
-import json
+from melodywoods import runtime
+from melodywoods import config
+from melodywoods import reporting
+from melodywoods import schedule
+from melodywoods import tracing
+from melodywoods import scheduler
+from melodywoods import tank
+from melodywoods import resilience
+from melodywoods import verify
+from melodywoods import state
+from melodywoods import topology
+from melodywoods import runlog
+from melodywoods import optimizer
+from melodywoods.status import SystemStatus, StatusLookupError
+import os
+import time
+import logging
 import datetime
 import dateutil.tz
-import boto3
 
+logger = logging.getLogger()
 
+# Predicted time (seconds) to reach the limit, turn off now when it is within PREDICT_NOW,
+# schedule a one time 'off' run when it is before the next hourly check.
+PREDICT_NOW = int(os.environ.get('TANK_PREDICT_NOW', 300))
+PREDICT_HORIZON = int(os.environ.get('TANK_PREDICT_HORIZON', 3600))
+
+
+def error_result(status_code, msg, devices, started):
+    """
+    Result of a run that stopped before a pump decision, logged like every other run (melodywoods.reporting).
+    Parameters:
+        status_code (int): HTTP Status Code
+        msg (str): what went wrong
+        devices (list): system status, empty when it wasn't downloaded
+        started (float): time.perf_counter() at the start of the run
+
+    Returns:
+        dict: Lambda result
+    """
+    record = {"statusCode": status_code, "summary": msg, "seconds": round(time.perf_counter() - started, 3)}
+    result = {"statusCode": status_code, "body": {"zone": "TP 88k 5hp Pump Output", "summary": msg, "data": None,
+                                                  "system_status": devices}}
+    reporting.log_result(result, devices, record)
+    return result
+
+
+@tracing.handler('88k_tank')
 def lambda_handler(event, context):
+    started = time.perf_counter()
 
-    ssm = boto3.client('ssm')
-    shutoff_level = float(ssm.get_parameter(Name='shutoff_level_88k')['Parameter']['Value'])
-    shutoff_noon_level = float(ssm.get_parameter(Name='shutoff_noon_level_88k')['Parameter']['Value'])
+    # SSM values, Sensaphone session and boto3 clients are cached between warm invocations
+    # {"refresh": true} (a shutoff level changed in Parameter Store, see template.yaml) skips the cache
+    cfg = config.load_config(force=bool(event.get('refresh')))
+    shutoff_level = cfg.shutoff_level
+    shutoff_noon_level = cfg.shutoff_noon_level
     # moved to parameters because of sensor drift, below were the starting values we used for a long time
     #shutoff_level = 23.3
     #shutoff_noon_level = 23.0
 
     # Get current Pacific time. AWS Lambda event triggers operate in UTC.
-    pacific = dateutil.tz.gettz('US/Pacific')
-    current_pacific_time = datetime.datetime.now(tz=pacific)
-    utc = dateutil.tz.gettz('UTC')
-    current_utc_time = datetime.datetime.now(tz=utc)
-
-    # Login to sensaphone.net
-    creds = sensaphone_auth.check_valid_session()
+    current_pacific_time = schedule.now()
+    current_utc_time = current_pacific_time.astimezone(dateutil.tz.gettz('UTC'))
 
     # Current System Status
-    devices = get_sensaphone.system_status(creds)
-
-    for d in devices:
-        if d['name'] == 'TreatmentPlant':
-            # TP Sentinel
-            device_id = d['device_id']
-            tp_is_online = d['is_online']
-            tp_power = d['power_value']
-            for z in d['zone']:
-                if z['name'] == '88k Pump':
-                    pump_88k = z['value']
-                    # Output #1 - 88k 5hp
-                    zone_id = z['zone_id']
-        elif d['name'] == '88kTank':
-            # 88k Sentinel
-            is_online_88k = d['is_online']
-            power_88k = d['power_value']
-            for z in d['zone']:
-                if z['name'] == '88k Level':
-                    level_88k = float(z['value'].strip('Ft'))
+    # imported on first use to keep cold starts short (see melodywoods.runtime)
+    from pysensaphone import get_sensaphone, set_sensaphone
+    try:
+        devices = runtime.call_sensaphone(get_sensaphone.system_status)
+    except resilience.CallError as err:
+        # sensaphone.net is down, fail fast, the next hourly check tries again
+        return error_result(503, 'Sensaphone unavailable - ' + str(err), [], started)
+
+    status = SystemStatus(devices)
+
+    # 88k pump on the TP Sentinel, level on the 88k Sentinel (melodywoods.topology)
+    pump = topology.load().pumps['88k']
+    level_sentinel, level_zone = pump.level
+    try:
+        # TP Sentinel
+        device_id = status.device(pump.sentinel)['device_id']
+        tp_power = status.power(pump.sentinel)
+        # Output #1 - 88k 5hp
+        zone_id = status.zone(pump.sentinel, pump.zone)['zone_id']
+        # 88k Sentinel
+        power_88k = status.power(level_sentinel)
+        level_88k = status.value(level_sentinel, level_zone)
+        pump_on = status.value(pump.sentinel, pump.zone) is True
+    except StatusLookupError as err:
+        # renamed Sentinel / zone, nothing to decide on until the topology matches sensaphone.net again
+        return error_result(404, str(err), devices, started)
+    if not isinstance(level_88k, float):
+        # sensor fault or a zone that isn't the level, ex. 'Not Connected'
+        return error_result(500, '88k Level not a number - ' + repr(status.zone(level_sentinel, level_zone)['value']),
+                            devices, started)
+
+    plant_state = state.load_state()
+    plant_state.update_status(status, current_pacific_time.timestamp())
+
+    # Level history kept between runs, trend gives a smoothed level (sensor noise) and the fill rate
+    now = current_pacific_time.timestamp()
+    history = tank.load_history()
+    history.append(now, level_88k, pump_on)
+    tank.save_history(history)
+    trend = history.trend(now)
+    reading_88k = level_88k
+    if trend:
+        level_88k = round(trend[1], 2)
+
+    # Cheapest on/off plan for the next 24 hours (melodywoods.optimizer), replaces the 9PM / noon / morning rules
+    plan = None
+    # predicted limit 'off' schedule armed by this run
+    armed = None
+    if optimizer.TANK_OPTIMIZER and event['pump'] != 'off':
+        plan = optimizer.plan_88k(level_88k, current_pacific_time, pump_on, shutoff_level)
 
     # Process Lambda Event Payload
     msg = None
+    # why the pump was changed (or not), for the run log (melodywoods.runlog)
+    reason = 'other'
     if event['pump'] == 'off':
         pump_value = 0
         msg = event
-    elif event['pump'] == 'on':
+        reason = 'event_off'
+    elif event['pump'] == 'on' and plan is None:
+        reason = 'event_on'
         # 9PM turn the pump On, or after power has been restored (future Lambda).
         # PDT - 9PM / 4 UTC
         # PST - 9PM / 5 UTC
@@ -64,34 +135,77 @@ def lambda_handler(event, context):
             msg = 'Currently ' + current_pacific_time.strftime("%I%p %Z") + ' / '\
                   + current_utc_time.strftime("%I%p %Z") + ' - Pump will turn ' + event['pump'] + ' at 9PM Pacific'
     else:
-        if level_88k > shutoff_level:
-            # Turn Off pump as 88k is full
+        if reading_88k > shutoff_level or level_88k > shutoff_level:
+            # Turn Off pump as 88k is full, on the raw reading too, smoothing lags a fast fill
             pump_value = 0
-            msg = '88k Level at High Limit ' + str(level_88k)
-        elif level_88k > shutoff_noon_level and (12 <= current_pacific_time.hour < 21):
+            msg = '88k Level at High Limit ' + str(max(reading_88k, level_88k))
+            reason = 'high_limit'
+        elif plan is not None and plan.on[0] != pump_on:
+            pump_value = 1 if plan.on[0] else 0
+            msg = '88k Plan ' + ('On' if plan.on[0] else 'Off') + ' ' + str(level_88k)
+            reason = 'plan'
+        elif plan is None and level_88k > shutoff_noon_level and (12 <= current_pacific_time.hour < 21):
             # If it is after 12PM/Noon and 88k tank is > 23ft shutoff 5hp
             # Attempt to even out, pumping during lower $/kW when water usage is higher
             pump_value = 0
             msg = '88k Level at Noon High Limit ' + str(level_88k)
-        elif level_88k < shutoff_noon_level and current_pacific_time.hour <= 7:
+            reason = 'noon_limit'
+        elif plan is None and level_88k < shutoff_noon_level and current_pacific_time.hour <= 7:
             pump_value = 1
             msg = '88k Level Morning Low Optimization ' + str(level_88k)
+            reason = 'morning_fill'
         else:
-            # No Output Changes needed
+            # No Output Changes needed now
             pump_value = None
+            # While filling, predict when the limit is reached and turn off then instead of at the next hourly check
+            limit = shutoff_noon_level if plan is None and 12 <= current_pacific_time.hour < 21 else shutoff_level
+            eta = history.seconds_to_level(limit, now) if pump_on else None
+            if eta is not None and eta <= PREDICT_NOW:
+                pump_value = 0
+                reason = 'predicted_limit'
+                msg = '88k Level Predicted Limit ' + str(limit) + ' in ' + str(round(eta / 60)) + ' mins ' \
+                      + str(level_88k)
+            elif eta is not None and eta < PREDICT_HORIZON:
+                at = datetime.datetime.fromtimestamp(now + eta, tz=schedule.PACIFIC)
+                armed = scheduler.timed_name('88k-predicted-limit', at)
+                scheduler.get_scheduler().schedule_once(armed, at, scheduler.function_arn(context),
+                                                        {"pump": "off", "reason": "Predicted Limit " + str(limit)})
+                msg = '88k Level ' + str(level_88k) + ' Pump Off scheduled at ' + at.strftime("%I:%M%p %Z")
 
     # Set 88k Output
-    if (tp_power == "On" and power_88k == "On") and pump_value is not None:
-        data = set_sensaphone.change_device_output(creds, device_id, zone_id, pump_value)
-        if data['result']['success']:
-            status_code = 200
-        else:
-            status_code = data['result']['code']
+    if tp_power and power_88k and pump_value is not None:
+        try:
+            data = runtime.call_sensaphone(set_sensaphone.change_device_output, device_id, zone_id, pump_value)
+            if data['result']['success']:
+                status_code = 200
+                if verify.VERIFY:
+                    data['verify'] = verify.verify_output(device_id, zone_id, pump_value == 1)
+                    if not data['verify']['verified']:
+                        status_code = 504
+                plant_state.record_command(pump.sentinel, pump.zone, 'On' if pump_value else 'Off',
+                                           current_pacific_time.timestamp(), confirmed=status_code == 200)
+            else:
+                status_code = data['result']['code']
+        except resilience.CallError as err:
+            data = {'error': 'Sensaphone unavailable - ' + str(err)}
+            status_code = 503
     # In the future when power Off/On email received could shut pumps Off/On
     # To avoid tripped breakers when power comes back On
-    elif tp_power == "Off" or power_88k == "Off":
-        msg = 'Power Out - TP ' + tp_power + ' - 88k ' + power_88k
-        data = set_sensaphone.change_device_output(creds, device_id, zone_id, 0)
+    elif not (tp_power and power_88k):
+        msg = 'Power Out - TP ' + ('On' if tp_power else 'Off') + ' - 88k ' + ('On' if power_88k else 'Off')
+        reason = 'power_out'
+        # the 'off' is repeated every few hours during a long outage, not every run (melodywoods.state)
+        if plant_state.repeated_command(pump.sentinel, pump.zone, 'Off', current_pacific_time.timestamp()):
+            msg = msg + ' - Off already sent'
+            data = None
+        else:
+            try:
+                data = runtime.call_sensaphone(set_sensaphone.change_device_output, device_id, zone_id, 0)
+                if data['result']['success']:
+                    plant_state.record_command(pump.sentinel, pump.zone, 'Off', current_pacific_time.timestamp(),
+                                               confirmed=False)
+            except resilience.CallError as err:
+                data = {'error': 'Sensaphone unavailable - ' + str(err)}
         status_code = 503
     else:
         if not msg:
@@ -99,6 +213,21 @@ def lambda_handler(event, context):
         data = None
         status_code = 200
 
+    # An 'off' predicted by an earlier run is stale once a later run decided otherwise (the pump seen or turned off,
+    # the 9PM on, the plan, a new prediction), it would turn the pump off after it was turned back on.
+    pending = tank.pending_shutoff()
+    if pending != armed:
+        if pending:
+            try:
+                scheduler.get_scheduler().cancel(pending)
+            except Exception as err:
+                logger.error('Predicted limit {a} not cancelled: {b!r}'.format(a=pending, b=err))
+        tank.save_pending_shutoff(armed)
+
+    state.save_state(plant_state)
+    runlog.append([(pump.name, now, plant_state.value(pump.sentinel, pump.zone, now), reading_88k, status_code,
+                    reason)])
+
     result = {
         "statusCode": status_code,
         "body": {
@@ -108,6 +237,20 @@ def lambda_handler(event, context):
             "system_status": devices
         },
     }
-    # This is to record what happens in CloudWatch logs. For some reason return value is not logged.
-    print(json.dumps(result))
+    # Compact record for CloudWatch, the full result is logged with LOG_MODE=verbose (melodywoods.reporting)
+    record = {
+        "statusCode": status_code,
+        "summary": msg,
+        "level_88k": reading_88k,
+        "smoothed_level_88k": level_88k,
+        "fill_rate": round(trend[0], 3) if trend else None,
+        "before": status.zone(pump.sentinel, pump.zone)['value'],
+        "requested": pump_value,
+        "response": (data or {}).get('result') or (data or {}).get('error'),
+        "verify": (data or {}).get('verify'),
+        "plan": ''.join('1' if on else '0' for on in plan.on) if plan else None,
+        "plan_cost": plan.cost if plan else None,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    reporting.log_result(result, devices, record)
     return result
@@ -1,7 +1,12 @@
-import boto3
-import email
+from melodywoods import runtime
+from melodywoods import config
+from melodywoods import control
+from melodywoods import parallel
+from melodywoods import alerts
+from melodywoods import dedupe
+from melodywoods import tracing
+from melodywoods import topology
 import os
-import re
 import json
 import logging
 
@@ -12,6 +17,12 @@ logging.getLogger("botocore").setLevel(logging.WARNING)
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# How pump changes are sent
+#   invoke - asynchronous invoke of the supply function for each pump, returns when they are accepted
+#   inprocess - the supply control logic (melodywoods.control) runs in this invocation, one Sensaphone login and
+#               status download for all the pumps, returns the actual result of each change
+DISPATCH_MODE = os.environ.get('DISPATCH_MODE', 'invoke').lower()
+
 ''' How to test/debug
     https://docs.aws.amazon.com/workmail/latest/adminguide/lambda-content.html
     1. Generate recent alert (needs to be in last 24hrs), by changing Alarm Low or High within
@@ -31,109 +42,99 @@ def get_email(event):
             event (dict): Contains event payload from Lambda.
 
         Returns:
-            str: email body.
+            bytes: email body.
         """
     # event['messageId'] contains id to retrieve complete email from WorkMail (only for emails in last 24hrs)
-    workmail = boto3.client('workmailmessageflow', region_name=os.environ["AWS_REGION"])
-
-    # get email
-    raw_msg = workmail.get_raw_message_content(messageId=event['messageId'])
-    parsed_msg = email.message_from_bytes(raw_msg['messageContent'].read())
-
-    # get body of email
-    if parsed_msg.is_multipart():
-        for part in parsed_msg.walk():
-            content_type = part.get_content_type()
-            cdispo = str(part.get('Content-Disposition'))
-            # skip any text/plain (txt) attachments
-            if content_type == 'text/plain' and 'attachment' not in cdispo:
-                body = part.get_payload(decode=True)  # decode
-                break
-    # not multipart - i.e. plain text, no attachments
-    else:
-        body = parsed_msg.get_payload(decode=True)
+    workmail = runtime.get_client('workmailmessageflow', region_name=os.environ["AWS_REGION"])
+
+    # get email, read in chunks and keep only the body
+    with tracing.span('get_raw_message_content'):
+        raw_msg = workmail.get_raw_message_content(messageId=event['messageId'])
+        body = alerts.read_message(raw_msg['messageContent'])
 
     # log email body
-    logger.info(json.dumps({'email_body': body.decode('UTF-8')}))
+    logger.info(json.dumps({'email_body': body.decode('UTF-8', errors='replace')}))
     return body
 
 
+@tracing.handler('email')
 def lambda_handler(event, context):
     msg = []
+    # pump changes to send to the supply lambda, sent together once the email is parsed
+    payloads = []
+    # alarms acted on (sentinel, alarm type, target state) -> their pump changes, and repeats skipped (melodywoods.dedupe)
+    acted = {}
+    repeats = []
+
+    # which pumps an alarm from a Sentinel acts on (melodywoods.topology)
+    topo = topology.load()
 
-    spring = {"sentinel_name": "TreatmentPlant", "pump_name": "Spring Pump", "pump": "off",
-              "reason": {"type": "email_alarm", "value": True}}
-    well3 = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "off",
-             "reason": {"type": "email_alarm", "value": True}}
-    """
-    well5 = {"sentinel_name": "Well#5", "pump_name": "#5 Well Pump", "pump": "off",
-             "reason": {"type": "email_alarm", "value": True}}
-    """
     logger.info(json.dumps(event))
     email_body = get_email(event)
 
-    # parse body of email
-    email_lines = email_body.splitlines()
-    for idx, l in enumerate(email_lines):
+    # parse body of email, one Alert per alert line
+    for alert in alerts.parse_alerts(email_body):
         # from which Sentinel
-        if 'From:' in str(l):
-            sentinel = email_lines[idx + 1].decode('utf-8')
-            # Well#3 / TreatmentPlant etc
+        sentinel = alert.sentinel
 
-        # what alerted?
         # looking for CL Barrel Low Alarm
-        elif 'alarm' in str(l):
-            alert_details = str(l).split('. ')
-            cl_alert = re.search(r"Low level alarm .+ Chlorine Barrel Level", str(alert_details[0]), re.I)
-            cl_level = re.search(r"-?\d+\.\d+", alert_details[2])[0]
-
-            logger.info("Valid alert to take action? " + str(cl_alert and float(cl_level) > 0))
+        if alert.alarm_type == 'low_level':
+            cl_alert = alerts.is_chlorine_low(alert)
+            logger.info("Valid alert to take action? " + str(cl_alert))
 
             # valid alert? if reading is > 0. If we lost power value will be negative.
-            if cl_alert and float(cl_level) > 0:
-                # if CL Barrel in TP is low all the wells and spring need to be shutoff
-                if sentinel == 'TreatmentPlant':
-                    msg.append(invoke_supply_lambda(spring))
-                    msg.append(invoke_supply_lambda(well3))
-                    # msg.append(invoke_supply_lambda(well5))
-                # if Well3 CL Barrel is low then turn off Well3
-                elif sentinel == 'Well#3':
-                    msg.append(invoke_supply_lambda(well3))
-                else:
+            # repeats of the same alarm inside the de-dupe window are skipped
+            if cl_alert and not dedupe.first_alarm(sentinel, 'chlorine_low', 'off'):
+                repeats.append(dedupe.alarm_key(sentinel, 'chlorine_low', 'off'))
+            elif cl_alert:
+                # ex. if CL Barrel in TP is low all the wells and spring need to be shutoff
+                pumps = topo.pumps_for_alarm(sentinel, 'chlorine_low')
+                if pumps is None:
                     msg = 'Unknown Sentinel, no mapping of pumps to turn off'
                     logger.error(msg)
-
-        elif 'power' in str(l):
-            alert_details = str(l).split('. ')
-            power_off = re.search(r"The power is OFF", str(alert_details[0]), re.I)
-            power_on = re.search(r"The power has returned to normal", str(alert_details[0]), re.I)
-
-            if power_off:
-                if sentinel == 'TreatmentPlant':
-                    msg.append(invoke_supply_lambda(spring))
-                    msg.append(invoke_supply_lambda(well3))
-                    # msg.append(invoke_supply_lambda(well5))
-                elif sentinel == 'Well#3':
-                    msg.append(invoke_supply_lambda(well3))
-                else:
-                    msg = 'Unknown Sentinel, no mapping of pumps to turn off'
-                    logger.error(msg)
-            elif power_on:
-                spring['pump'] = 'on'
-                # Well3 turns on if it is currently in between its On/Off times based on Supply Lambda.
-                well3['pump'] = 'on'
-                # well5['pump'] = 'on'
-                if sentinel == 'TreatmentPlant':
-                    msg.append(invoke_supply_lambda(spring))
-                    msg.append(invoke_supply_lambda(well3))
-                    # msg.append(invoke_supply_lambda(well5))
-                elif sentinel == 'Well#3':
-                    msg.append(invoke_supply_lambda(well3))
                 else:
-                    msg = 'Unknown Sentinel, no mapping of pumps to turn on'
-                    logger.error(msg)
-
-    if not msg:
+                    changes = [topo.pump_event(p, 'off', 'email_alarm') for p in pumps]
+                    acted[(sentinel, 'chlorine_low', 'off')] = changes
+                    payloads += changes
+
+        elif alert.alarm_type == 'power':
+            value = 'on' if alert.power else 'off'
+            if not dedupe.first_alarm(sentinel, 'power', value):
+                repeats.append(dedupe.alarm_key(sentinel, 'power', value))
+                continue
+            # power restored, wells restored on their schedule only turn on between their On/Off times (supply lambda)
+            pumps = topo.pumps_for_alarm(sentinel, 'power')
+            if pumps is None:
+                msg = 'Unknown Sentinel, no mapping of pumps to turn ' + value
+                logger.error(msg)
+            else:
+                changes = [topo.pump_event(p, value, 'email_alarm') for p in pumps]
+                acted[(sentinel, 'power', value)] = changes
+                payloads += changes
+
+    if payloads:
+        # same pump change asked for by several alerts in one email is only sent once
+        unique = []
+        for p in payloads:
+            if p not in unique:
+                unique.append(p)
+        try:
+            if DISPATCH_MODE == 'inprocess':
+                msg = dispatch_pumps(unique)
+            else:
+                msg = invoke_supply_lambdas(unique)
+        except BaseException:
+            for alarm in acted:
+                dedupe.forget(*alarm)
+            raise
+        # an alarm is only recorded once all of its pump changes succeeded, a repeat of a failed one is acted on
+        succeeded = [p for p, result in zip(unique, msg) if result['success']]
+        for alarm, changes in acted.items():
+            if any(p not in succeeded for p in changes):
+                dedupe.forget(*alarm)
+    elif repeats:
+        msg = 'Repeat alarm already acted on, skipped - ' + ', '.join(repeats)
+    elif not msg:
         msg = 'Email Alert body has no match - no-op'
 
     # This is to record what happens in CloudWatch logs. For some reason return value is not logged.
@@ -143,11 +144,50 @@ def lambda_handler(event, context):
 
 def invoke_supply_lambda(payload):
     # run supply lambda to turn on/off wells or spring
-    lambda_client = boto3.client('lambda')
-    invoke_response = lambda_client.invoke(
-        FunctionName="arn:aws:lambda:us-east-1:222492554563:function:melody-woods-water-supply-SacqPDTlGjRU",
-        InvocationType='Event',
-        Payload=json.dumps(payload))
+    lambda_client = runtime.get_client('lambda')
+    with tracing.span('lambda_invoke'):
+        invoke_response = lambda_client.invoke(
+            FunctionName=os.environ.get('SUPPLY_FUNCTION'),
+            InvocationType='Event',
+            Payload=json.dumps(payload))
 
     return {'success': True if invoke_response['StatusCode'] == 202 else False,
             'HTTPStatusCode': invoke_response['StatusCode'], 'pump': payload['pump_name'], "executed": payload}
+
+
+def invoke_supply_lambdas(payloads):
+    """
+        Invoke the supply lambda for each pump at the same time (melodywoods.parallel).
+        Parameters:
+            payloads (list): supply lambda event payload for each pump
+
+        Returns:
+            list: invoke_supply_lambda() response for each pump, in the same order as payloads
+        """
+    results = []
+    for payload, output in zip(payloads, parallel.run_concurrently([(invoke_supply_lambda, (p,)) for p in payloads])):
+        if output['error']:
+            results.append({'success': False, 'error': output['error'], 'pump': payload['pump_name'],
+                            "executed": payload})
+        else:
+            results.append(output['result'])
+    return results
+
+
+def dispatch_pumps(payloads):
+    """
+        Run the pump changes in this invocation with the supply control logic (melodywoods.control).
+        Parameters:
+            payloads (list): supply lambda event payload for each pump
+
+        Returns:
+            list: result for each pump, in the same order as payloads
+        """
+    # alarms are rare, a warm container's cached timers could be hours old (no parameter change event reaches email)
+    cfg = config.load_config(force=True)
+    outputs = control.run_pumps([dict(p) for p in payloads], cfg)[0]
+    results = []
+    for payload, (status_code, msg, data) in zip(payloads, outputs):
+        results.append({'success': status_code == 200, 'statusCode': status_code, 'msg': msg,
+                        'pump': payload['pump_name'], "executed": payload, 'response': (data or {}).get('result')})
+    return results
@@ -0,0 +1,4 @@
+"""
+Shared code for the melody-woods-water Lambda functions.
+Deployed as a Lambda Layer (see template.yaml), so each function can `import melodywoods`.
+"""
@@ -0,0 +1,206 @@
+import os
+import re
+import logging
+import email.parser
+import email.policy
+from collections import namedtuple
+
+''' Sensaphone alert email parser
+    Sensaphone emails list the Sentinel under a 'From:' line followed by one line per alert, ex.
+        From:
+        TreatmentPlant
+        Low level alarm on Chlorine Barrel Level. Alarm limit 10.00 Gal. Current reading 9.50 Gal.
+        The power is OFF. ...
+    A digest can have several Sentinels and alerts, parse_alerts() returns one Alert for each alert line.
+'''
+
+logger = logging.getLogger()
+
+CHUNK_SIZE = 64 * 1024
+# most of a message kept by read_message(), attachments aren't counted as they are dropped while reading
+ALERT_MAX_BYTES = int(os.environ.get('ALERT_MAX_BYTES', 1024 * 1024))
+
+FROM = re.compile(r'From:')
+LEVEL_ALARM = re.compile(r'\b(?P<kind>low|high) level alarm\b\s*(?:(?:on|for|at|in)\s+)?(?:zone\s+)?(?P<zone>[^.]*)',
+                         re.I)
+ALARM = re.compile(r'alarm')
+POWER = re.compile(r'power')
+POWER_OFF = re.compile(r'The power is OFF', re.I)
+POWER_ON = re.compile(r'The power has returned to normal', re.I)
+NUMBER = re.compile(r'-?\d+\.\d+')
+
+# alarm_type - 'low_level', 'high_level', 'alarm' (other alarms), 'power'
+# level - reading from the alert (float), None if there isn't one
+# power - True power returned / False power is off, None for non power alerts
+Alert = namedtuple('Alert', ['sentinel', 'zone', 'alarm_type', 'level', 'power', 'text'])
+
+
+def read_lines(stream, chunk_size=CHUNK_SIZE):
+    """
+    Parameters:
+        stream: file like object with read(size), returning bytes
+        chunk_size (int): bytes to read at a time
+
+    Returns:
+        generator: lines of the stream (bytes, with their line ending)
+    """
+    rest = b''
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if rest:
+        yield rest
+
+
+def body_lines(lines):
+    """
+    Drop what read_message() won't use as the lines arrive - the bodies of attachments and of parts that are not
+    text/plain, multipart preambles and epilogues. Headers and boundaries are kept so the message still parses.
+    Parameters:
+        lines: iterable of the raw email lines (bytes)
+
+    Returns:
+        generator: lines to parse
+    """
+    boundaries = []
+    headers = []
+    skip = False
+    for line in lines:
+        if headers is not None:
+            yield line
+            headers.append(line)
+            if line.strip():
+                continue
+            part = email.parser.BytesHeaderParser(policy=email.policy.compat32).parsebytes(b''.join(headers))
+            headers = None
+            if part.get_content_maintype() == 'multipart' and part.get_boundary():
+                boundaries.append(b'--' + part.get_boundary().encode('utf-8', errors='replace'))
+                skip = True
+            elif part.get_content_maintype() == 'message':
+                # forwarded email, its headers follow
+                headers = []
+            else:
+                # not multipart - the body, whatever its type
+                skip = bool(boundaries) and (part.get_content_type() != 'text/plain'
+                                             or 'attachment' in str(part.get('Content-Disposition')))
+            continue
+        stripped = line.rstrip()
+        if stripped.startswith(b'--'):
+            matched = [i for i, boundary in enumerate(boundaries) if stripped in (boundary, boundary + b'--')]
+            if matched:
+                del boundaries[matched[-1] + 1:]
+                yield line
+                if stripped == boundaries[-1] + b'--':
+                    boundaries.pop()
+                    skip = True
+                else:
+                    headers = []
+                continue
+        if not skip:
+            yield line
+
+
+def read_message(stream, chunk_size=CHUNK_SIZE, max_bytes=ALERT_MAX_BYTES):
+    """
+    Read a raw email (ex. WorkMail get_raw_message_content()['messageContent']) in chunks and return the body.
+    Only the part that could be the body is kept, attachments are dropped while reading (body_lines()) and at most
+    max_bytes are parsed.
+    Parameters:
+        stream: file like object with read(size), returning bytes
+        chunk_size (int): bytes to read at a time
+        max_bytes (int): most bytes of the message parsed, the rest isn't read
+
+    Returns:
+        bytes: first text/plain part that is not an attachment, b'' if there is none
+    """
+
+    parser = email.parser.BytesFeedParser(policy=email.policy.compat32)
+    kept = 0
+    for line in body_lines(read_lines(stream, chunk_size)):
+        kept += len(line)
+        if kept > max_bytes:
+            logger.warning('Email longer than {a} bytes, the rest was not read'.format(a=max_bytes))
+            break
+        parser.feed(line)
+    parsed_msg = parser.close()
+
+    # not multipart - i.e. plain text, no attachments
+    if not parsed_msg.is_multipart():
+        return parsed_msg.get_payload(decode=True) or b''
+
+    for part in parsed_msg.walk():
+        # skip any text/plain (txt) attachments
+        if part.get_content_type() == 'text/plain' and 'attachment' not in str(part.get('Content-Disposition')):
+            return part.get_payload(decode=True) or b''
+    return b''
+
+
+def parse_level(line):
+    """
+    Reading from an alarm line, it is in the 3rd sentence ('<alarm>. <limit>. <reading>').
+    Parameters:
+        line (str): alert line
+
+    Returns:
+        float: reading, None if not found
+    """
+    sentences = line.split('. ')
+    match = NUMBER.search(sentences[2] if len(sentences) > 2 else sentences[-1])
+    return float(match[0]) if match else None
+
+
+def parse_alerts(body):
+    """
+    Parse all alerts in a Sensaphone email body in one pass.
+    Parameters:
+        body (bytes | str): email body
+
+    Returns:
+        list: Alert for each alert line
+    """
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+
+    alerts = []
+    sentinel = None
+    expect_sentinel = False
+    for line in body.splitlines():
+        line = line.strip()
+        if expect_sentinel:
+            # Well#3 / TreatmentPlant etc
+            sentinel = line
+            expect_sentinel = False
+        # from which Sentinel
+        elif FROM.search(line):
+            expect_sentinel = True
+        # what alerted?
+        elif ALARM.search(line):
+            match = LEVEL_ALARM.search(line)
+            if match:
+                alerts.append(Alert(sentinel, match['zone'].strip(), match['kind'].lower() + '_level',
+                                    parse_level(line), None, line))
+            else:
+                alerts.append(Alert(sentinel, None, 'alarm', parse_level(line), None, line))
+        elif POWER.search(line):
+            if POWER_OFF.search(line):
+                alerts.append(Alert(sentinel, None, 'power', None, False, line))
+            elif POWER_ON.search(line):
+                alerts.append(Alert(sentinel, None, 'power', None, True, line))
+
+    return alerts
+
+
+def is_chlorine_low(alert):
+    """
+    Valid chlorine barrel low alert? Reading must be > 0, if the Sentinel lost power the value will be negative.
+    Parameters:
+        alert (Alert): parsed alert
+
+    Returns:
+        bool: True if the chlorine barrel is low
+    """
+    return (alert.alarm_type == 'low_level' and 'chlorine barrel level' in (alert.zone or '').lower()
+            and alert.level is not None and alert.level > 0)
@@ -0,0 +1,97 @@
+import re
+import logging
+from collections import namedtuple
+from melodywoods import runtime
+from melodywoods import topology
+
+logger = logging.getLogger()
+
+''' Adjustable parameters stored in AWS Systems Manager - Parameter Store
+    https://us-east-1.console.aws.amazon.com/systems-manager/parameters?region=us-east-1
+    All pump timers and 88k tank limits are loaded with one get_parameters call and parsed once.
+'''
+
+# parameter names come from the plant topology (melodywoods.topology)
+PUMP_TIMERS = {p.name: p.timers for p in topology.load().pumps.values() if p.timers}
+TANK_LEVELS = topology.load().pumps['88k'].limits
+PARAMETER_NAMES = [name for timers in PUMP_TIMERS.values() for name in timers] + list(TANK_LEVELS)
+
+TIMER_FORMAT = re.compile(r'^(\d+):(\d+)$')
+
+Timer = namedtuple('Timer', ['hour', 'minute'])
+PumpSchedule = namedtuple('PumpSchedule', ['on', 'off'])
+Config = namedtuple('Config', ['pumps', 'shutoff_level', 'shutoff_noon_level'])
+
+_parsed = {}
+
+
+def parse_timer(param_name, value):
+    """
+    Parse a pump timer parameter 'HH:MM'.
+    Parameters:
+        param_name (str): name of the parameter, for logging
+        value (str): parameter value
+
+    Returns:
+        Timer: hour and minute, None if the value is missing or not a valid time
+    """
+
+    match = TIMER_FORMAT.match(value or '')
+    if match and int(match.group(1)) < 24 and int(match.group(2)) < 60:
+        return Timer(int(match.group(1)), int(match.group(2)))
+    logger.error('Invalid {a} parameter format \n {b}'.format(a=param_name, b=value))
+    return None
+
+
+def parse_level(param_name, value):
+    """
+    Parse a tank level parameter in feet.
+    Parameters:
+        param_name (str): name of the parameter, for logging
+        value (str): parameter value
+
+    Returns:
+        float: level in feet, None if the value is missing or not a number
+    """
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logger.error('Invalid {a} parameter format \n {b}'.format(a=param_name, b=value))
+        return None
+
+
+def parse_config(values):
+    """
+    Build the Config from raw parameter values.
+    Parameters:
+        values (dict): parameter name -> value
+
+    Returns:
+        Config: pump schedules keyed by pump ('well3', 'well5', 'spring') and 88k tank limits
+    """
+
+    pumps = {pump: PumpSchedule(parse_timer(on, values.get(on)), parse_timer(off, values.get(off)))
+             for pump, (on, off) in PUMP_TIMERS.items()}
+    return Config(pumps, parse_level(TANK_LEVELS[0], values.get(TANK_LEVELS[0])),
+                  parse_level(TANK_LEVELS[1], values.get(TANK_LEVELS[1])))
+
+
+def load_config(force=False):
+    """
+    Load all adjustable parameters, values are cached between warm invocations (melodywoods.runtime) and
+    the parsed Config is re-used as long as the values have not changed.
+    Parameters:
+        force (bool): Ignore the cache and get the current values.
+
+    Returns:
+        Config: parsed parameters
+    """
+
+    values = runtime.get_ssm_values(PARAMETER_NAMES, force=force)
+    key = tuple(values.get(name) for name in PARAMETER_NAMES)
+    if key not in _parsed:
+        _parsed.clear()
+        _parsed[key] = parse_config(values)
+        logger.info('Parameters {a}'.format(a=values))
+    return _parsed[key]
@@ -0,0 +1,321 @@
+import logging
+from melodywoods import runtime
+from melodywoods import config
+from melodywoods import parallel
+from melodywoods import schedule
+from melodywoods import resilience
+from melodywoods import verify
+from melodywoods import state
+from melodywoods import topology
+from melodywoods import runlog
+from melodywoods.status import SystemStatus, StatusLookupError
+
+logger = logging.getLogger()
+
+''' Pump control, the decisions of the supply function
+    Shared so a pump change can be run by the supply function (timers, async invoke from email) or in the email
+    function's own run (DISPATCH_MODE=inprocess), with the same session, status download and plant state.
+    run_pumps() downloads the system status once for all the pump events that need it and changes the outputs at
+    the same time.
+    Every pump event run is added to the run log (melodywoods.runlog).
+'''
+
+# reason types of timer events, the pumps with timers in the topology (ex. 'well3')
+TIMER_TYPES = list(config.PUMP_TIMERS)
+
+
+def change_pump(event, device_id, zone_id, power, current_pump_value, requested_pump_value):
+    """
+        Change pump output.
+
+        Parameters:
+            event (dict): Lambda event payload
+            device_id (int): Sentinel Device ID to change output
+            zone_id (int): Output Zone ID to change output
+            power (str): Power On or Off
+            current_pump_value (str): Current output value of Sentinel (on/off)
+            requested_pump_value (str): Requested change of output value based on Lambda cron or email
+
+        Returns:
+            list: status_code (int) - HTTP Status Code,
+                    msg (str) - message of what occurred during the run,
+                    data (dict) - request data from changing Sentinel Output
+        """
+
+    data = None
+    event['pump'] = None
+    if requested_pump_value.lower() == current_pump_value.lower():
+        status_code = 200
+        msg = 'Requested Pump Value Change Not Required, Value Already Set'
+    elif power == "On":
+        if requested_pump_value.lower() == 'on':
+            pump_value = 1
+        else:
+            pump_value = 0
+        from pysensaphone import set_sensaphone
+        try:
+            data = runtime.call_sensaphone(set_sensaphone.change_device_output, device_id, zone_id, pump_value)
+        except resilience.CallError as err:
+            return 503, 'Sensaphone unavailable - ' + str(err), None
+        if data['result']['success']:
+            status_code = 200
+            msg = 'Success'
+            event['pump'] = requested_pump_value
+            if verify.VERIFY:
+                # read the output back, a 504 when the Sentinel hasn't switched it by the deadline
+                data['verify'] = verify.verify_output(device_id, zone_id, pump_value == 1)
+                if not data['verify']['verified']:
+                    status_code = 504
+                    msg = 'Output change not confirmed'
+        else:
+            status_code = data['result']['code']
+            msg = 'Failure'
+    else:
+        # Power is out
+        status_code = 409
+        msg = 'Power is ' + power
+
+    return status_code, msg, data
+
+
+def pump_result(status_code, event, msg, data):
+    """
+    Result of a single pump change request.
+        Parameters:
+            status_code (int): HTTP Status Code from Sentinel Output change
+            event (dict): event details from Lambda cron or email
+            msg (str): message of what occurred during the run
+            data (dict): request data from changing Sentinel Output
+
+        Returns:
+            dict: dictionary of what happened to the pump
+    """
+    if not event['pump']:
+        event['pump'] = 'None'
+
+    return {
+        "statusCode": status_code,
+        "body": {
+            "summary": event['sentinel_name'] + ' - ' + event['pump_name'] + ' Change - ' + event['pump'],
+            "msg": msg,
+            "requested_change": event,
+            "response_data": data
+        },
+    }
+
+
+def requested_change(event, cfg, now):
+    """
+    Pump value a pump event asks for, from its timers / email alarm. Doesn't need the system status.
+        Parameters:
+            event (dict): Lambda event payload for one pump
+            cfg (config.Config): parameters from AWS Systems Manager Parameter Store
+            now (datetime): time to evaluate the schedule at
+
+        Returns:
+            list: requested (str) - 'on' / 'off', None when no change is requested,
+                    status_code (int) - HTTP Status Code when no change is requested,
+                    msg (str) - message when no change is requested
+    """
+
+    if event['reason']['type'].lower() in TIMER_TYPES:
+        reason = event['reason']['type'].lower()
+        pump_schedule = schedule.pump_schedule(*cfg.pumps[reason])
+        if pump_schedule is None:
+            return None, 500, reason + ' - Invalid timer parameters'
+
+        # Timer within the next 15 mins (or last minute) take action.
+        # Runs are scheduled at the timer transitions, the fallback cron runs a transition up to 15 mins early.
+        due = pump_schedule.due(now)
+        if due:
+            return due, None, None
+        else:
+            return None, 200, reason + ' - Not time to change pump output'
+
+    # Pump change based on content of email alert from Sensaphone.
+    elif event['reason']['type'].lower() in ['email_alarm', 'intermittent_pumping']:
+        if event['pump'] == 'on':
+            pump = topology.load().pump_at(event['sentinel_name'], event['pump_name'])
+            # pumps restored on their schedule (ex. Well#3) turn on between their turn on and turn off times
+            if pump is not None and pump.restore == 'schedule':
+                pump_schedule = schedule.pump_schedule(*cfg.pumps[pump.name])
+                if pump_schedule is not None and pump_schedule.state_at(now) == 'on':
+                    return 'on', None, None
+                else:
+                    return None, 200, event['reason']['type'].lower() + ' ' + event['sentinel_name'] \
+                        + ' - Not time to change pump output'
+            # tend to run #5 / Spring 24/7.
+            else:
+                return 'on', None, None
+        elif event['pump'] == 'off':
+            return 'off', None, None
+        else:
+            return None, 400, 'Invalid Pump Value! Check Template Payload'
+    else:
+        return None, 400, 'Invalid \'Reason Type\'! Check Template Payload'
+
+
+def known_result(event, cfg, plant_state, now):
+    """
+    Result of a pump event that doesn't need the system status, no change is requested or the requested value is
+    already the last known value of the output (melodywoods.state).
+        Parameters:
+            event (dict): Lambda event payload for one pump
+            cfg (config.Config): parameters from AWS Systems Manager Parameter Store
+            plant_state (state.PlantState): last known plant state
+            now (datetime): current time
+
+        Returns:
+            list: status_code, msg, data like control_pump(), None if the system status is needed
+    """
+    requested, status_code, msg = requested_change(event, cfg, now)
+    if requested is None:
+        return status_code, msg, None
+    known = plant_state.value(event['sentinel_name'], event['pump_name'], now.timestamp())
+    if known is not None and known.lower() == requested:
+        event['pump'] = None
+        return 200, 'Requested Pump Value Change Not Required, Value Already Set (last known)', None
+    return None
+
+
+def control_pump(event, cfg, status, now=None, plant_state=None):
+    """
+    Evaluate a pump event against its timers / email alarm and change the pump output if needed.
+        Parameters:
+            event (dict): Lambda event payload for one pump
+            cfg (config.Config): parameters from AWS Systems Manager Parameter Store
+            status (SystemStatus): current system status
+            now (datetime): time to evaluate the schedule at, defaults to the current time
+            plant_state (state.PlantState): last known plant state, output changes are recorded in it
+
+        Returns:
+            list: status_code (int) - HTTP Status Code,
+                    msg (str) - message of what occurred during the run,
+                    data (dict) - request data from changing Sentinel Output
+    """
+
+    try:
+        # Sentinel Device Name
+        device = status.device(event['sentinel_name'])
+        # Sentinel Output
+        zone = status.zone(event['sentinel_name'], event['pump_name'])
+    except StatusLookupError as err:
+        event['pump'] = None
+        return 404, str(err), None
+
+    device_id = device['device_id']
+    power = device['power_value']
+    # Output Id
+    zone_id = zone['zone_id']
+    current_pump_value = zone['value']
+
+    if now is None:
+        now = schedule.now()
+    logger.info('Current Pacific Time: {a}'.format(a=now))
+
+    requested, status_code, msg = requested_change(event, cfg, now)
+    if requested is None:
+        return status_code, msg, None
+    status_code, msg, data = change_pump(event, device_id, zone_id, power, current_pump_value, requested)
+    if plant_state is not None and data and data['result']['success']:
+        plant_state.record_command(event['sentinel_name'], event['pump_name'], requested.capitalize(),
+                                   now.timestamp(), confirmed=status_code == 200)
+    return status_code, msg, data
+
+
+def pump_events(event):
+    """
+    Pump events of a Lambda event.
+        Parameters:
+            event (dict): single pump event, batch event {"pumps": [...]} or {"pumps": "timers"} for the pumps
+                run by their timers in the topology (melodywoods.topology)
+
+        Returns:
+            list: pump events
+    """
+    if 'pumps' not in event:
+        return [event]
+    if event['pumps'] == 'timers':
+        return topology.load().timer_events()
+    return event['pumps']
+
+
+def run_pumps(pumps, cfg, now=None, isolate=True):
+    """
+    Evaluate pump events and change the outputs that need it, sharing one system status download and the plant
+    state (melodywoods.state).
+        Parameters:
+            pumps (list): pump events, see pump_events()
+            cfg (config.Config): parameters from AWS Systems Manager Parameter Store
+            now (datetime): current time, defaults to the current time
+            isolate (bool): run the changes on the thread pool (melodywoods.parallel), an exception in one pump is
+                reported as a 500 for that pump. False runs them in order and lets exceptions through.
+
+        Returns:
+            list: outputs (list) - (status_code, msg, data) for each pump event, in the same order,
+                    status (SystemStatus) - system status, empty when it wasn't downloaded
+    """
+    if now is None:
+        now = schedule.now()
+    plant_state = state.load_state()
+
+    # Pumps with nothing to change, or already known to be at the requested value, don't need the system status.
+    outputs = [known_result(p, cfg, plant_state, now) for p in pumps]
+    todo = [i for i, output in enumerate(outputs) if output is None]
+    devices = None
+    if todo:
+        # Get Current System Status, login to sensaphone.net is cached between warm invocations
+        from pysensaphone import get_sensaphone
+        try:
+            devices = runtime.call_sensaphone(get_sensaphone.system_status)
+        except resilience.CallError as err:
+            # sensaphone.net is down, fail fast, the next timer run / fallback cron tries again
+            for i in todo:
+                pumps[i]['pump'] = None
+                outputs[i] = (503, 'Sensaphone unavailable - ' + str(err), None)
+            todo = []
+    status = SystemStatus(devices)
+    if devices is not None:
+        plant_state.update_status(status, now.timestamp())
+
+    # Pumps are independent, their output changes are sent at the same time.
+    if isolate:
+        changes = parallel.run_concurrently([(control_pump, (pumps[i], cfg, status, now, plant_state)) for i in todo])
+        for i, output in zip(todo, changes):
+            if output['error']:
+                pumps[i]['pump'] = None
+                outputs[i] = (500, output['error'], None)
+            else:
+                outputs[i] = output['result']
+    else:
+        for i in todo:
+            outputs[i] = control_pump(pumps[i], cfg, status, now, plant_state)
+    state.save_state(plant_state)
+    runlog.append(run_log_rows(pumps, outputs, plant_state, now))
+    return outputs, status
+
+
+def run_log_rows(pumps, outputs, plant_state, now):
+    """
+        Parameters:
+            pumps (list): pump events of run_pumps()
+            outputs (list): (status_code, msg, data) for each pump event
+            plant_state (state.PlantState): plant state after the changes
+            now (datetime): time of the run
+
+        Returns:
+            list: runlog.append() rows, pumps that aren't in the topology are left out
+    """
+    rows = []
+    for event, (status_code, _, _) in zip(pumps, outputs):
+        pump = topology.load().pump_at(event['sentinel_name'], event['pump_name'])
+        if pump is None:
+            continue
+        reason = event['reason']['type'].lower()
+        if reason in TIMER_TYPES:
+            reason = 'timer'
+        elif reason in ('email_alarm', 'intermittent_pumping'):
+            reason = 'alarm'
+        value = plant_state.value(pump.sentinel, pump.zone, now.timestamp())
+        rows.append((pump.name, now.timestamp(), value, None, status_code, reason))
+    return rows
@@ -0,0 +1,136 @@
+import os
+import time
+import logging
+from melodywoods import runtime
+
+logger = logging.getLogger()
+
+''' Alarm de-duplication
+    Sensaphone repeats the same 'Zone Alarm' email while a condition lasts (ex. power flapping). The first alarm for
+    (sentinel, alarm type, target state) is acted on, repeats inside the window are skipped before any Sensaphone
+    or Lambda calls. When acting on the alarm fails (ex. Sensaphone down) forget() removes the record, so the next
+    repeat is acted on again instead of being skipped.
+    Stores:
+        MemoryStore - module level dict, only shared between warm invocations of the same container (and tests).
+        DynamoDBStore - shared by every container, used when DEDUPE_TABLE is set (see template.yaml).
+'''
+
+DEDUPE_WINDOW = int(os.environ.get('DEDUPE_WINDOW', 900))
+
+
+class MemoryStore:
+    """ In memory store, keys expire after the window. """
+
+    def __init__(self):
+        self.items = {}
+
+    def put_if_absent(self, key, now, expires_at):
+        """
+        Record key unless it is already recorded and not expired.
+        Parameters:
+            key (str): alarm key
+            now (float): current epoch seconds
+            expires_at (float): epoch seconds the record expires
+
+        Returns:
+            bool: True if the key was recorded, False if it already exists
+        """
+        if self.items.get(key, 0) > now:
+            return False
+        self.items[key] = expires_at
+        return True
+
+    def delete(self, key):
+        """ Forget key, it is no longer a repeat. """
+        self.items.pop(key, None)
+
+
+class DynamoDBStore:
+    """ DynamoDB store, table with a string partition key 'pk' and TTL attribute 'expires_at'. """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    def put_if_absent(self, key, now, expires_at):
+        """ See MemoryStore.put_if_absent() """
+        client = runtime.get_client('dynamodb')
+        try:
+            client.put_item(TableName=self.table_name,
+                            Item={'pk': {'S': key}, 'expires_at': {'N': str(int(expires_at))}},
+                            ConditionExpression='attribute_not_exists(pk) OR expires_at <= :now',
+                            ExpressionAttributeValues={':now': {'N': str(int(now))}})
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def delete(self, key):
+        """ See MemoryStore.delete() """
+        runtime.get_client('dynamodb').delete_item(TableName=self.table_name, Key={'pk': {'S': key}})
+
+
+_store = None
+
+
+def get_store():
+    """
+    Returns:
+        MemoryStore | DynamoDBStore: DynamoDBStore if DEDUPE_TABLE is set, the same store is re-used while warm
+    """
+    global _store
+    if _store is None:
+        table_name = os.environ.get('DEDUPE_TABLE')
+        _store = DynamoDBStore(table_name) if table_name else MemoryStore()
+    return _store
+
+
+def alarm_key(sentinel, alarm_type, target_state):
+    """
+    Returns:
+        str: store key of an alarm, ex. 'Well#3|power|off'
+    """
+    return '{a}|{b}|{c}'.format(a=sentinel, b=alarm_type, c=target_state)
+
+
+def first_alarm(sentinel, alarm_type, target_state, store=None, window=DEDUPE_WINDOW, now=None):
+    """
+    Is this the first alarm for (sentinel, alarm type, target state) in the window?
+    Acting on an alarm clears the record for the opposite target state, so off -> on -> off is acted on every time.
+    Parameters:
+        sentinel (str): Sentinel that sent the alarm
+        alarm_type (str): ex. 'chlorine_low', 'power'
+        target_state (str): pump state the alarm asks for, 'on' / 'off'
+        store: MemoryStore or DynamoDBStore, defaults to get_store()
+        window (int): seconds repeats are ignored for
+        now (float): epoch seconds, defaults to the current time
+
+    Returns:
+        bool: True to act on the alarm, False if it is a repeat
+    """
+    if store is None:
+        store = get_store()
+    if now is None:
+        now = time.time()
+    key = alarm_key(sentinel, alarm_type, target_state)
+    if store.put_if_absent(key, now, now + window):
+        opposite = {'on': 'off', 'off': 'on'}.get(target_state)
+        if opposite:
+            store.delete(alarm_key(sentinel, alarm_type, opposite))
+        return True
+    logger.info('Repeat alarm within {a}s, skipping {b}'.format(a=window, b=key))
+    return False
+
+
+def forget(sentinel, alarm_type, target_state, store=None):
+    """
+    Remove the record of an alarm that wasn't acted on successfully, the next repeat is then acted on.
+    Parameters:
+        sentinel (str): Sentinel that sent the alarm
+        alarm_type (str): ex. 'chlorine_low', 'power'
+        target_state (str): pump state the alarm asks for, 'on' / 'off'
+        store: MemoryStore or DynamoDBStore, defaults to get_store()
+    """
+    if store is None:
+        store = get_store()
+    key = alarm_key(sentinel, alarm_type, target_state)
+    logger.warning('Alarm {a} not acted on, forgetting it so a repeat is acted on'.format(a=key))
+    store.delete(key)
@@ -0,0 +1,68 @@
+import os
+import time
+
+''' One deadline for the whole invocation
+    Lambda stops an invocation at its Timeout (60s, see template.yaml). tracing.handler() starts the deadline from
+    context.get_remaining_time_in_millis(), less INVOCATION_MARGIN seconds kept for saving the state, the run log and
+    the result after the pump changes. The limits inside an invocation are nested in it,
+        resilience.call()           - each attempt is cut short at the deadline, no retry once it's used up,
+        verify.verify_output()      - stops polling at the deadline,
+        parallel.run_concurrently() - waits for its calls until the deadline (and RETURN_GRACE for them to return).
+    Without a Lambda context (tests, scripts) there is no deadline, only the limits themselves.
+'''
+
+INVOCATION_MARGIN = float(os.environ.get('INVOCATION_MARGIN', 5))
+
+_deadline = {'at': None}
+
+
+def start(context, margin=INVOCATION_MARGIN):
+    """
+    Start the deadline of an invocation, an invocation inside another one (ex. a simulated lambda invoke) keeps the
+    earlier of the two.
+    Parameters:
+        context: Lambda context, None when there isn't one
+        margin (float): seconds kept after the deadline
+
+    Returns:
+        float: the previous deadline, for end()
+    """
+    previous = _deadline['at']
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        at = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin
+        _deadline['at'] = at if previous is None else min(previous, at)
+    return previous
+
+
+def end(previous=None):
+    """
+    Parameters:
+        previous (float): deadline returned by start()
+    """
+    _deadline['at'] = previous
+
+
+def remaining(limit=None):
+    """
+    Parameters:
+        limit (float): seconds a step would be allowed without the deadline, None for no limit
+
+    Returns:
+        float: seconds the step is allowed, limit capped at what is left of the invocation (0 once it has passed),
+               limit when there is no deadline
+    """
+    if _deadline['at'] is None:
+        return limit
+    left = max(0.0, _deadline['at'] - time.monotonic())
+    return left if limit is None else min(limit, left)
+
+
+def passed(grace=0.0):
+    """
+    Parameters:
+        grace (float): seconds
+
+    Returns:
+        bool: True when the deadline was more than grace seconds ago
+    """
+    return _deadline['at'] is not None and time.monotonic() > _deadline['at'] + grace
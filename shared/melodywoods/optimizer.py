@@ -0,0 +1,175 @@
+import os
+import math
+import datetime
+from array import array
+from collections import namedtuple
+from melodywoods import query
+from melodywoods import tariff
+from melodywoods import topology
+from melodywoods.schedule import PACIFIC
+
+''' Cheapest 88k pump plan for the next PLAN_HOURS hours (melodywoods.tariff prices)
+    The hourly check runs the first hour of the plan and plans again the next hour with the new level.
+    consumption_profile() estimates from the run log (melodywoods.runlog, the last PROFILE_DAYS days)
+        - usage, ft/hour drained for each hour of the day (pump off between two runs),
+        - fill rate, ft/hour the pump adds on top of usage (pump on between two runs),
+    falling back to TANK_USAGE_RATE / TANK_FILL_RATE while there isn't enough history.
+    plan() is a dynamic program over one hour slots and the level in GRID ft steps between TANK_LOW_LEVEL and the
+    shutoff level (a few hundred levels x 2 pump states x 24 slots, milliseconds). It minimizes the energy cost
+    plus a small cost for each pump start, with the level kept within the bounds and back to at least where it
+    started at the end of the plan (so it doesn't save by emptying the tank for tomorrow). Going outside the
+    bounds costs PENALTY $/ft instead of being impossible, there is always a plan even when the bounds can't be met.
+    Turned on with TANK_OPTIMIZER=on, replacing the 9PM / noon / morning rules. The high limit and the predicted
+    shutoff still turn the pump off at the shutoff level.
+'''
+
+TANK_OPTIMIZER = os.environ.get('TANK_OPTIMIZER', 'off').lower() == 'on'
+PLAN_HOURS = int(os.environ.get('TANK_PLAN_HOURS', 24))
+LOW_LEVEL = float(os.environ.get('TANK_LOW_LEVEL', 19.0))
+# ft/hour, used until the run log has enough history
+FILL_RATE = float(os.environ.get('TANK_FILL_RATE', 0.35))
+USAGE_RATE = float(os.environ.get('TANK_USAGE_RATE', 0.12))
+PROFILE_DAYS = int(os.environ.get('TANK_PROFILE_DAYS', 7))
+# $ for each pump start, keeps the pump from switching back and forth between equal prices
+SWITCH_COST = float(os.environ.get('TANK_SWITCH_COST', 0.01))
+GRID = 0.01
+PENALTY = 1000.0
+# steps between runs longer than this aren't used for the profile, seconds
+PROFILE_MAX_STEP = 2 * 3600
+
+Profile = namedtuple('Profile', ['fill_rate', 'usage'])
+Plan = namedtuple('Plan', ['on', 'levels', 'cost'])
+
+
+def consumption_profile(rows, fill_rate=FILL_RATE, usage_rate=USAGE_RATE, max_step=PROFILE_MAX_STEP):
+    """
+    Parameters:
+        rows (query.Rows): run log rows of the 88k pump, with levels
+        fill_rate (float): ft/hour, when there are no pump on steps
+        usage_rate (float): ft/hour, for hours of the day without pump off steps
+        max_step (int): seconds, longer steps between runs are ignored
+
+    Returns:
+        Profile: fill_rate (ft/hour added by the pump), usage (list of ft/hour used for each Pacific hour)
+    """
+    # level change and hours for each hour of the day, pump off / on
+    off = [[0.0, 0.0] for _ in range(24)]
+    on = [[0.0, 0.0] for _ in range(24)]
+    for i in range(len(rows.time) - 1):
+        t, level, state = rows.time[i], rows.level[i], rows.on[i]
+        hours = (rows.time[i + 1] - t) / 3600
+        if state == -1 or math.isnan(level) or math.isnan(rows.level[i + 1]) or not 0 < hours * 3600 <= max_step:
+            continue
+        total = (on if state == 1 else off)[datetime.datetime.fromtimestamp(t, tz=PACIFIC).hour]
+        total[0] += rows.level[i + 1] - level
+        total[1] += hours
+
+    off_hours = sum(h for _, h in off)
+    if off_hours:
+        usage_rate = max(0.0, -sum(d for d, _ in off) / off_hours)
+    usage = [max(0.0, -d / h) if h else usage_rate for d, h in off]
+    on_hours = sum(h for _, h in on)
+    if on_hours:
+        # the level rises by the fill rate less what is used at the time
+        added = sum(d + usage[hour] * h for hour, (d, h) in enumerate(on)) / on_hours
+        if added > 0:
+            fill_rate = added
+    return Profile(fill_rate, usage)
+
+
+def plan(level, start, profile, prices, low, high, kw, pump_on, hours=PLAN_HOURS, grid=GRID,
+         switch_cost=SWITCH_COST):
+    """
+    Parameters:
+        level (float): current level, ft
+        start (datetime): start of the first slot
+        profile (Profile): fill rate and usage
+        prices (tariff.Tariff): $/kWh
+        low (float): lowest level, ft
+        high (float): highest level (shutoff level), ft
+        kw (float): pump power, kW
+        pump_on (bool): the pump is on now
+        hours (int): number of one hour slots
+        grid (float): level step, ft
+        switch_cost (float): $ for each pump start
+
+    Returns:
+        Plan: on (tuple of bool for each slot), levels (level at the end of each slot), cost (energy $)
+    """
+    size = int(round((high - low) / grid)) + 1
+
+    def index(value):
+        return int(round((value - low) / grid))
+
+    slots = [start + datetime.timedelta(hours=s) for s in range(hours)]
+    slot_prices = [prices.price(s) for s in slots]
+    slot_usage = [profile.usage[s.astimezone(PACIFIC).hour] for s in slots]
+
+    # cost[state][level index] of the cheapest way there, state 0 off / 1 on
+    cost = [array('d', [math.inf]) * size for _ in range(2)]
+    cost[1 if pump_on else 0][min(size - 1, max(0, index(level)))] = 0.0
+    back = []
+    for s in range(hours):
+        steps = [index(low + (profile.fill_rate * action - slot_usage[s])) for action in (0, 1)]
+        # between equal prices pump earlier, a missed hourly check later still leaves cheap hours to fill in
+        energy = (0.0, slot_prices[s] * kw * (1 + s * 1e-4))
+        new = [array('d', [math.inf]) * size for _ in range(2)]
+        choice = [array('l', [-1]) * size for _ in range(2)]
+        for state in (0, 1):
+            current = cost[state]
+            for i in range(size):
+                if current[i] == math.inf:
+                    continue
+                for action in (0, 1):
+                    j = i + steps[action]
+                    # outside the bounds, clamp and pay the penalty
+                    penalty = 0.0
+                    if j < 0:
+                        penalty, j = -j * grid * PENALTY, 0
+                    elif j >= size:
+                        penalty, j = (j - size + 1) * grid * PENALTY, size - 1
+                    total = current[i] + energy[action] + penalty + (switch_cost if action > state else 0.0)
+                    if total < new[action][j]:
+                        new[action][j] = total
+                        choice[action][j] = i * 2 + state
+        cost = new
+        back.append(choice)
+
+    # back to at least the starting level at the end
+    target = index(min(max(level, low), high))
+    best = None
+    for state in (0, 1):
+        for j in range(size):
+            if cost[state][j] < math.inf:
+                total = cost[state][j] + max(0, target - j) * grid * PENALTY
+                if best is None or total < best[0]:
+                    best = (total, state, j)
+
+    _, state, j = best
+    on, levels = [], []
+    for s in range(hours - 1, -1, -1):
+        on.append(state == 1)
+        levels.append(round(low + j * grid, 2))
+        previous = back[s][state][j]
+        j, state = previous // 2, previous % 2
+    on.reverse()
+    levels.reverse()
+    return Plan(tuple(on), tuple(levels), round(sum(p * kw for p, o in zip(slot_prices, on) if o), 2))
+
+
+def plan_88k(level, now, pump_on, high, kv=None):
+    """
+    Plan for the 88k tank from its run log, the tariff and the topology.
+    Parameters:
+        level (float): current (smoothed) level, ft
+        now (datetime): current time
+        pump_on (bool): the 88k pump is on now
+        high (float): shutoff level, ft
+        kv: melodywoods.store store, defaults to store.get_store()
+
+    Returns:
+        Plan: see plan()
+    """
+    pump = topology.load().pumps['88k']
+    rows = query.load(pump.name, now - datetime.timedelta(days=PROFILE_DAYS), now, kv)
+    return plan(level, now, consumption_profile(rows), tariff.load(), LOW_LEVEL, high, pump.kw or 1.0, pump_on)
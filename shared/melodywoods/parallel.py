@@ -0,0 +1,76 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from melodywoods import invocation
+
+logger = logging.getLogger()
+
+''' Run independent pump changes at the same time
+    Shutting off every source on a chlorine low alarm should take one Sensaphone/Lambda round trip, not one per pump.
+    Calls run on a small thread pool, each call gets its own timeout counted from when it starts running.
+    A call that times out is reported as an error, the thread is left behind (Python threads can't be killed)
+    and the Lambda response does not wait for it. A pump change left behind could still switch the output after the
+    state is saved, so the timeout is longer than a pump change can take, the Sensaphone call (resilience.CALL_BUDGET)
+    and the read back (verify.VERIFY_DEADLINE). Both stop at the invocation deadline (melodywoods.invocation),
+    calls are waited for until RETURN_GRACE after it.
+'''
+
+MAX_WORKERS = int(os.environ.get('PARALLEL_MAX_WORKERS', 4))
+CALL_TIMEOUT = float(os.environ.get('PARALLEL_CALL_TIMEOUT', 35))
+# seconds after the invocation deadline for calls to return, less than invocation.INVOCATION_MARGIN
+RETURN_GRACE = 1.0
+
+
+def run_concurrently(calls, max_workers=MAX_WORKERS, timeout=CALL_TIMEOUT):
+    """
+    Run calls on a bounded thread pool and collect the results in the same order as calls.
+    Parameters:
+        calls (list): list of (function, args tuple)
+        max_workers (int): max number of calls running at the same time
+        timeout (float): seconds each call is allowed to run, at most until RETURN_GRACE after the invocation
+                         deadline
+
+    Returns:
+        list: dict for each call - result (return value or None), error (str or None), seconds (float)
+    """
+
+    if not calls:
+        return []
+
+    started = {}
+    results = [{'result': None, 'error': None, 'seconds': None} for _ in calls]
+
+    def run(i, func, args):
+        started[i] = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            results[i]['seconds'] = round(time.monotonic() - started[i], 3)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls))))
+    futures = {pool.submit(run, i, func, args): i for i, (func, args) in enumerate(calls)}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i]['result'] = future.result()
+                except Exception as err:
+                    logger.error('Call {a} failed: {b!r}'.format(a=calls[i][0].__name__, b=err))
+                    results[i]['error'] = repr(err)
+
+            now = time.monotonic()
+            for future in list(pending):
+                i = futures[future]
+                if i in started and (now - started[i] > timeout or invocation.passed(RETURN_GRACE)):
+                    logger.error('Call {a} timed out after {b}s'.format(a=calls[i][0].__name__, b=timeout))
+                    results[i]['error'] = 'Timeout after {a}s'.format(a=timeout)
+                    results[i]['seconds'] = round(now - started[i], 3)
+                    pending.discard(future)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return results
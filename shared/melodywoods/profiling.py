@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+''' Profiling mode, to right-size MemorySize and find hot spots
+    With PROFILING=on each invocation (melodywoods.tracing.handler) is run under cProfile and tracemalloc and one
+    compact JSON report is written to sink (default print -> CloudWatch logs),
+        peak_rss_mb       - peak resident memory of the process so far (what MemorySize has to fit, includes the
+                            interpreter, imports and earlier warm invocations)
+        python_peak_kb    - peak of memory allocated by Python during this invocation
+        top_allocations   - PROFILE_TOP lines holding the most memory at the end of the invocation
+        hot_spots         - PROFILE_TOP functions with the most time spent in them (not in what they call)
+    Both profilers slow the invocation down several times, leave it off in normal operation. cProfile, pstats and
+    tracemalloc are only imported when it is on, every handler imports this module (melodywoods.tracing).
+'''
+
+PROFILING = os.environ.get('PROFILING', 'off').lower() == 'on'
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 10))
+
+sink = print
+
+_active = []
+
+
+def peak_rss_mb():
+    """
+    Returns:
+        float: peak resident set size of the process in MB, None where the resource module isn't available
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def short_path(path):
+    """
+    Returns:
+        str: last two parts of a file path, ex. 'melodywoods/control.py'
+    """
+    return '/'.join(path.replace('\\', '/').split('/')[-2:])
+
+
+def top_allocations(snapshot, top=PROFILE_TOP):
+    """
+    Parameters:
+        snapshot (tracemalloc.Snapshot): snapshot at the end of the invocation
+        top (int): number of lines
+
+    Returns:
+        list: 'file:line' with the KB and number of blocks allocated there, largest first
+    """
+    import tracemalloc
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, __file__)])
+    return ['{a}:{b} {c:.1f}KB {d}'.format(a=short_path(stat.traceback[0].filename), b=stat.traceback[0].lineno,
+                                           c=stat.size / 1024, d=stat.count)
+            for stat in snapshot.statistics('lineno')[:top]]
+
+
+def hot_spots(profiler, top=PROFILE_TOP):
+    """
+    Parameters:
+        profiler (cProfile.Profile): profiler of the invocation
+        top (int): number of functions
+
+    Returns:
+        list: 'file:line(function)' with the calls, own time and cumulative time (ms), most own time first
+    """
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return ['{a}:{b}({c}) {d} calls {e:.2f}ms {f:.2f}ms cumulative'.format(
+                a=short_path(filename), b=line, c=name, d=calls, e=own * 1000, f=cumulative * 1000)
+            for (filename, line, name), (_, calls, own, cumulative, _) in ranked]
+
+
+@contextmanager
+def profile(function_name):
+    """
+    Profile a block of code when PROFILING is on, the report is written to sink at the end of the block.
+    Parameters:
+        function_name (str): name in the report
+    """
+    # an invocation inside a profiled one (ex. a simulated lambda invoke) is part of the outer report
+    if not PROFILING or _active:
+        yield
+        return
+    _active.append(function_name)
+    import cProfile
+    import tracemalloc
+
+    # tracemalloc may already be running, ex. python -X tracemalloc, leave it running then
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _active.clear()
+        seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        python_peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        sink(json.dumps({
+            'profile': function_name,
+            'seconds': round(seconds, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'python_peak_kb': round(python_peak / 1024, 1),
+            'top_allocations': top_allocations(snapshot),
+            'hot_spots': hot_spots(profiler)
+        }))
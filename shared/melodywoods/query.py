@@ -0,0 +1,141 @@
+import os
+import math
+import bisect
+import datetime
+from array import array
+from collections import namedtuple
+from melodywoods import runlog
+from melodywoods import tariff
+from melodywoods.schedule import PACIFIC
+
+''' Reports over the run log (melodywoods.runlog), ex. how many hours did well #3 run last month, how often did
+    the 88k noon limit trigger, how much of the 88k pumping was on-peak (melodywoods.tariff periods).
+        rows = query.load('well3', start, end)
+        sum(query.runtime_hours(rows).values())
+    load() joins the day segments into one array per column, the aggregations work over those arrays. The pump is
+    taken to stay as it was after a run until the next run, for at most MAX_GAP seconds (supply runs at least
+    every 6 hours, 88k_tank every hour), a gap in the log doesn't count as running.
+    Run locally against the stored log with STATE_DB (SQLite) or STATE_TABLE (DynamoDB), see melodywoods.store.
+'''
+
+MAX_GAP = int(os.environ.get('QUERY_MAX_GAP', 7 * 3600))
+
+Rows = namedtuple('Rows', ['start', 'end'] + [name for name, _ in runlog.COLUMNS])
+
+
+def load(pump_name, start, end, kv=None):
+    """
+    Parameters:
+        pump_name (str): pump name in the topology, ex. '88k'
+        start (datetime): first time, inclusive
+        end (datetime): last time, exclusive
+        kv: melodywoods.store store, defaults to store.get_store()
+
+    Returns:
+        Rows: start/end epoch seconds and one array per run log column, oldest first
+    """
+    columns = {name: array(code) for name, code in runlog.COLUMNS}
+    for segment in runlog.read(pump_name, start, end, kv):
+        for name, _ in runlog.COLUMNS:
+            columns[name].extend(segment.columns[name])
+    first = bisect.bisect_left(columns['time'], start.timestamp())
+    last = bisect.bisect_left(columns['time'], end.timestamp())
+    return Rows(start.timestamp(), end.timestamp(), **{name: column[first:last] for name, column in columns.items()})
+
+
+def hourly_on_seconds(rows, max_gap=MAX_GAP):
+    """
+    Seconds the pump was on in each hour.
+    Parameters:
+        rows (Rows): load() result
+        max_gap (int): longest time a run's value is carried forward, seconds
+
+    Returns:
+        dict: epoch seconds of the start of the hour -> seconds on
+    """
+    hours = {}
+    times = rows.time
+    ends = list(times[1:]) + [rows.end]
+    for t, next_t, on in zip(times, ends, rows.on):
+        if on != 1:
+            continue
+        stop = min(next_t, t + max_gap, rows.end)
+        # Pacific is a whole number of hours from UTC, hours start on multiples of 3600 in epoch seconds too
+        hour = t - t % 3600
+        while t < stop:
+            piece = min(stop, hour + 3600) - t
+            hours[hour] = hours.get(hour, 0) + piece
+            t += piece
+            hour += 3600
+    return hours
+
+
+def runtime_hours(rows, max_gap=MAX_GAP):
+    """
+    Parameters:
+        rows (Rows): load() result
+        max_gap (int): see hourly_on_seconds()
+
+    Returns:
+        dict: Pacific date -> hours on
+    """
+    days = {}
+    for hour, seconds in hourly_on_seconds(rows, max_gap).items():
+        day = datetime.datetime.fromtimestamp(hour, tz=PACIFIC).date()
+        days[day] = days.get(day, 0) + seconds / 3600
+    return days
+
+
+def energy_kwh(rows, kw, prices=None, max_gap=MAX_GAP):
+    """
+    Parameters:
+        rows (Rows): load() result
+        kw (float): pump power, kW
+        prices (tariff.Tariff): tariff the hours are classified with, defaults to tariff.load()
+        max_gap (int): see hourly_on_seconds()
+
+    Returns:
+        dict: tariff period name (ex. on_peak, off_peak) -> kWh
+    """
+    prices = prices or tariff.load()
+    energy = {name: 0.0 for day in prices.table for name, _ in day}
+    for hour, seconds in hourly_on_seconds(rows, max_gap).items():
+        name, _ = prices.period(datetime.datetime.fromtimestamp(hour, tz=PACIFIC))
+        energy[name] += kw * seconds / 3600
+    return energy
+
+
+def level_curve(rows, step=3600):
+    """
+    Parameters:
+        rows (Rows): load() result
+        step (int): seconds in each point
+
+    Returns:
+        list: (epoch seconds of the start of the step, mean level) for each step with a level reading
+    """
+    sums = {}
+    for t, level in zip(rows.time, rows.level):
+        if not math.isnan(level):
+            total = sums.setdefault(t - t % step, [0.0, 0])
+            total[0] += level
+            total[1] += 1
+    return [(t, total / count) for t, (total, count) in sorted(sums.items())]
+
+
+def reason_counts(rows):
+    """
+    Parameters:
+        rows (Rows): load() result
+
+    Returns:
+        dict: reason (runlog.REASONS) -> number of runs
+    """
+    counts = {}
+    for code in rows.reason:
+        counts[code] = counts.get(code, 0) + 1
+    reasons = {}
+    for code, count in counts.items():
+        reason = runlog.REASONS[code] if code < len(runlog.REASONS) else 'other'
+        reasons[reason] = reasons.get(reason, 0) + count
+    return reasons
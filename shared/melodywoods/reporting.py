@@ -0,0 +1,134 @@
+import os
+import json
+import logging
+from melodywoods import store
+
+logger = logging.getLogger()
+
+''' Result logging to CloudWatch
+    LOG_MODE (environment variable, set per function in template.yaml)
+        verbose - the full result including the complete system status, what the functions always logged.
+        compact - default, a small record of what was decided plus only the system status values that changed
+                  since the function's last run. The full system status is still logged on the first run and every
+                  LOG_SNAPSHOT_EVERY runs so there is a recent complete picture in the logs.
+    The last snapshot and the run count are kept in melodywoods.store (one small JSON item per function), so a cold
+    start compares with the last run of any container instead of logging the full system status again.
+    sink (default print -> CloudWatch logs) can be replaced, ex. to keep simulations quiet.
+'''
+
+LOG_MODE = os.environ.get('LOG_MODE', 'compact').lower()
+LOG_SNAPSHOT_EVERY = int(os.environ.get('LOG_SNAPSHOT_EVERY', 96))
+
+sink = print
+SNAPSHOT_PREFIX = 'reporting/snapshot/'
+
+
+def status_snapshot(devices):
+    """
+    Flatten system status into the values worth comparing between runs.
+    Parameters:
+        devices (list): get_sensaphone.system_status() response
+
+    Returns:
+        dict: 'Sentinel/zone' -> value, plus 'Sentinel/power' and 'Sentinel/online'
+    """
+    snapshot = {}
+    for d in devices or []:
+        snapshot[d['name'] + '/power'] = d.get('power_value')
+        snapshot[d['name'] + '/online'] = d.get('is_online')
+        for z in d['zone']:
+            snapshot[d['name'] + '/' + z['name']] = z['value']
+    return snapshot
+
+
+def status_diff(previous, current):
+    """
+    Parameters:
+        previous (dict): status_snapshot() from the last run
+        current (dict): status_snapshot() from this run
+
+    Returns:
+        dict: key -> [previous value, current value] for every value that changed
+    """
+    return {k: [previous.get(k), current.get(k)] for k in sorted(set(previous) | set(current))
+            if previous.get(k) != current.get(k)}
+
+
+def snapshot_key():
+    """
+    Returns:
+        str: store key of the function's last snapshot, Lambda sets AWS_LAMBDA_FUNCTION_NAME
+    """
+    return SNAPSHOT_PREFIX + os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+
+def load_last(kv):
+    """
+    Parameters:
+        kv: melodywoods.store store
+
+    Returns:
+        dict: snapshot (status_snapshot() of the last run, None if there isn't one) and runs (count)
+    """
+    try:
+        data = kv.get(snapshot_key())
+    except Exception as err:
+        logger.warning('Last system status not read: {a!r}'.format(a=err))
+        data = None
+    if not data:
+        return {'snapshot': None, 'runs': 0}
+    return json.loads(data)
+
+
+def save_last(kv, last):
+    """
+    Parameters:
+        kv: melodywoods.store store
+        last (dict): see load_last()
+    """
+    try:
+        kv.put(snapshot_key(), json.dumps(last, separators=(',', ':')).encode())
+    except Exception as err:
+        # the next run logs the full system status
+        logger.warning('Last system status not saved: {a!r}'.format(a=err))
+
+
+def log_result(result, devices, record, mode=None, kv=None):
+    """
+    Log what happened during the Lambda execution to CloudWatch
+    https://us-east-1.console.aws.amazon.com/cloudwatch/home?region=us-east-1#logsV2:log-groups
+        Parameters:
+            result (dict): full result including the system status, logged as is in verbose mode
+            devices (list): Sentinel data of system status, None when it wasn't downloaded this run
+            record (dict): compact summary of the decision, logged in compact mode
+            mode (str): 'verbose' or 'compact', defaults to LOG_MODE
+            kv: melodywoods.store store, defaults to store.get_store()
+
+        Returns:
+            dict: what was logged
+    """
+    mode = (mode or LOG_MODE).lower()
+    if devices is None:
+        # nothing to compare, keep the last status for the next run
+        sink(json.dumps(result if mode == 'verbose' else record))
+        return result if mode == 'verbose' else record
+
+    kv = kv or store.get_store()
+    snapshot = status_snapshot(devices)
+    last = load_last(kv)
+    previous = last['snapshot']
+    runs = last['runs'] + 1
+    save_last(kv, {'snapshot': snapshot, 'runs': runs})
+
+    if mode == 'verbose':
+        logged = result
+    else:
+        logged = dict(record)
+        if previous is None or (LOG_SNAPSHOT_EVERY and runs % LOG_SNAPSHOT_EVERY == 0):
+            logged['system_status'] = devices
+        else:
+            logged['status_changes'] = status_diff(previous, snapshot)
+
+    # This is to record what happens in CloudWatch logs. For some reason return value is not logged.
+    sink(json.dumps(logged))
+    return logged
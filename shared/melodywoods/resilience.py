@@ -0,0 +1,207 @@
+import os
+import time
+import random
+import logging
+import threading
+from melodywoods import tracing
+from melodywoods import invocation
+
+logger = logging.getLogger()
+
+''' Retries, deadlines and circuit breakers for external calls
+    call() runs a function with
+        - a deadline per attempt, a hung request is given up on instead of burning the Lambda timeout
+          (the call is left running on a daemon thread, Python threads can't be killed, same as melodywoods.parallel),
+        - retries with jittered exponential backoff ("full jitter", a random wait up to base * 2^attempt),
+        - a budget for all attempts and waits together, no retry that can't finish in it, and every attempt cut
+          short at the invocation deadline (melodywoods.invocation),
+        - a circuit breaker per service, after BREAKER_FAILURES failed calls in a row further calls fail at once
+          for BREAKER_RESET seconds, then one trial call (with its retries) decides whether to close it again.
+          A call counts once, however many attempts it took.
+    Breakers are kept at module level, so a warm container remembers that sensaphone.net is down.
+    AWS calls get their deadline and backoff from botocore instead (see runtime.get_client()).
+'''
+
+CALL_DEADLINE = float(os.environ.get('CALL_DEADLINE', 10))
+RETRY_ATTEMPTS = int(os.environ.get('RETRY_ATTEMPTS', 3))
+# seconds for a call with its retries and waits, has to fit in parallel.CALL_TIMEOUT with verify.VERIFY_DEADLINE
+CALL_BUDGET = float(os.environ.get('CALL_BUDGET', 20))
+BACKOFF_BASE = float(os.environ.get('RETRY_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('RETRY_BACKOFF_MAX', 4))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 3))
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 120))
+
+
+class CallError(Exception):
+    """ An external call failed, handlers catch this to fail fast with an error response. """
+
+
+class CallTimeout(CallError):
+    """ An attempt ran past its deadline. """
+
+
+class CircuitOpenError(CallError):
+    """ The service's circuit breaker is open, the call was not made. """
+
+
+class RetriesExhausted(CallError):
+    """ Every attempt failed, the last error is the __cause__. """
+
+
+class CircuitBreaker:
+    """
+    closed - calls are made, open - calls fail at once, half-open - one trial call after reset_timeout.
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns:
+            bool: True if a call may be made now
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half-open'
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info('Circuit {a} closed'.format(a=self.name))
+            self.failures = 0
+            self.state = 'closed'
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half-open' or (self.state == 'closed' and self.failures >= self.max_failures):
+                logger.error('Circuit {a} open after {b} failures, failing fast for {c}s'.format(
+                    a=self.name, b=self.failures, c=self.reset_timeout))
+                self.state = 'open'
+                self.opened_at = time.time()
+
+
+_breakers = {}
+
+
+def breaker(service):
+    """
+    Parameters:
+        service (str): name of the service, ex. 'sensaphone'
+
+    Returns:
+        CircuitBreaker: the service's breaker, created on first use
+    """
+    if service not in _breakers:
+        _breakers[service] = CircuitBreaker(service)
+    return _breakers[service]
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """
+    Parameters:
+        attempt (int): number of attempts already made (1 for the wait before the second attempt)
+        base (float): seconds
+        cap (float): longest wait, seconds
+
+    Returns:
+        float: random wait in seconds, between 0 and min(cap, base * 2^(attempt - 1))
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def run_with_deadline(func, args=(), deadline=CALL_DEADLINE):
+    """
+    Parameters:
+        func (function): function to call
+        args (tuple): arguments for func
+        deadline (float): seconds to wait for func, None to wait as long as it takes
+
+    Returns:
+        return value of func, raises CallTimeout if it is still running at the deadline
+    """
+    if not deadline:
+        return func(*args)
+
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = func(*args)
+        except BaseException as err:
+            outcome['error'] = err
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(deadline)
+    if thread.is_alive():
+        raise CallTimeout('{a} still running after {b}s'.format(a=getattr(func, '__name__', func), b=deadline))
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def call(service, func, *args, name=None, attempts=RETRY_ATTEMPTS, deadline=CALL_DEADLINE, budget=CALL_BUDGET):
+    """
+    Call func with a deadline per attempt, retries with backoff and the service's circuit breaker.
+    Parameters:
+        service (str): circuit breaker name, ex. 'sensaphone'
+        func (function): function to call, any exception it raises is a failed attempt
+        *args: arguments for func
+        name (str): metric name for retries (melodywoods.tracing), defaults to func.__name__
+        attempts (int): max number of attempts
+        deadline (float): seconds allowed per attempt
+        budget (float): seconds allowed for all attempts and the waits between them, None for no limit
+
+    Returns:
+        return value of func, raises CircuitOpenError / RetriesExhausted / CallTimeout (CallError) when it can't
+        be called
+    """
+    name = name or func.__name__
+    circuit = breaker(service)
+    ends = time.time() + budget if budget else None
+
+    def remaining():
+        return invocation.remaining(None if ends is None else max(0.0, ends - time.time()))
+
+    left = remaining()
+    if left is not None and left <= 0:
+        raise CallTimeout('{a} not called, out of time'.format(a=name))
+    if not circuit.allow():
+        raise CircuitOpenError('{a} circuit open, {b} not called'.format(a=service, b=name))
+    for attempt in range(1, attempts + 1):
+        try:
+            if left is not None and left <= 0:
+                raise CallTimeout('{a} out of time before attempt {b}'.format(a=name, b=attempt))
+            result = run_with_deadline(func, args, deadline if left is None else min(deadline or left, left))
+        except Exception as err:
+            logger.warning('{a} attempt {b} of {c} failed: {d!r}'.format(a=name, b=attempt, c=attempts, d=err))
+            wait = backoff(attempt) if attempt < attempts else 0
+            left = remaining()
+            if attempt == attempts or (left is not None and left <= wait):
+                # the call failed, one failure for the breaker however many attempts it took
+                circuit.failure()
+                raise RetriesExhausted('{a} failed after {b} attempts'.format(a=name, b=attempt)) from err
+            tracing.retry(name)
+            time.sleep(wait)
+            left = remaining()
+        else:
+            circuit.success()
+            return result
+
+def clear():
+    """
+    Forget all circuit breakers, used by tests.
+    """
+    _breakers.clear()
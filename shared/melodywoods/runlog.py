@@ -0,0 +1,184 @@
+import os
+import math
+import logging
+import datetime
+from array import array
+from melodywoods import store
+from melodywoods.schedule import PACIFIC
+
+logger = logging.getLogger()
+
+''' Append-only run log, one row per pump per run, for reports (melodywoods.query)
+    Rows are kept in segments, one per pump per Pacific day (key runlog/<pump>/<YYYY-MM-DD>, melodywoods.store).
+    A segment is columnar, each column is an array stored one after the other,
+        time     'd' epoch seconds of the run
+        on       'b' pump output after the run, 1 on, 0 off, -1 unknown
+        level    'f' tank level in feet, NaN when the pump has no level sensor
+        status   'H' statusCode of the run
+        reason   'B' why the run happened, index into REASONS
+    16 bytes a row, a day of 15 minute runs is 1.5 KB, a year of one pump is under 600 KB. A query reads a whole
+    column with one frombytes() and aggregates over the arrays without building a dict per row.
+    Runs of the same pump can append to the same segment at the same time (ex. a supply timer run and an email
+    alarm run both switching well3), so a segment is written with a conditional put on its version
+    (store.put_versioned()) and read again and appended to again if another run wrote it first.
+    RUN_LOG=off turns it off.
+'''
+
+RUN_LOG = os.environ.get('RUN_LOG', 'on').lower() == 'on'
+RUN_LOG_PREFIX = 'runlog/'
+# tries to write a segment when other runs keep writing it first
+RUN_LOG_ATTEMPTS = int(os.environ.get('RUN_LOG_ATTEMPTS', 5))
+
+# only append to this, the index is what is stored
+REASONS = ('other', 'timer', 'alarm', 'event_on', 'event_off', 'high_limit', 'noon_limit', 'morning_fill',
+           'predicted_limit', 'power_out', 'plan')
+
+COLUMNS = (('time', 'd'), ('on', 'b'), ('level', 'f'), ('status', 'H'), ('reason', 'B'))
+ROW_BYTES = sum(array(code).itemsize for _, code in COLUMNS)
+
+
+def reason_code(reason):
+    """
+    Parameters:
+        reason (str): one of REASONS
+
+    Returns:
+        int: index in REASONS, 0 ('other') for anything else
+    """
+    try:
+        return REASONS.index(reason)
+    except ValueError:
+        return 0
+
+
+def on_value(value):
+    """
+    Parameters:
+        value (bool | str): True/False or a zone value, ex. 'On'
+
+    Returns:
+        int: 1 on, 0 off, -1 unknown
+    """
+    if isinstance(value, str):
+        value = {'on': True, 'off': False}.get(value.strip().lower())
+    if value is None:
+        return -1
+    return 1 if value else 0
+
+
+class Segment:
+    """
+    Rows of one pump for one day, oldest first.
+    """
+
+    def __init__(self):
+        self.columns = {name: array(code) for name, code in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def append(self, t, on, level=None, status=200, reason='other'):
+        """
+        Parameters:
+            t (float): epoch seconds of the run
+            on (bool | str): pump output after the run, None if unknown
+            level (float): tank level in feet, None if there isn't one
+            status (int): statusCode of the run
+            reason (str): one of REASONS
+        """
+        self.columns['time'].append(t)
+        self.columns['on'].append(on_value(on))
+        self.columns['level'].append(math.nan if level is None else level)
+        self.columns['status'].append(int(status))
+        self.columns['reason'].append(reason_code(reason))
+
+    def to_bytes(self):
+        return b''.join(self.columns[name].tobytes() for name, _ in COLUMNS)
+
+    @classmethod
+    def from_bytes(cls, data):
+        segment = cls()
+        # ignore anything that isn't whole rows (ex. a different format)
+        if not data or len(data) % ROW_BYTES:
+            return segment
+        rows = len(data) // ROW_BYTES
+        offset = 0
+        for name, _ in COLUMNS:
+            column = segment.columns[name]
+            size = rows * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            offset += size
+        return segment
+
+
+def segment_key(pump_name, t):
+    """
+    Parameters:
+        pump_name (str): pump name in the topology, ex. 'well3'
+        t (float): epoch seconds
+
+    Returns:
+        str: store key of the pump's segment for the Pacific day of t
+    """
+    day = datetime.datetime.fromtimestamp(t, tz=PACIFIC).date()
+    return RUN_LOG_PREFIX + pump_name + '/' + day.isoformat()
+
+
+def append(rows, kv=None, attempts=RUN_LOG_ATTEMPTS):
+    """
+    Append rows to the run log, one read and one conditional write per segment, again if another run wrote the
+    segment in between. A failed write is logged, the run log is never the reason a run fails.
+    Parameters:
+        rows (list): (pump_name, t, on, level, status, reason) tuples, see Segment.append()
+        kv: melodywoods.store store, defaults to store.get_store()
+        attempts (int): tries per segment
+
+    Returns:
+        int: number of rows written
+    """
+    if not RUN_LOG or not rows:
+        return 0
+    kv = kv or store.get_store()
+    segments = {}
+    for pump_name, *row in rows:
+        segments.setdefault(segment_key(pump_name, row[0]), []).append(row)
+    written = 0
+    for key, key_rows in segments.items():
+        try:
+            for _ in range(attempts):
+                data, version = kv.get_versioned(key)
+                segment = Segment.from_bytes(data)
+                for row in key_rows:
+                    segment.append(*row)
+                if kv.put_versioned(key, segment.to_bytes(), version):
+                    written += len(key_rows)
+                    break
+            else:
+                logger.warning('Run log {a} not written, still written by other runs after {b} tries'.format(
+                    a=key, b=attempts))
+        except Exception as err:
+            logger.warning('Run log {a} not written: {b!r}'.format(a=key, b=err))
+    return written
+
+
+def read(pump_name, start, end, kv=None):
+    """
+    Parameters:
+        pump_name (str): pump name in the topology
+        start (datetime): first day to read
+        end (datetime): last day to read (inclusive)
+        kv: melodywoods.store store, defaults to store.get_store()
+
+    Returns:
+        list: Segment for each stored day, oldest first
+    """
+    kv = kv or store.get_store()
+    day = start.astimezone(PACIFIC).date()
+    last = end.astimezone(PACIFIC).date()
+    segments = []
+    while day <= last:
+        data = kv.get(RUN_LOG_PREFIX + pump_name + '/' + day.isoformat())
+        if data:
+            segments.append(Segment.from_bytes(data))
+        day += datetime.timedelta(days=1)
+    return segments
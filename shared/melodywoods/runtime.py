@@ -0,0 +1,200 @@
+import datetime
+import os
+import time
+import threading
+import logging
+from melodywoods import tracing
+from melodywoods import resilience
+
+logger = logging.getLogger()
+
+''' Warm-start cache
+    Anything stored at module level survives between invocations while AWS keeps the Lambda container warm.
+    boto3 clients, the Sensaphone session and SSM parameter values are kept here so a warm run does not pay
+    for a KMS decrypt + Sensaphone login + new clients every 15 mins.
+    Cached values expire after a TTL (seconds, adjustable with environment variables) longer than the time between
+    runs (supply every 15 mins, 88k_tank hourly), so a warm run doesn't login or read SSM again. The Sensaphone
+    session is thrown away and re-created if Sensaphone rejects it, SSM values are read again by a run started by
+    a parameter change (config.load_config(force=True), see the TimerChange rules in template.yaml).
+    Sensaphone calls go through melodywoods.resilience (deadline, retries, circuit breaker), boto3 clients are
+    created with a connect/read timeout and botocore's standard retry mode (jittered exponential backoff).
+    boto3 and pysensaphone are imported on first use, they are slow to import and not every function needs both
+    (ex. email only needs boto3), keeping cold starts short.
+'''
+
+# the session_expiration of the login still ends it earlier (get_session())
+SESSION_TTL = int(os.environ.get('SENSAPHONE_SESSION_TTL', 12 * 3600))
+# same as the supply fallback cron
+SSM_TTL = int(os.environ.get('SSM_CACHE_TTL', 6 * 3600))
+
+_clients = {}
+# boto3.client() is not thread safe, melodywoods.parallel may ask for clients from several threads
+_clients_lock = threading.Lock()
+_session = {'creds': None, 'expires': 0.0}
+_ssm = {}
+
+# statusCode of a request sensaphone.net refused, pysensaphone doesn't pass on its code
+REJECTED_CODE = 422
+
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', 3))
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', 10))
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', 3))
+
+
+class SensaphoneError(resilience.CallError):
+    """ pysensaphone returned no data, ex. the session was rejected or the request failed. """
+
+
+def get_client(service, **kwargs):
+    """
+    Returns a boto3 client, re-using the one created on a previous invocation if the container is warm.
+    Clients time out and retry (with backoff) after AWS_CONNECT_TIMEOUT / AWS_READ_TIMEOUT instead of waiting for
+    the Lambda timeout.
+    Parameters:
+        service (str): AWS service name, ex. 'ssm', 'lambda'
+        **kwargs: extra arguments for boto3.client(), ex. region_name, config
+
+    Returns:
+        botocore.client.BaseClient: boto3 client for the service
+    """
+
+    key = (service, tuple(sorted(kwargs.items())))
+    if key not in _clients:
+        with _clients_lock:
+            if key not in _clients:
+                import boto3
+                from botocore.config import Config
+                kwargs.setdefault('config', Config(connect_timeout=AWS_CONNECT_TIMEOUT,
+                                                   read_timeout=AWS_READ_TIMEOUT,
+                                                   retries={'mode': 'standard', 'max_attempts': AWS_MAX_ATTEMPTS}))
+                _clients[key] = boto3.client(service, **kwargs)
+    return _clients[key]
+
+
+def get_session(force=False):
+    """
+    Sensaphone.net credentials, cached until the TTL or the Sensaphone session expiration (whichever is first).
+    Parameters:
+        force (bool): Ignore the cache and login again.
+
+    Returns:
+        dict: Sensaphone.net credentials (False if login failed)
+    """
+
+    now = time.time()
+    if not force and _session['creds'] and now < _session['expires']:
+        return _session['creds']
+
+    from pysensaphone import sensaphone_auth
+
+    with tracing.span('sensaphone_login'):
+        if force:
+            creds = sensaphone_auth.sensaphone_login()
+        else:
+            creds = sensaphone_auth.check_valid_session()
+
+    if creds:
+        expires = now + SESSION_TTL
+        try:
+            # sensaphone_login() stores the expiration as local time, leave a minute of margin
+            session_expiration = datetime.datetime.strptime(creds['session_expiration'], '%Y-%m-%d %H:%M:%S')
+            expires = min(expires, session_expiration.timestamp() - 60)
+        except (KeyError, TypeError, ValueError):
+            pass
+        _session['creds'] = creds
+        _session['expires'] = expires
+    else:
+        invalidate_session()
+    return creds
+
+
+def invalidate_session():
+    """
+    Drop the cached Sensaphone session, the next get_session() will login again.
+    """
+    _session['creds'] = None
+    _session['expires'] = 0.0
+
+
+def call_sensaphone(func, *args, budget=resilience.CALL_BUDGET):
+    """
+    Call a pysensaphone function with the cached session, with a deadline, retries and the 'sensaphone' circuit
+    breaker (melodywoods.resilience).
+    pysensaphone returns None when the request failed (connection, timeout), read functions then fail with a
+    TypeError reading the response. That, or a failed login, is retried after logging in again.
+    It returns False when sensaphone.net answered but refused the request (ex. the Sentinel rejected an output
+    change), that isn't retried and doesn't count for the breaker, it is returned as a failed result
+    {'result': {'success': False, 'code': REJECTED_CODE}} like any other refused request (the session is renewed
+    before it expires, see get_session(), so it isn't a login problem).
+    Parameters:
+        func (function): pysensaphone function that takes creds as the first argument
+        *args: remaining arguments for func
+        budget (float): seconds for all attempts, see resilience.call()
+
+    Returns:
+        response of func, raises resilience.CallError if sensaphone.net can't be reached
+    """
+
+    login = {'force': False}
+
+    def attempt():
+        creds = get_session(force=login['force'])
+        try:
+            with tracing.span(func.__name__):
+                response = func(creds, *args) if creds else None
+        except TypeError:
+            response = None
+        if response is False:
+            logger.warning('{a} refused by sensaphone.net'.format(a=func.__name__))
+            return {'result': {'success': False, 'code': REJECTED_CODE}}
+        if not response:
+            # request failed or the session was rejected, login again on the next attempt
+            login['force'] = True
+            invalidate_session()
+            raise SensaphoneError('{a} returned no data'.format(a=func.__name__))
+        return response
+
+    return resilience.call('sensaphone', attempt, name=func.__name__, budget=budget)
+
+
+def get_ssm_values(param_names, force=False):
+    """
+    Values of several AWS Systems Manager Parameters, any not already cached are fetched with a single
+    get_parameters call (max 10 names per call).
+    Parameters:
+        param_names (list): names of AWS Systems Manager Parameters to retrieve
+        force (bool): Ignore the cache and get the current values.
+
+    Returns:
+        dict: parameter name -> value, parameters that do not exist are left out
+    """
+
+    now = time.time()
+    values = {}
+    missing = []
+    for name in param_names:
+        cached = _ssm.get(name)
+        if not force and cached and now < cached[1]:
+            values[name] = cached[0]
+        else:
+            missing.append(name)
+
+    for i in range(0, len(missing), 10):
+        with tracing.span('ssm_get_parameters'):
+            response = get_client('ssm').get_parameters(Names=missing[i:i + 10])
+        for parameter in response['Parameters']:
+            values[parameter['Name']] = parameter['Value']
+            _ssm[parameter['Name']] = (parameter['Value'], now + SSM_TTL)
+        if response.get('InvalidParameters'):
+            logger.error('Unknown SSM parameters {a}'.format(a=response['InvalidParameters']))
+
+    return values
+
+
+def clear():
+    """
+    Reset all cached state, used by tests.
+    """
+    _clients.clear()
+    _ssm.clear()
+    invalidate_session()
@@ -0,0 +1,135 @@
+import bisect
+import datetime
+import functools
+import dateutil.tz
+from collections import namedtuple
+
+''' Pump schedule engine
+    On/Off timers (Pacific wall clock, HH:MM) are compiled once into a sorted list of daily transitions.
+    state_at() and next_transition() are a binary search over that list, schedules wrap around midnight
+    (ex. on 20:00 / off 7:00 is on overnight) and follow Pacific daylight saving time.
+    Nothing here reads the clock, the caller passes the time in (now() for the real time), so tests can simulate
+    as many days as they like.
+'''
+
+PACIFIC = dateutil.tz.gettz('US/Pacific')
+
+Transition = namedtuple('Transition', ['minute', 'state'])
+
+
+def now():
+    """
+    Returns:
+        datetime: current Pacific time. AWS Lambda event triggers operate in UTC.
+    """
+    return datetime.datetime.now(tz=PACIFIC)
+
+
+class Schedule:
+    """
+    Daily on/off transitions for a pump.
+    """
+
+    def __init__(self, transitions):
+        """
+        Parameters:
+            transitions (list): (config.Timer, state) pairs, state is 'on' or 'off'.
+                When two transitions are at the same time the last one listed wins,
+                so on and off at the same time means the pump is always in the last state.
+        """
+        if not transitions:
+            raise ValueError('Schedule needs at least one transition')
+        by_minute = {}
+        for timer, state in transitions:
+            by_minute[timer.hour * 60 + timer.minute] = state
+        self.transitions = [Transition(m, by_minute[m]) for m in sorted(by_minute)]
+        self._minutes = [t.minute for t in self.transitions]
+
+    def __repr__(self):
+        return 'Schedule({a})'.format(a=', '.join('{b:02d}:{c:02d} {d}'.format(b=t.minute // 60, c=t.minute % 60,
+                                                                               d=t.state) for t in self.transitions))
+
+    def state_at(self, when):
+        """
+        Parameters:
+            when (datetime): timezone aware time
+
+        Returns:
+            str: 'on' or 'off', the state the pump should be in at that time
+        """
+        local = when.astimezone(PACIFIC)
+        i = bisect.bisect_right(self._minutes, _minute_of_day(local)) - 1
+        # i == -1 before the first transition of the day, wraps to the last transition of the previous day
+        return self.transitions[i].state
+
+    def next_transition(self, when):
+        """
+        Parameters:
+            when (datetime): timezone aware time
+
+        Returns:
+            tuple: (datetime, state) of the first transition after when, datetime is in Pacific time
+        """
+        local = when.astimezone(PACIFIC)
+        day = local.date()
+        i = bisect.bisect_right(self._minutes, _minute_of_day(local))
+        if i == len(self.transitions):
+            i = 0
+            day += datetime.timedelta(days=1)
+        transition = self.transitions[i]
+        return _local_time(day, transition.minute), transition.state
+
+    def due(self, when, before=datetime.timedelta(minutes=15), after=datetime.timedelta(minutes=1)):
+        """
+        Transition that is due to run when polling, the first transition from `after` ago until `before` from now.
+        The supply cron runs every 15 mins so a transition is run up to 15 mins early.
+        Parameters:
+            when (datetime): timezone aware time
+            before (timedelta): how far ahead to look
+            after (timedelta): how far back to look
+
+        Returns:
+            str: 'on' or 'off', None if no transition is due
+        """
+        at, state = self.next_transition(when - after)
+        if at < when + before:
+            return state
+        return None
+
+    def next_due(self, when, before=datetime.timedelta(minutes=15)):
+        """
+        Next transition that due() hasn't already picked up at `when`, the time to run again instead of polling.
+        Parameters:
+            when (datetime): timezone aware time
+            before (timedelta): how far ahead due() looks
+
+        Returns:
+            tuple: (datetime, state) of the transition, datetime is in Pacific time
+        """
+        return self.next_transition(when + before)
+
+
+@functools.lru_cache(maxsize=32)
+def pump_schedule(on, off):
+    """
+    Compiled schedule for a pump with one on and one off timer, cached so it is only built once per timer values.
+    Parameters:
+        on (config.Timer): time to turn the pump on
+        off (config.Timer): time to turn the pump off
+
+    Returns:
+        Schedule: compiled schedule, None if either timer is missing
+    """
+    if on is None or off is None:
+        return None
+    return Schedule([(off, 'off'), (on, 'on')])
+
+
+def _minute_of_day(local):
+    return local.hour * 60 + local.minute + (local.second + local.microsecond / 1e6) / 60
+
+
+def _local_time(day, minute):
+    # times skipped when the clocks go forward (ex. 2:30 AM) move to the first valid time after the gap
+    return dateutil.tz.resolve_imaginary(datetime.datetime(day.year, day.month, day.day, minute // 60, minute % 60,
+                                                           tzinfo=PACIFIC))
@@ -0,0 +1,130 @@
+import os
+import json
+import logging
+from melodywoods import runtime
+
+logger = logging.getLogger()
+
+''' One-shot schedules - invoke a Lambda once at a given time.
+    EventBridgeScheduler - Amazon EventBridge Scheduler 'at()' schedule, deleted after it runs. Used when
+        SCHEDULER_ROLE_ARN is set (role EventBridge Scheduler assumes to invoke the function, see template.yaml).
+    LocalScheduler - keeps the schedules in memory, used locally / by the simulator which runs them with due().
+    Scheduling the same name again replaces the earlier schedule. A run started by a schedule arms the next one
+    under a new name (timed_name(), the time is part of it), EventBridge Scheduler deletes a schedule after it has
+    run and that delete can race with updating the same name (the new arm would be lost or fail). A schedule that
+    is no longer wanted is removed with cancel(), ex. the 88k predicted limit 'off' once a later run decided otherwise
+    (melodywoods.tank.pending_shutoff()).
+'''
+
+TIMEZONE = 'America/Los_Angeles'
+
+
+class LocalScheduler:
+    """ In memory stand-in for EventBridge Scheduler. """
+
+    def __init__(self):
+        self.schedules = {}
+
+    def schedule_once(self, name, at, target_arn, payload):
+        """
+        Parameters:
+            name (str): schedule name
+            at (datetime): timezone aware time to run
+            target_arn (str): Lambda function ARN
+            payload (dict): Lambda event payload
+        """
+        self.schedules[name] = (at, target_arn, payload)
+        logger.info('Scheduled {a} at {b}'.format(a=name, b=at))
+
+    def cancel(self, name):
+        """
+        Parameters:
+            name (str): schedule name
+        """
+        self.schedules.pop(name, None)
+
+    def due(self, now):
+        """
+        Remove and return schedules due at or before now.
+        Parameters:
+            now (datetime): timezone aware time
+
+        Returns:
+            list: (name, at, target_arn, payload) sorted by time
+        """
+        due = sorted(((v[0], k) for k, v in self.schedules.items() if v[0] <= now))
+        return [(k,) + self.schedules.pop(k) for _, k in due]
+
+
+class EventBridgeScheduler:
+    """ Amazon EventBridge Scheduler. """
+
+    def __init__(self, role_arn, group_name='default'):
+        self.role_arn = role_arn
+        self.group_name = group_name
+
+    def schedule_once(self, name, at, target_arn, payload):
+        """ See LocalScheduler.schedule_once() """
+        from melodywoods.schedule import PACIFIC
+        client = runtime.get_client('scheduler')
+        request = {
+            'Name': name,
+            'GroupName': self.group_name,
+            'ScheduleExpression': 'at({a})'.format(a=at.astimezone(PACIFIC).strftime('%Y-%m-%dT%H:%M:%S')),
+            'ScheduleExpressionTimezone': TIMEZONE,
+            'FlexibleTimeWindow': {'Mode': 'OFF'},
+            'ActionAfterCompletion': 'DELETE',
+            'Target': {'Arn': target_arn, 'RoleArn': self.role_arn, 'Input': json.dumps(payload)}
+        }
+        try:
+            client.create_schedule(**request)
+        except client.exceptions.ConflictException:
+            client.update_schedule(**request)
+        logger.info('Scheduled {a} {b}'.format(a=name, b=request['ScheduleExpression']))
+
+    def cancel(self, name):
+        """ See LocalScheduler.cancel() """
+        client = runtime.get_client('scheduler')
+        try:
+            client.delete_schedule(Name=name, GroupName=self.group_name)
+        except client.exceptions.ResourceNotFoundException:
+            pass
+
+
+def timed_name(prefix, at):
+    """
+    Parameters:
+        prefix (str): what the schedule is for, ex. 'supply-timers'
+        at (datetime): timezone aware time to run
+
+    Returns:
+        str: schedule name with the Pacific time of the run, ex. 'supply-timers-20240603T0730'
+    """
+    from melodywoods.schedule import PACIFIC
+    return prefix + '-' + at.astimezone(PACIFIC).strftime('%Y%m%dT%H%M')
+
+
+def function_arn(context):
+    """
+    Parameters:
+        context: Lambda context, None when run locally
+
+    Returns:
+        str: ARN of the running function, the target for schedules that run it again
+    """
+    return context.invoked_function_arn if context else os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """
+    Returns:
+        EventBridgeScheduler | LocalScheduler: EventBridgeScheduler if SCHEDULER_ROLE_ARN is set, re-used while warm
+    """
+    global _scheduler
+    if _scheduler is None:
+        role_arn = os.environ.get('SCHEDULER_ROLE_ARN')
+        _scheduler = EventBridgeScheduler(role_arn) if role_arn else LocalScheduler()
+    return _scheduler
@@ -0,0 +1,147 @@
+import os
+import json
+import logging
+from melodywoods import store
+
+logger = logging.getLogger()
+
+''' Last known plant state, shared between runs and functions (melodywoods.store)
+    For each output zone: the last value seen and when, the last command sent and when. For each Sentinel: the last
+    power value seen and when.
+    Handlers check it before calling Sensaphone
+        - supply skips the system status download when every requested pump value is already known (seen within
+          STATE_FRESHNESS seconds),
+        - 88k_tank doesn't send the same 'off' every hour during a power outage, it is repeated every
+          STATE_COMMAND_FRESHNESS seconds.
+    Kept as one small JSON item, save_state() merges with what is stored so runs of different functions don't
+    undo each other's updates (the newer entry wins). It is written with a conditional put on the item's version
+    (store.put_versioned()), merged again and retried if another run saved in between.
+'''
+
+STATE_FRESHNESS = int(os.environ.get('STATE_FRESHNESS', 900))
+STATE_COMMAND_FRESHNESS = int(os.environ.get('STATE_COMMAND_FRESHNESS', 4 * 3600))
+STATE_KEY = 'plant/state'
+# tries to save when other runs keep saving first
+STATE_SAVE_ATTEMPTS = int(os.environ.get('STATE_SAVE_ATTEMPTS', 5))
+
+
+class PlantState:
+    """
+    Last known output values, commands and Sentinel power.
+    """
+
+    def __init__(self, zones=None, power=None):
+        # 'Sentinel/zone' -> {'value': 'On', 'seen': epoch, 'command': 'Off', 'sent': epoch}
+        self.zones = zones or {}
+        # 'Sentinel' -> {'value': 'On', 'seen': epoch}
+        self.power = power or {}
+        self.changed = False
+
+    def update_status(self, status, now):
+        """
+        Record the output values and power of a system status download.
+        Parameters:
+            status (SystemStatus): system status
+            now (float): epoch seconds
+        """
+        for device in status.devices:
+            self.power[device['name']] = {'value': device.get('power_value'), 'seen': now}
+            for zone in device['zone']:
+                if str(zone['value']).strip().lower() in ('on', 'off'):
+                    entry = self.zones.setdefault(device['name'] + '/' + zone['name'], {})
+                    entry.update({'value': zone['value'], 'seen': now})
+        self.changed = True
+
+    def record_command(self, sentinel_name, zone_name, value, now, confirmed=True):
+        """
+        Record an output change sent to Sensaphone.
+        Parameters:
+            sentinel_name (str): Sentinel Device Name
+            zone_name (str): Zone Name
+            value (str): 'On' or 'Off'
+            now (float): epoch seconds
+            confirmed (bool): Sensaphone accepted it, the value is then the last known value
+        """
+        entry = self.zones.setdefault(sentinel_name + '/' + zone_name, {})
+        entry.update({'command': value, 'sent': now})
+        if confirmed:
+            entry.update({'value': value, 'seen': now})
+        self.changed = True
+
+    def value(self, sentinel_name, zone_name, now, max_age=STATE_FRESHNESS):
+        """
+        Returns:
+            str: last known value of the output, None if it wasn't seen within max_age seconds
+        """
+        entry = self.zones.get(sentinel_name + '/' + zone_name)
+        if entry and 'seen' in entry and now - entry['seen'] < max_age:
+            return entry['value']
+        return None
+
+    def repeated_command(self, sentinel_name, zone_name, value, now, max_age=STATE_COMMAND_FRESHNESS):
+        """
+        Returns:
+            bool: the same command was sent to the output within max_age seconds
+        """
+        entry = self.zones.get(sentinel_name + '/' + zone_name)
+        return bool(entry and entry.get('command', '').lower() == value.lower() and now - entry['sent'] < max_age)
+
+    def merge(self, other):
+        """
+        Keep the newer of each entry from another PlantState.
+        """
+        for key, entry in other.zones.items():
+            mine = self.zones.setdefault(key, {})
+            for value_key, time_key in (('value', 'seen'), ('command', 'sent')):
+                if time_key in entry and entry[time_key] > mine.get(time_key, -1):
+                    mine[value_key] = entry[value_key]
+                    mine[time_key] = entry[time_key]
+        for key, entry in other.power.items():
+            if entry['seen'] > self.power.get(key, {}).get('seen', -1):
+                self.power[key] = entry
+
+    def to_bytes(self):
+        return json.dumps({'zones': self.zones, 'power': self.power}, separators=(',', ':')).encode()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        values = json.loads(data)
+        return cls(values.get('zones'), values.get('power'))
+
+
+def load_state(kv=None):
+    """
+    Parameters:
+        kv: melodywoods.store store, defaults to store.get_store()
+
+    Returns:
+        PlantState: stored state, empty if there isn't one
+    """
+    kv = kv or store.get_store()
+    return PlantState.from_bytes(kv.get(STATE_KEY))
+
+
+def save_state(plant_state, kv=None, attempts=STATE_SAVE_ATTEMPTS):
+    """
+    Merge with the stored state and save, nothing is written if the state didn't change.
+    Parameters:
+        plant_state (PlantState): state to save
+        kv: melodywoods.store store, defaults to store.get_store()
+        attempts (int): tries when another run saved in between
+
+    Returns:
+        bool: True if saved (or nothing to save)
+    """
+    if not plant_state.changed:
+        return True
+    kv = kv or store.get_store()
+    for _ in range(attempts):
+        data, version = kv.get_versioned(STATE_KEY)
+        plant_state.merge(PlantState.from_bytes(data))
+        if kv.put_versioned(STATE_KEY, plant_state.to_bytes(), version):
+            plant_state.changed = False
+            return True
+    logger.warning('Plant state not saved, still saved by other runs after {a} tries'.format(a=attempts))
+    return False
@@ -0,0 +1,98 @@
+import re
+
+''' Index over get_sensaphone.system_status()
+    system_status() returns a list of Sentinels each with a list of zones (sensors/outputs). SystemStatus is built
+    once per fetch so handlers can look up a Sentinel or zone by name instead of looping over every device, and
+    zone values are parsed in one place (ex. '23.1 Ft' -> 23.1, 'On' -> True).
+'''
+
+NUMBER = re.compile(r'^\s*(-?\d+(?:\.\d+)?)')
+
+
+class StatusLookupError(KeyError):
+    """ Sentinel or zone name not found in the system status. """
+
+    def __str__(self):
+        return self.args[0]
+
+
+def parse_value(value):
+    """
+    Parse a Sensaphone zone value.
+    Parameters:
+        value (str): zone value, ex. '23.1 Ft', 'On', 'Off'
+
+    Returns:
+        float | bool | str: number for sensor readings, True/False for On/Off, otherwise the value unchanged
+    """
+
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value.strip().lower() in ('on', 'off'):
+        return value.strip().lower() == 'on'
+    match = NUMBER.match(value)
+    if match:
+        return float(match.group(1))
+    return value
+
+
+class SystemStatus:
+    """
+    Lookup tables for the Sentinels and zones returned by get_sensaphone.system_status().
+    """
+
+    def __init__(self, devices):
+        """
+        Parameters:
+            devices (list): get_sensaphone.system_status() response, None when it wasn't downloaded
+        """
+        self.devices = devices
+        self._devices = {}
+        self._zones = {}
+        for d in devices or []:
+            self._devices[d['name']] = d
+            for z in d['zone']:
+                self._zones[(d['name'], z['name'])] = z
+
+    def device(self, sentinel_name):
+        """
+        Parameters:
+            sentinel_name (str): Sentinel Device Name, ex. 'Well#3'
+
+        Returns:
+            dict: Sentinel from system status
+        """
+        try:
+            return self._devices[sentinel_name]
+        except KeyError:
+            raise StatusLookupError('Sentinel ' + sentinel_name + ' not found in system status') from None
+
+    def zone(self, sentinel_name, zone_name):
+        """
+        Parameters:
+            sentinel_name (str): Sentinel Device Name, ex. 'Well#3'
+            zone_name (str): Zone Name, ex. '#3 Well Pump'
+
+        Returns:
+            dict: zone from system status
+        """
+        try:
+            return self._zones[(sentinel_name, zone_name)]
+        except KeyError:
+            self.device(sentinel_name)
+            raise StatusLookupError('Zone ' + zone_name + ' not found on Sentinel ' + sentinel_name) from None
+
+    def value(self, sentinel_name, zone_name):
+        """
+        Parsed zone value, see parse_value().
+        """
+        return parse_value(self.zone(sentinel_name, zone_name)['value'])
+
+    def power(self, sentinel_name):
+        """
+        Returns:
+            bool: True if the Sentinel reports power is On
+        """
+        return self.device(sentinel_name)['power_value'] == 'On'
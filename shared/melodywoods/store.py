@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import threading
+from melodywoods import runtime
+
+''' Small key/value store for state kept between invocations (ex. 88k tank level history).
+    MemoryStore - module level dict, only survives while the Lambda container is warm (and for tests).
+    DynamoDBStore - used when STATE_TABLE is set (see template.yaml), table with a string partition key 'pk'.
+    SQLiteStore - used when STATE_DB is set to a file path, for running locally (or /tmp in a container).
+    Values are bytes, callers choose their own compact encoding.
+    get_versioned() / put_versioned() are for items several functions append to (ex. melodywoods.runlog), the put
+    only succeeds if nobody wrote the item since it was read, the caller reads again and retries otherwise.
+'''
+
+
+class MemoryStore:
+    """ In memory store. """
+
+    def __init__(self):
+        self.items = {}
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Parameters:
+            key (str): item key
+
+        Returns:
+            bytes: stored value, None if there isn't one
+        """
+        return self.items.get(key)
+
+    def put(self, key, value):
+        """
+        Parameters:
+            key (str): item key
+            value (bytes): value to store
+        """
+        with self._lock:
+            self.items[key] = bytes(value)
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def get_versioned(self, key):
+        """
+        Parameters:
+            key (str): item key
+
+        Returns:
+            tuple: (stored value, version), (None, None) if there isn't one
+        """
+        with self._lock:
+            if key not in self.items:
+                return None, None
+            return self.items[key], self.versions.get(key, 0)
+
+    def put_versioned(self, key, value, version):
+        """
+        Parameters:
+            key (str): item key
+            value (bytes): value to store
+            version (int): version from get_versioned(), None if the item didn't exist
+
+        Returns:
+            bool: True if stored, False if the item was written since it was read
+        """
+        with self._lock:
+            current = self.versions.get(key, 0) if key in self.items else None
+            if current != version:
+                return False
+            self.items[key] = bytes(value)
+            self.versions[key] = (version or 0) + 1
+            return True
+
+
+class DynamoDBStore:
+    """ DynamoDB store, the value is kept in the binary attribute 'value'. """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    def get(self, key):
+        """ See MemoryStore.get() """
+        item = runtime.get_client('dynamodb').get_item(TableName=self.table_name, Key={'pk': {'S': key}},
+                                                       ConsistentRead=True).get('Item')
+        return item['value']['B'] if item else None
+
+    def put(self, key, value):
+        """ See MemoryStore.put() """
+        runtime.get_client('dynamodb').put_item(TableName=self.table_name,
+                                                Item={'pk': {'S': key}, 'value': {'B': bytes(value)}})
+
+    def get_versioned(self, key):
+        """ See MemoryStore.get_versioned() """
+        item = runtime.get_client('dynamodb').get_item(TableName=self.table_name, Key={'pk': {'S': key}},
+                                                       ConsistentRead=True).get('Item')
+        if not item:
+            return None, None
+        return item['value']['B'], int(item.get('version', {}).get('N', 0))
+
+    def put_versioned(self, key, value, version):
+        """ See MemoryStore.put_versioned(), a conditional put on the 'version' attribute """
+        client = runtime.get_client('dynamodb')
+        item = {'pk': {'S': key}, 'value': {'B': bytes(value)}, 'version': {'N': str((version or 0) + 1)}}
+        if version is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(pk)'}
+        elif version == 0:
+            condition = {'ConditionExpression': 'attribute_not_exists(version) OR version = :v',
+                         'ExpressionAttributeValues': {':v': {'N': '0'}}}
+        else:
+            condition = {'ConditionExpression': 'version = :v',
+                         'ExpressionAttributeValues': {':v': {'N': str(version)}}}
+        try:
+            client.put_item(TableName=self.table_name, Item=item, **condition)
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+
+class SQLiteStore:
+    """ SQLite store, one table of key -> blob. """
+
+    def __init__(self, path):
+        self.path = path
+        # one connection shared by melodywoods.parallel threads
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS kv (pk TEXT PRIMARY KEY, value BLOB, version INTEGER)')
+            if 'version' not in [row[1] for row in self._db.execute('PRAGMA table_info(kv)')]:
+                self._db.execute('ALTER TABLE kv ADD COLUMN version INTEGER')
+
+    def get(self, key):
+        """ See MemoryStore.get() """
+        with self._lock:
+            row = self._db.execute('SELECT value FROM kv WHERE pk = ?', (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def put(self, key, value):
+        """ See MemoryStore.put() """
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO kv (pk, value, version) VALUES (?, ?, 1) ON CONFLICT (pk) '
+                             'DO UPDATE SET value = excluded.value, version = IFNULL(version, 0) + 1',
+                             (key, bytes(value)))
+
+    def get_versioned(self, key):
+        """ See MemoryStore.get_versioned() """
+        with self._lock:
+            row = self._db.execute('SELECT value, version FROM kv WHERE pk = ?', (key,)).fetchone()
+        return (bytes(row[0]), row[1] or 0) if row else (None, None)
+
+    def put_versioned(self, key, value, version):
+        """ See MemoryStore.put_versioned() """
+        with self._lock, self._db:
+            if version is None:
+                cursor = self._db.execute('INSERT OR IGNORE INTO kv (pk, value, version) VALUES (?, ?, 1)',
+                                          (key, bytes(value)))
+            else:
+                cursor = self._db.execute('UPDATE kv SET value = ?, version = ? '
+                                          'WHERE pk = ? AND IFNULL(version, 0) = ?',
+                                          (bytes(value), version + 1, key, version))
+        return cursor.rowcount == 1
+
+
+_store = None
+
+
+def get_store():
+    """
+    Returns:
+        MemoryStore | DynamoDBStore | SQLiteStore: DynamoDBStore if STATE_TABLE is set, SQLiteStore if STATE_DB is
+            set, the same store is re-used while warm
+    """
+    global _store
+    if _store is None:
+        if os.environ.get('STATE_TABLE'):
+            _store = DynamoDBStore(os.environ['STATE_TABLE'])
+        elif os.environ.get('STATE_DB'):
+            _store = SQLiteStore(os.environ['STATE_DB'])
+        else:
+            _store = MemoryStore()
+    return _store
@@ -0,0 +1,166 @@
+import os
+from array import array
+from melodywoods import store
+
+''' 88k tank level history
+    The last HISTORY_SIZE level readings (time, level, pump on/off) are kept in a ring buffer that is stored between
+    invocations as a few hundred bytes (melodywoods.store). A least squares line over the recent readings gives
+    the fill rate and a smoothed level, used to
+        - predict when the tank reaches the shutoff level, so the pump is turned off at that time instead of at the
+          next hourly check (less overshoot),
+        - compare the smoothed level with the limits instead of a single noisy reading (less flapping).
+    The high limit (shutoff level) turns the pump off on the raw reading as well, the smoothed level lags behind
+    a tank that is filling faster than the trend.
+'''
+
+HISTORY_SIZE = int(os.environ.get('TANK_HISTORY_SIZE', 48))
+HISTORY_KEY = 'tank88k/level_history'
+# name of the one-shot predicted limit 'off' schedule still to run, see pending_shutoff()
+SHUTOFF_KEY = 'tank88k/predicted_limit'
+# readings older than this are not used for the trend (seconds)
+TREND_WINDOW = int(os.environ.get('TANK_TREND_WINDOW', 3 * 3600))
+
+
+class LevelHistory:
+    """
+    Ring buffer of level readings, oldest first.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        # time (epoch seconds), level (ft), pump (1.0 on / 0.0 off) interleaved
+        self.readings = array('d')
+
+    def __len__(self):
+        return len(self.readings) // 3
+
+    def append(self, t, level, pump_on):
+        """
+        Parameters:
+            t (float): epoch seconds of the reading
+            level (float): 88k level in feet
+            pump_on (bool): 88k pump output was on at the time of the reading
+        """
+        self.readings.extend((t, level, 1.0 if pump_on else 0.0))
+        if len(self) > self.size:
+            del self.readings[:3 * (len(self) - self.size)]
+
+    def recent(self, now, window=TREND_WINDOW):
+        """
+        Readings inside the window with the same pump state as the latest reading (the current fill/drain run).
+        Parameters:
+            now (float): epoch seconds
+            window (int): seconds
+
+        Returns:
+            tuple: (times, levels) lists, oldest first
+        """
+        times, levels = [], []
+        if not len(self):
+            return times, levels
+        pump = self.readings[-1]
+        for i in range(len(self) - 1, -1, -1):
+            t, level, p = self.readings[3 * i:3 * i + 3]
+            if p != pump or now - t > window:
+                break
+            times.append(t)
+            levels.append(level)
+        times.reverse()
+        levels.reverse()
+        return times, levels
+
+    def trend(self, now, window=TREND_WINDOW):
+        """
+        Least squares line over recent().
+        Parameters:
+            now (float): epoch seconds
+            window (int): seconds
+
+        Returns:
+            tuple: (rate ft/hour, smoothed level at now), None if there are less than 2 readings
+        """
+        times, levels = self.recent(now, window)
+        n = len(times)
+        if n < 2:
+            return None
+        # centre the times on now (hours) to keep the sums small
+        xs = [(t - now) / 3600 for t in times]
+        mean_x = sum(xs) / n
+        mean_y = sum(levels) / n
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        if sxx == 0:
+            return None
+        rate = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, levels)) / sxx
+        return rate, mean_y - rate * mean_x
+
+    def seconds_to_level(self, target, now, window=TREND_WINDOW):
+        """
+        Predicted seconds until the level reaches target while filling.
+        Parameters:
+            target (float): level in feet
+            now (float): epoch seconds
+            window (int): seconds
+
+        Returns:
+            float: seconds from now (0 if already there), None if the level is not rising
+        """
+        trend = self.trend(now, window)
+        if trend is None or trend[0] <= 0:
+            return None
+        rate, level = trend
+        return max(0.0, (target - level) / rate * 3600)
+
+    def to_bytes(self):
+        return self.readings.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, size=HISTORY_SIZE):
+        history = cls(size)
+        # ignore anything that isn't whole readings (ex. a different format)
+        if data and len(data) % (3 * history.readings.itemsize) == 0:
+            history.readings.frombytes(data)
+        return history
+
+
+def load_history(kv=None):
+    """
+    Parameters:
+        kv: melodywoods.store store, defaults to store.get_store()
+
+    Returns:
+        LevelHistory: stored history, empty if there isn't one
+    """
+    kv = kv or store.get_store()
+    return LevelHistory.from_bytes(kv.get(HISTORY_KEY))
+
+
+def save_history(history, kv=None):
+    """
+    Parameters:
+        history (LevelHistory): history to store
+        kv: melodywoods.store store, defaults to store.get_store()
+    """
+    kv = kv or store.get_store()
+    kv.put(HISTORY_KEY, history.to_bytes())
+
+
+def pending_shutoff(kv=None):
+    """
+    Parameters:
+        kv: melodywoods.store store, defaults to store.get_store()
+
+    Returns:
+        str: name of the predicted limit schedule armed by an earlier run, None if there isn't one
+    """
+    kv = kv or store.get_store()
+    return (kv.get(SHUTOFF_KEY) or b'').decode() or None
+
+
+def save_pending_shutoff(name, kv=None):
+    """
+    Parameters:
+        name (str): schedule name, None when nothing is armed
+        kv: melodywoods.store store, defaults to store.get_store()
+    """
+    kv = kv or store.get_store()
+    kv.put(SHUTOFF_KEY, (name or '').encode())
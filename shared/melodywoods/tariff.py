@@ -0,0 +1,67 @@
+import os
+import json
+import functools
+from melodywoods.schedule import PACIFIC
+
+''' Time-of-use electricity tariff, the $/kWh for each hour (Pacific)
+    Declared in tariff.json (or the file in TARIFF_FILE) as periods,
+        {"name": "on_peak", "start": 12, "end": 21, "price": 0.36, "days": [0, 1, 2, 3, 4]}
+    start is inclusive, end exclusive, a period can wrap past midnight (start 21, end 12), days (Monday is 0)
+    defaults to every day. The first period matching an hour wins. Compiled once into a table of 7 x 24 periods.
+'''
+
+TARIFF_FILE = os.environ.get('TARIFF_FILE', os.path.join(os.path.dirname(__file__), 'tariff.json'))
+
+
+class Tariff:
+    """
+    Price lookup by hour.
+    """
+
+    def __init__(self, declaration):
+        """
+        Parameters:
+            declaration (dict): {"periods": [{"name", "start", "end", "price", "days"}]}
+        """
+        self.table = [[None] * 24 for _ in range(7)]
+        for period in declaration['periods']:
+            end = period['end'] if period['end'] > period['start'] else period['end'] + 24
+            hours = [h % 24 for h in range(period['start'], end)]
+            for day in period.get('days', range(7)):
+                for hour in hours:
+                    if self.table[day][hour] is None:
+                        self.table[day][hour] = (period['name'], period['price'])
+        missing = [(d, h) for d in range(7) for h in range(24) if self.table[d][h] is None]
+        if missing:
+            raise ValueError('Tariff has no price for (weekday, hour) {a}'.format(a=missing[:3]))
+
+    def period(self, when):
+        """
+        Parameters:
+            when (datetime): time, converted to Pacific
+
+        Returns:
+            tuple: (period name, $/kWh) of the hour
+        """
+        local = when.astimezone(PACIFIC)
+        return self.table[local.weekday()][local.hour]
+
+    def price(self, when):
+        """
+        Returns:
+            float: $/kWh at when
+        """
+        return self.period(when)[1]
+
+
+@functools.lru_cache(maxsize=4)
+def load(path=None):
+    """
+    Parameters:
+        path (str): tariff JSON file, defaults to TARIFF_FILE
+
+    Returns:
+        Tariff: compiled tariff, loaded once per file
+    """
+    with open(path or TARIFF_FILE) as fp:
+        return Tariff(json.load(fp))
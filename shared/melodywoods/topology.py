@@ -0,0 +1,108 @@
+import os
+import json
+import functools
+from collections import namedtuple
+
+''' Plant topology - which Sentinel and zone each pump is on and which pumps an alarm acts on.
+    Declared in topology.json (or the file in TOPOLOGY_FILE) and compiled once per container into lookup tables,
+        pumps      - pump name -> Pump
+        zones      - (Sentinel, zone) -> Pump
+        fanout     - (Sentinel, alarm type) -> pumps to change, ex. a TreatmentPlant chlorine low alarm shuts off every
+                     source ("role:source" in a dependency means every enabled pump with that role)
+        timer_pumps - enabled pumps run by their on/off timers ("scheduled"), the supply {"pumps": "timers"} batch
+    Bringing a pump back (ex. well #5) is "enabled" (alarms act on it) and "scheduled" (timers run it) in
+    topology.json, no code changes.
+'''
+
+TOPOLOGY_FILE = os.environ.get('TOPOLOGY_FILE', os.path.join(os.path.dirname(__file__), 'topology.json'))
+
+Pump = namedtuple('Pump', ['name', 'sentinel', 'zone', 'role', 'timers', 'scheduled', 'restore', 'level', 'limits',
+                           'enabled', 'kw'])
+
+
+class Topology:
+    """
+    Lookup tables over a topology declaration.
+    """
+
+    def __init__(self, declaration):
+        """
+        Parameters:
+            declaration (dict): {"pumps": {name: {...}}, "dependencies": [{"sentinel", "alarms", "pumps"}]}
+        """
+        self.pumps = {}
+        for name, p in declaration['pumps'].items():
+            self.pumps[name] = Pump(name, p['sentinel'], p['zone'], p.get('role'),
+                                    tuple(p['timers']) if p.get('timers') else None, p.get('scheduled', False),
+                                    p.get('restore', 'always'),
+                                    tuple(p['level']) if p.get('level') else None,
+                                    tuple(p['limits']) if p.get('limits') else None, p.get('enabled', True),
+                                    p.get('kw'))
+        self.zones = {(p.sentinel, p.zone): p for p in self.pumps.values()}
+        self.timer_pumps = [p for p in self.pumps.values() if p.timers and p.scheduled and p.enabled]
+
+        self.fanout = {}
+        for dependency in declaration.get('dependencies', []):
+            targets = []
+            for target in dependency['pumps']:
+                if target.startswith('role:'):
+                    targets += [p for p in self.pumps.values() if p.role == target[len('role:'):]]
+                else:
+                    targets.append(self.pumps[target])
+            targets = tuple(p for p in targets if p.enabled)
+            for alarm in dependency['alarms']:
+                self.fanout[(dependency['sentinel'], alarm)] = targets
+
+    def pumps_for_alarm(self, sentinel_name, alarm_type):
+        """
+        Parameters:
+            sentinel_name (str): Sentinel the alarm is from
+            alarm_type (str): ex. 'chlorine_low', 'power'
+
+        Returns:
+            tuple: Pumps to change, None if the Sentinel/alarm isn't mapped
+        """
+        return self.fanout.get((sentinel_name, alarm_type))
+
+    def pump_at(self, sentinel_name, zone_name):
+        """
+        Returns:
+            Pump: pump on the Sentinel's zone, None if it isn't in the topology
+        """
+        return self.zones.get((sentinel_name, zone_name))
+
+    def pump_event(self, pump, value, reason_type):
+        """
+        Supply lambda event for one pump.
+        Parameters:
+            pump (Pump): pump to change
+            value (str): 'on', 'off' or '' (timers decide)
+            reason_type (str): ex. 'email_alarm', 'well3'
+
+        Returns:
+            dict: supply event
+        """
+        reason = {"type": reason_type}
+        if reason_type == 'email_alarm':
+            reason['value'] = True
+        return {"sentinel_name": pump.sentinel, "pump_name": pump.zone, "pump": value, "reason": reason}
+
+    def timer_events(self):
+        """
+        Returns:
+            list: supply batch events for the timer_pumps
+        """
+        return [self.pump_event(p, '', p.name) for p in self.timer_pumps]
+
+
+@functools.lru_cache(maxsize=4)
+def load(path=None):
+    """
+    Parameters:
+        path (str): topology JSON file, defaults to TOPOLOGY_FILE
+
+    Returns:
+        Topology: compiled topology, loaded once per file
+    """
+    with open(path or TOPOLOGY_FILE) as fp:
+        return Topology(json.load(fp))
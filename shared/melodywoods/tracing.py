@@ -0,0 +1,138 @@
+import os
+import time
+import json
+import functools
+import threading
+from contextlib import contextmanager
+from melodywoods import profiling
+from melodywoods import invocation
+
+''' Timing of external calls
+    Each call to Sensaphone / AWS is wrapped in a span, at the end of the invocation the durations (and retry counts)
+    are written as one CloudWatch Embedded Metric Format (EMF) record. CloudWatch turns the record into metrics,
+    no PutMetricData calls needed.
+    https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    Set TRACING=off to turn it off. sink (default print -> CloudWatch logs) can be replaced, ex. list.append in tests.
+'''
+
+NAMESPACE = os.environ.get('TRACING_NAMESPACE', 'MelodyWoodsWater')
+TRACING = os.environ.get('TRACING', 'on').lower() != 'off'
+
+sink = print
+
+_lock = threading.Lock()
+_trace = {'spans': {}, 'retries': {}}
+
+
+@contextmanager
+def span(name):
+    """
+    Time a block of code, ex.
+        with tracing.span('system_status'):
+            devices = get_sensaphone.system_status(creds)
+    Parameters:
+        name (str): metric name for the call
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        with _lock:
+            _trace['spans'].setdefault(name, []).append(round(elapsed, 2))
+
+
+def retry(name):
+    """
+    Count a retry of a call.
+    Parameters:
+        name (str): metric name for the call
+    """
+    with _lock:
+        _trace['retries'][name] = _trace['retries'].get(name, 0) + 1
+
+
+def spans():
+    """
+    Returns:
+        dict: name -> list of durations (ms) recorded so far in this invocation
+    """
+    with _lock:
+        return {k: list(v) for k, v in _trace['spans'].items()}
+
+
+def reset():
+    """
+    Forget recorded spans, called at the start of each invocation.
+    """
+    with _lock:
+        _trace['spans'] = {}
+        _trace['retries'] = {}
+
+
+def emf_record(function_name, total_ms=None):
+    """
+    Build the EMF record for the spans recorded in this invocation.
+    Parameters:
+        function_name (str): value of the Function dimension
+        total_ms (float): duration of the whole invocation
+
+    Returns:
+        dict: EMF record
+    """
+    with _lock:
+        span_values = {k: list(v) for k, v in _trace['spans'].items()}
+        retries = dict(_trace['retries'])
+
+    metrics = [{'Name': name, 'Unit': 'Milliseconds'} for name in span_values]
+    metrics += [{'Name': name + '_retries', 'Unit': 'Count'} for name in retries]
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [['Function']], 'Metrics': metrics}]
+        },
+        'Function': function_name
+    }
+    record.update(span_values)
+    record.update({name + '_retries': count for name, count in retries.items()})
+    if total_ms is not None:
+        metrics.append({'Name': 'invocation', 'Unit': 'Milliseconds'})
+        record['invocation'] = round(total_ms, 2)
+    return record
+
+
+def flush(function_name, total_ms=None):
+    """
+    Write the EMF record to the sink and reset.
+    Parameters:
+        function_name (str): value of the Function dimension
+        total_ms (float): duration of the whole invocation
+    """
+    record = emf_record(function_name, total_ms)
+    reset()
+    if TRACING:
+        sink(json.dumps(record))
+
+
+def handler(function_name):
+    """
+    Decorator for a lambda_handler, resets the spans at the start and flushes them at the end of each invocation.
+    The invocation deadline is started from the Lambda context (melodywoods.invocation). The invocation is profiled
+    when PROFILING is on (melodywoods.profiling).
+    Parameters:
+        function_name (str): value of the Function dimension
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(event, context):
+            reset()
+            start = time.perf_counter()
+            previous = invocation.start(context)
+            try:
+                with profiling.profile(function_name):
+                    return func(event, context)
+            finally:
+                invocation.end(previous)
+                flush(function_name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
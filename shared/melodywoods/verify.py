@@ -0,0 +1,87 @@
+import os
+import time
+import logging
+from melodywoods import runtime
+from melodywoods import tracing
+from melodywoods import resilience
+from melodywoods import invocation
+from melodywoods.status import parse_value
+
+logger = logging.getLogger()
+
+''' Read-after-write check of a pump output
+    change_device_output() only says Sensaphone accepted the request, not that the Sentinel switched the output.
+    verify_output() reads back just that zone (device_zone_info, not the whole system_status) until it shows the
+    requested value or the deadline passes (at the latest the invocation deadline). The wait between reads doubles (VERIFY_FIRST_WAIT up to
+    VERIFY_MAX_WAIT), a quick Sentinel is confirmed with one or two reads and a slow one isn't polled hard.
+    Turned on with VERIFY_OUTPUT=on (see template.yaml).
+'''
+
+VERIFY = os.environ.get('VERIFY_OUTPUT', 'off').lower() == 'on'
+VERIFY_DEADLINE = float(os.environ.get('VERIFY_DEADLINE', 12))
+VERIFY_FIRST_WAIT = float(os.environ.get('VERIFY_FIRST_WAIT', 1))
+VERIFY_MAX_WAIT = float(os.environ.get('VERIFY_MAX_WAIT', 5))
+
+
+def zone_from_info(response, zone_id):
+    """
+    Parameters:
+        response (dict): get_sensaphone.device_zone_info() response
+        zone_id (int): Output Zone ID
+
+    Returns:
+        dict: the zone, same as a zone in system_status(), None if it isn't in the response
+    """
+    for device in (response.get('response') or {}).get('device') or []:
+        for zone in device.get('zone') or []:
+            if zone.get('zone_id') == zone_id:
+                return zone
+    return None
+
+
+def verify_output(device_id, zone_id, expected, deadline=VERIFY_DEADLINE, first_wait=VERIFY_FIRST_WAIT,
+                  max_wait=VERIFY_MAX_WAIT):
+    """
+    Poll an output zone until it shows the expected value.
+    Parameters:
+        device_id (int): Sentinel Device ID
+        zone_id (int): Output Zone ID
+        expected (bool): True for On, False for Off
+        deadline (float): seconds to keep polling, reads included
+        first_wait (float): seconds before the first read
+        max_wait (float): longest wait between reads
+
+    Returns:
+        dict: verified (bool), seconds (actuation latency, or time spent when not verified), polls (int),
+              value (last value read)
+    """
+    from pysensaphone import get_sensaphone
+
+    started = time.time()
+    deadline = invocation.remaining(deadline)
+    wait = first_wait
+    polls = 0
+    value = None
+    with tracing.span('verify_output'):
+        while True:
+            elapsed = time.time() - started
+            if elapsed + wait > deadline:
+                break
+            time.sleep(wait)
+            polls += 1
+            try:
+                response = runtime.call_sensaphone(get_sensaphone.device_zone_info, device_id, zone_id,
+                                                   budget=deadline - (time.time() - started))
+            except resilience.CallError as err:
+                logger.warning('Output read back failed: {a}'.format(a=err))
+                break
+            zone = zone_from_info(response, zone_id)
+            value = zone['value'] if zone else None
+            if parse_value(value) is expected:
+                return {'verified': True, 'seconds': round(time.time() - started, 3), 'polls': polls,
+                        'value': value}
+            wait = min(wait * 2, max_wait)
+
+    logger.error('Output {a}/{b} not {c} after {d}s'.format(a=device_id, b=zone_id, c='On' if expected else 'Off',
+                                                             d=round(time.time() - started, 3)))
+    return {'verified': False, 'seconds': round(time.time() - started, 3), 'polls': polls, 'value': value}
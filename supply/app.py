@@ -1,11 +1,12 @@
-from pysensaphone import sensaphone_auth
-from pysensaphone import get_sensaphone
-from pysensaphone import set_sensaphone
-import json
-import datetime
-import dateutil.tz
-import re
-import boto3
+from melodywoods import config
+from melodywoods import control
+from melodywoods import schedule
+from melodywoods import reporting
+from melodywoods import tracing
+from melodywoods import scheduler
+from melodywoods.status import StatusLookupError
+import copy
+import time
 import logging
 
 # quiet boto3 message, "Found credentials in environment variables."
@@ -16,106 +17,37 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def get_ssm_param(param_name):
+def pump_record(result, status):
     """
-    Retrieve adjustable parameters for Well ON/OFF times which are stored in AWS Systems Manager - Parameter Store
-    https://us-east-1.console.aws.amazon.com/systems-manager/parameters?region=us-east-1
-
-    Parameters:
-        param_name (str): name of AWS Systems Manager Parameter to retrieve
-
-    Returns:
-        str: Returning value of AWS Systems Manager Parameter
-    """
-
-    ssm = boto3.client('ssm')
-    parameter = ssm.get_parameter(Name=param_name)
-    param = parameter['Parameter']['Value']
-
-    # Check that parameter format is 'HH:MM'
-    if re.match(r'^\d+\:\d+$', param):
-        logger.info('{a} {b}'.format(a=param_name, b=parameter))
-    else:
-        logger.error('Invalid {a} parameter format \n {b}'.format(a=param, b=parameter))
-        param = None
-
-    return param
-
-
-def timer_offset(timer):
-    """
-    Takes pump timer (HH:MM) and returns the minutes until timer from current time.
-    Parameters:
-        timer (str): Time in HH:MM for the pump change.
-
-    Returns:
-        float: Minutes until or since the timer from current time.
-    """
-
-    # Get current Pacific time. AWS Lambda event triggers operate in UTC.
-    pacific = dateutil.tz.gettz('US/Pacific')
-    current_pacific_time = datetime.datetime.now(tz=pacific)
-
-    timestamp = current_pacific_time.replace(hour=int(timer.split(":")[0]),
-                                             minute=int(timer.split(":")[1]),
-                                             second=0, microsecond=0)
-
-    # Difference in between timer and current time
-    timer_minutes = (timestamp - current_pacific_time).total_seconds() / 60
-
-    logger.info('Current Pacific Time: {a} \n Timer Change Timestamp: {b}'.format(a=current_pacific_time
-                                                                                  , b=timestamp))
-    logger.info('Minutes until Change: {a:.2f}'.format(a=timer_minutes))
-
-    return timer_minutes
-
+    Compact summary of a pump_result() for logging (melodywoods.reporting).
+        Parameters:
+            result (dict): control.pump_result()
+            status (SystemStatus): system status the decision was made with
 
-def change_pump(event, creds, device_id, zone_id, power, current_pump_value, requested_pump_value):
+        Returns:
+            dict: decision, pump value before/after, the Sensaphone result code and read back (verify) result
     """
-        Change pump output.
+    body = result['body']
+    event = body['requested_change']
+    response = (body['response_data'] or {}).get('result')
+    try:
+        before = status.zone(event['sentinel_name'], event['pump_name'])['value']
+    except StatusLookupError:
+        before = None
+
+    return {
+        "statusCode": result['statusCode'],
+        "summary": body['summary'],
+        "msg": body['msg'],
+        "reason": event['reason'].get('type'),
+        "before": before,
+        "after": event['pump'] if response and response.get('success') else before,
+        "response": response,
+        "verify": (body['response_data'] or {}).get('verify')
+    }
 
-        Parameters:
-            event (dict): Lambda event payload
-            creds (dict): Sensaphone.net credentials
-            device_id (int): Sentinel Device ID to change output
-            zone_id (int): Output Zone ID to change output
-            power (str): Power On or Off
-            current_pump_value (str): Current output value of Sentinel (on/off)
-            requested_pump_value (str): Requested change of output value based on Lambda cron or email
 
-        Returns:
-            list: status_code (int) - HTTP Status Code,
-                    msg (str) - message of what occurred during the run,
-                    data (dict) - request data from changing Sentinel Output
-        """
-
-    data = None
-    event['pump'] = None
-    if requested_pump_value.lower() == current_pump_value.lower():
-        status_code = 200
-        msg = 'Requested Pump Value Change Not Required, Value Already Set'
-    elif power == "On":
-        if requested_pump_value.lower() == 'on':
-            pump_value = 1
-        else:
-            pump_value = 0
-        data = set_sensaphone.change_device_output(creds, device_id, zone_id, pump_value)
-        if data['result']['success']:
-            status_code = 200
-            msg = 'Success'
-            event['pump'] = requested_pump_value
-        else:
-            status_code = data['result']['code']
-            msg = 'Failure'
-    else:
-        # Power is out
-        status_code = 409
-        msg = 'Power is ' + power
-
-    return status_code, msg, data
-
-
-def log_result(status_code, event, msg, data, devices):
+def log_result(status_code, event, msg, data, status, seconds):
     """
     Log what happened during the Lambda execution to CloudWatch
     https://us-east-1.console.aws.amazon.com/cloudwatch/home?region=us-east-1#logsV2:log-groups
@@ -124,100 +56,107 @@ def log_result(status_code, event, msg, data, devices):
             event (dict): event details from Lambda cron or email
             msg (str): message of what occurred during the run
             data (dict): request data from changing Sentinel Output
-            devices (dict): Sentinel data of system status
+            status (SystemStatus): Sentinel data of system status
+            seconds (float): run duration
 
         Returns:
             dict: dictionary of what happened during the Lambda execution
     """
-    if not event['pump']:
-        event['pump'] = 'None'
+    result = control.pump_result(status_code, event, msg, data)
+    result['body']['system_status'] = status.devices
+
+    record = pump_record(result, status)
+    record['seconds'] = round(seconds, 3)
+    reporting.log_result(result, status.devices, record)
+    return result
+
+
+def log_batch_result(results, status, seconds):
+    """
+    Log the results of a batch run (several pumps, one system status) to CloudWatch
+        Parameters:
+            results (list): control.pump_result() for each pump in the batch
+            status (SystemStatus): Sentinel data of system status
+            seconds (float): run duration
 
+        Returns:
+            dict: dictionary of what happened during the Lambda execution
+    """
     result = {
-        "statusCode": status_code,
+        # 207 Multi-Status when any pump did not succeed
+        "statusCode": 200 if all(r['statusCode'] == 200 for r in results) else 207,
         "body": {
-            "summary": event['sentinel_name'] + ' - ' + event['pump_name'] + ' Change - ' + event['pump'],
-            "msg": msg,
-            "requested_change": event,
-            "response_data": data,
-            "system_status": devices
+            "results": results,
+            "system_status": status.devices
         },
     }
-    # This is to record what happens in CloudWatch logs.
-    print(json.dumps(result))
+
+    record = {"statusCode": result['statusCode'], "results": [pump_record(r, status) for r in results],
+              "seconds": round(seconds, 3)}
+    reporting.log_result(result, status.devices, record)
     return result
 
 
+def arm_next_run(event, cfg, context, now=None):
+    """
+    Schedule the event to run again at the next timer transition of its pumps (one-shot schedule, see
+    melodywoods.scheduler) instead of polling every 15 mins. Called on every timer run so the schedule follows
+    parameter changes.
+        Parameters:
+            event (dict): Lambda event payload, single pump or batch
+            cfg (config.Config): parameters from AWS Systems Manager Parameter Store
+            context: Lambda context
+            now (datetime): current time, defaults to the current time
+
+        Returns:
+            datetime: time of the next run, None if the event has no pump timers
+    """
+    if now is None:
+        now = schedule.now()
+    pumps = control.pump_events(event)
+    times = []
+    for pump in pumps:
+        reason = pump.get('reason', {}).get('type', '').lower()
+        if reason in control.TIMER_TYPES:
+            pump_schedule = schedule.pump_schedule(*cfg.pumps[reason])
+            if pump_schedule is not None:
+                times.append(pump_schedule.next_due(now)[0])
+    if not times:
+        return None
+
+    prefix = 'supply-timers' if 'pumps' in event else 'supply-' + pumps[0]['reason']['type'].lower()
+    at = min(times)
+    # the next run reads the parameters from the cache again
+    payload = {k: v for k, v in event.items() if k != 'refresh'}
+    # a new name for each transition, the schedule that started this run is being deleted by EventBridge Scheduler
+    scheduler.get_scheduler().schedule_once(scheduler.timed_name(prefix, at), at, scheduler.function_arn(context),
+                                            payload)
+    return at
+
+
+@tracing.handler('supply')
 def lambda_handler(event, context):
-    params = {'well3': ['well3_on', 'well3_off'], 'well5': ['well5_on', 'well5_off'],
-              'spring': ['spring_on', 'spring_off']}
-    # Login to sensaphone.net
-    creds = sensaphone_auth.check_valid_session()
-    # Get Current System Status
-    devices = get_sensaphone.system_status(creds)
-
-    for d in devices:
-        # Sentinel Device Name
-        if d['name'] == event['sentinel_name']:
-            device_id = d['device_id']
-            is_online = d['is_online']
-            power = d['power_value']
-            # Sentinel Output
-            for z in d['zone']:
-                if z['name'] == event['pump_name']:
-                    # Output Id
-                    zone_id = z['zone_id']
-                    current_pump_value = z['value']
-
-    if event['reason']['type'].lower() in ['well3', 'well5', 'spring']:
-        reason = event['reason']['type'].lower()
-
-        # Get Timer Settings from AWS Systems Manger Parameter Store
-        on = get_ssm_param(params[reason][0])
-        off = get_ssm_param(params[reason][1])
-        # Minutes until or since timer
-        on_mins = timer_offset(on)
-        off_mins = timer_offset(off)
-
-        # Timer in last 15 mins take action.
-        # AWS Lambda cron is set to run every 15 mins.
-        if 15 > on_mins >= -1:
-            poutput = change_pump(event, creds, device_id, zone_id, power, current_pump_value, 'on')
-        elif 15 > off_mins >= -1:
-            poutput = change_pump(event, creds, device_id, zone_id, power, current_pump_value, 'off')
-        else:
-            status_code = 200
-            msg = reason + ' - Not time to change pump output'
-
-    # Pump change based on content of email alert from Sensaphone.
-    elif event['reason']['type'].lower() in ['email_alarm', 'intermittent_pumping']:
-        if event['pump'] == 'on':
-            if event['pump_name'] == '#3 Well Pump':
-                # Get Timer Settings from AWS Systems Manger Parameter Store
-                well3_on_hour = int(get_ssm_param('well3_on').split(":")[0])
-                well3_off_hour = int(get_ssm_param('well3_off').split(":")[0])
-
-                # Get current Pacific time. AWS Lambda event triggers operate in UTC.
-                pacific = dateutil.tz.gettz('US/Pacific')
-                current_pacific_hour = datetime.datetime.now(tz=pacific).hour
-
-                # it is currently between turn on and turn off times.
-                if (current_pacific_hour >= well3_on_hour) or (current_pacific_hour <= well3_off_hour):
-                    poutput = change_pump(event, creds, device_id, zone_id, power, current_pump_value, 'on')
-                else:
-                    status_code = 200
-                    msg = event['reason']['type'].lower() + ' Well#3 - Not time to change pump output'
-            # tend to run #5 / Spring 24/7.
-            else:
-                poutput = change_pump(event, creds, device_id, zone_id, power, current_pump_value, 'on')
-        elif event['pump'] == 'off':
-            poutput = change_pump(event, creds, device_id, zone_id, power, current_pump_value, 'off')
-        else:
-            status_code = 400
-            msg = 'Invalid Pump Value! Check Template Payload'
-    else:
-        status_code = 400
-        msg = 'Invalid \'Reason Type\'! Check Template Payload'
-
-    if 'poutput' not in locals():
-        poutput = [status_code, msg, None]
-    log_result(poutput[0], event, poutput[1], poutput[2], devices)
+    started = time.perf_counter()
+    # Timer Settings and Limits from AWS Systems Manger Parameter Store, one request for all parameters.
+    # {"refresh": true} (a timer changed in Parameter Store, see template.yaml) skips the warm container's cache.
+    cfg = config.load_config(force=bool(event.get('refresh')))
+    # Re-arm before talking to Sensaphone, a failed run still runs again at the next transition.
+    # A scheduler failure doesn't stop the pumps being changed now, the 6 hourly fallback cron re-arms later.
+    try:
+        arm_next_run(copy.deepcopy(event), cfg, context)
+    except Exception as err:
+        logger.error('Next timer run not scheduled: {a!r}'.format(a=err))
+    pumps = control.pump_events(event)
+
+    # Batch mode, one run for several pumps sharing the same system status.
+    # {"pumps": [{"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "", "reason": {"type": "well3"}}, ...]}
+    # or {"pumps": "timers"} for all the timer pumps in the topology
+    if 'pumps' in event:
+        outputs, status = control.run_pumps(pumps, cfg)
+        results = [control.pump_result(status_code, p, msg, data)
+                   for p, (status_code, msg, data) in zip(pumps, outputs)]
+        return log_batch_result(results, status, time.perf_counter() - started)
+
+    outputs, status = control.run_pumps(pumps, cfg, isolate=False)
+    status_code, msg, data = outputs[0]
+    return log_result(status_code, event, msg, data, status, time.perf_counter() - started)
@@ -0,0 +1,238 @@
+""" Benchmarks - replay events/*.json and simulated weeks of cron ticks through the handlers.
+
+Run with -s to see the report, BENCH_DAYS sets the number of simulated days (default 7), ex.
+    BENCH_DAYS=365 pytest tests/benchmark -s
+"""
+import datetime
+import json
+import os
+import re
+import statistics
+import time
+
+from melodywoods import runlog, query, store, optimizer, tariff, topology, profiling, runtime
+from melodywoods.config import Timer
+from melodywoods.schedule import PACIFIC, pump_schedule
+from simulator import EMAILS, EVENTS, PARAMETERS, ROOT, FakeAWS, Simulation, load_event
+
+BENCH_DAYS = int(os.environ.get('BENCH_DAYS', 7))
+# years of 15 min run log rows for the query benchmark
+BENCH_LOG_YEARS = int(os.environ.get('BENCH_LOG_YEARS', 3))
+
+# smallest MemorySize of the functions in template.yaml, MB
+with open(os.path.join(ROOT, 'template.yaml')) as fp:
+    MEMORY_SIZE = min(int(size) for size in re.findall(r'MemorySize: (\d+)', fp.read()))
+# budgets for one profiled invocation (cProfile and tracemalloc make it several times slower)
+PYTHON_PEAK_KB = int(os.environ.get('BENCH_PYTHON_PEAK_KB', 32 * 1024))
+INVOCATION_SECONDS = float(os.environ.get('BENCH_INVOCATION_SECONDS', 5))
+# the 2MB email, alerts.read_message() keeps the first ALERT_MAX_BYTES (with the simulator building the raw email)
+EMAIL_PEAK_KB = int(os.environ.get('BENCH_EMAIL_PEAK_KB', 10 * 1024))
+
+# 88k tank - ft/hour filling with the 5hp pump on, ft/hour used by the system
+FILL_RATE = 0.35
+USAGE_RATE = 0.12
+
+
+def report(name, records):
+    """ Print latency and external call summary for a list of Simulation.invoke() records."""
+    latencies = sorted(r['seconds'] * 1000 for r in records)
+    calls = {}
+    for r in records:
+        for k, v in r['calls'].items():
+            calls[k] = calls.get(k, 0) + v
+    decisions = {}
+    for r in records:
+        # email returns a list of supply lambda invocations, not a statusCode
+        key = r['result']['statusCode'] if isinstance(r['result'], dict) else 'n/a'
+        decisions[key] = decisions.get(key, 0) + 1
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+    print('\n{a}: {b} invocations, latency ms p50 {c:.2f} p95 {d:.2f} max {e:.2f}'.format(
+        a=name, b=len(records), c=statistics.median(latencies), d=p95, e=latencies[-1]))
+    print('  external calls per invocation: ' + ', '.join('{a} {b:.2f}'.format(a=k, b=v / len(records))
+                                                          for k, v in sorted(calls.items())))
+    print('  status codes: {a}'.format(a=decisions))
+    return calls
+
+
+def test_replay_events():
+    records = []
+    with Simulation() as sim:
+        for name in sorted(os.listdir(EVENTS)):
+            function_dir = {'supply': 'supply', '88k': '88k_tank', 'email': 'email'}[name.split('_')[0]]
+            records.append(sim.invoke(function_dir, load_event(name)))
+
+    report('events/*.json', records)
+    assert len(records) == len(os.listdir(EVENTS))
+
+
+def test_supply_week_of_ticks():
+    well3 = pump_schedule(Timer(*map(int, PARAMETERS['well3_on'].split(':'))),
+                          Timer(*map(int, PARAMETERS['well3_off'].split(':'))))
+    event = load_event('supply_batch_test_event.json')
+    records = []
+    with Simulation() as sim:
+        # polling only acts on transitions, start with the pump in its scheduled state
+        sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] = well3.state_at(sim.clock.now()).capitalize()
+        for _ in range(BENCH_DAYS * 24 * 4):
+            records.append(sim.invoke('supply', event))
+            # the tick runs transitions up to 15 mins early
+            expected = well3.state_at(sim.clock.now() + datetime.timedelta(minutes=15, seconds=-1))
+            assert sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'].lower() == expected
+            sim.clock.advance(minutes=15)
+
+    calls = report('supply every 15 mins, {a} days'.format(a=BENCH_DAYS), records)
+    # status downloaded only when a transition is due (well3 on/off + spring at midnight), one pump change per
+    # well3 transition
+    assert calls['system_status'] == BENCH_DAYS * 3
+    assert calls['change_device_output'] == BENCH_DAYS * 2
+    # parameters read once per SSM_TTL by the warm container, not every tick
+    assert calls['ssm.get_parameters'] <= BENCH_DAYS * 24 * 3600 // runtime.SSM_TTL + 1
+
+
+def test_supply_week_event_driven():
+    well3 = pump_schedule(Timer(*map(int, PARAMETERS['well3_on'].split(':'))),
+                          Timer(*map(int, PARAMETERS['well3_off'].split(':'))))
+    event = load_event('supply_batch_test_event.json')
+    records = []
+    with Simulation() as sim:
+        sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] = well3.state_at(sim.clock.now()).capitalize()
+        for _ in range(BENCH_DAYS * 24 * 60):
+            now = sim.clock.now()
+            # fallback cron, every 6 hours
+            if now.minute == 0 and now.hour % 6 == 0:
+                records.append(sim.invoke('supply', event))
+            # one-shot schedules armed by the previous run
+            for name, at, target, payload in sim.due_schedules():
+                records.append(sim.invoke('supply', payload))
+            assert sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'].lower() == well3.state_at(now)
+            sim.clock.advance(minutes=1)
+
+    calls = report('supply event driven, {a} days'.format(a=BENCH_DAYS), records)
+    assert calls['change_device_output'] == BENCH_DAYS * 2
+    # 4 fallback runs + well3 on/off + spring 0:00 a day, instead of 96
+    assert len(records) <= BENCH_DAYS * 8
+
+
+def run_88k_week():
+    """ BENCH_DAYS of hourly checks, 9PM on events and predicted shutoffs with the tank filling/draining. """
+    event_9pm = load_event('88k_tank_test_event.json')
+    event_9pm.update({'pump': 'on', 'reason': '9PM'})
+    hourly = load_event('88k_tank_test_event_hourly.json')
+    records = []
+    levels = []
+    step = 5
+    with Simulation() as sim:
+        start = sim.clock.now()
+        for _ in range(BENCH_DAYS * 24 * 60 // step):
+            now = sim.clock.now()
+            if now.minute == 0 and now.hour == 21:
+                records.append(sim.invoke('88k_tank', event_9pm))
+            if now.minute == 5:
+                records.append(sim.invoke('88k_tank', hourly))
+            # one-shot predicted shutoff
+            for name, at, target, payload in sim.due_schedules():
+                records.append(sim.invoke('88k_tank', payload))
+
+            # filling / usage
+            level_zone = sim.sensaphone.zone('88kTank', '88k Level')
+            pump_on = sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] == 'On'
+            level = float(level_zone['value'].split()[0]) + ((FILL_RATE if pump_on else 0) - USAGE_RATE) * step / 60
+            level_zone['value'] = '{a:.2f} Ft'.format(a=level)
+            levels.append(level)
+            sim.clock.advance(minutes=step)
+
+        # energy cost from the run log
+        prices = tariff.load()
+        kw = topology.load().pumps['88k'].kw
+        rows = query.load('88k', start, sim.clock.now())
+        cost = sum(seconds / 3600 * kw * prices.price(datetime.datetime.fromtimestamp(hour, tz=PACIFIC))
+                   for hour, seconds in query.hourly_on_seconds(rows).items())
+        energy = query.energy_kwh(rows, kw)
+    return records, levels, cost, energy
+
+
+def test_88k_week_of_hourly_checks(mocker):
+    shutoff_level = float(PARAMETERS['shutoff_level_88k'])
+    records, levels, rules_cost, rules_energy = run_88k_week()
+    calls = report('88k hourly, {a} days'.format(a=BENCH_DAYS), records)
+    # the session outlives the hourly checks
+    assert calls['login'] <= BENCH_DAYS * 24 * 3600 // runtime.SESSION_TTL + 1
+    print('  highest level {a:.2f} Ft, shutoff {b} Ft'.format(a=max(levels), b=shutoff_level))
+    # predicted shutoff keeps the overshoot within a few minutes of filling
+    assert max(levels) <= shutoff_level + FILL_RATE / 4
+
+    mocker.patch.object(optimizer, 'TANK_OPTIMIZER', True)
+    records, levels, plan_cost, plan_energy = run_88k_week()
+    report('88k optimizer, {a} days'.format(a=BENCH_DAYS), records)
+    print('  levels {a:.2f} - {b:.2f} Ft, low level {c} Ft'.format(a=min(levels), b=max(levels),
+                                                                    c=optimizer.LOW_LEVEL))
+    print('  energy cost ${a:.2f} ({b:.0f} kWh on-peak) with rules, ${c:.2f} ({d:.0f} kWh on-peak) with the '
+          'optimizer'.format(a=rules_cost, b=rules_energy['on_peak'], c=plan_cost, d=plan_energy['on_peak']))
+    assert max(levels) <= shutoff_level + FILL_RATE / 4
+    assert min(levels) >= optimizer.LOW_LEVEL - USAGE_RATE
+    assert plan_cost <= rules_cost
+
+
+def test_run_log_query_years(tmp_path):
+    kv = store.SQLiteStore(str(tmp_path / 'runlog.db'))
+    start = datetime.datetime(2021, 1, 1, tzinfo=PACIFIC)
+    days = BENCH_LOG_YEARS * 365
+    # 15 min rows, pump on 21:00 - 07:00, level rising while on
+    for day in range(days):
+        segment = runlog.Segment()
+        midnight = (start + datetime.timedelta(days=day)).timestamp()
+        for quarter in range(96):
+            on = quarter >= 84 or quarter < 28
+            segment.append(midnight + quarter * 900, on, 20 + quarter / 96, 200, 'other' if quarter % 4 else 'timer')
+        kv.put(runlog.segment_key('88k', midnight), segment.to_bytes())
+
+    started = time.perf_counter()
+    rows = query.load('88k', start, start + datetime.timedelta(days=days), kv)
+    loaded = time.perf_counter() - started
+    hours = query.runtime_hours(rows)
+    energy = query.energy_kwh(rows, 3.73)
+    curve = query.level_curve(rows)
+    reasons = query.reason_counts(rows)
+    seconds = time.perf_counter() - started
+
+    print('\nrun log query, {a} years, {b} rows: {c:.2f}s ({d:.2f}s loading), {e:.0f} kWh on-peak, '
+          '{f:.0f} kWh off-peak'.format(a=BENCH_LOG_YEARS, b=len(rows.time), c=seconds, d=loaded,
+                                        e=energy['on_peak'], f=energy['off_peak']))
+    assert len(rows.time) == days * 96
+    # rows are 15 mins apart from midnight, on the DST change days the pump is on an hour early/late
+    assert 9 <= min(hours.values()) and max(hours.values()) <= 11
+    assert energy['on_peak'] <= 3.73 * BENCH_LOG_YEARS
+    assert len(curve) >= days * 24 - 24
+    assert reasons == {'timer': days * 24, 'other': days * 72}
+    assert seconds < 10
+
+
+def test_memory_and_time_budget(mocker):
+    mocker.patch.object(profiling, 'PROFILING', True)
+    # recorded events plus an email with a 2MB body (ex. a long alarm history) around one alert
+    emails = dict(EMAILS)
+    emails['large'] = EMAILS['f2aa54f9-e90a-3cba-9168-6fd9cf729969'] + \
+        'History 23.10 Ft 23.12 Ft 23.15 Ft 23.11 Ft 23.09 Ft 23.13 Ft 23.08 Ft 23.14 Ft 23.10 Ft 23.12 Ft\n' * 20000
+    large = load_event('email_test_tp.json')
+    large['messageId'] = 'large'
+    runs = [(name, {'supply': 'supply', '88k': '88k_tank', 'email': 'email'}[name.split('_')[0]], load_event(name))
+            for name in sorted(os.listdir(EVENTS))] + [('2MB email', 'email', large)]
+
+    reports = []
+    with Simulation(aws=FakeAWS(emails=emails)) as sim:
+        for name, function_dir, event in runs:
+            sim.invoke(function_dir, event)
+            reports.append((name, json.loads(sim.profiles[-1])))
+
+    print('\nprofiled invocations, MemorySize {a} MB'.format(a=MEMORY_SIZE))
+    for name, report in reports:
+        print('  {a:40} {b:6.3f}s rss {c} MB python peak {d:.0f} KB - {e}'.format(
+            a=name, b=report['seconds'], c=report['peak_rss_mb'], d=report['python_peak_kb'],
+            e=report['hot_spots'][0]))
+    assert len(reports) == len(runs)
+    for name, report in reports:
+        assert report['python_peak_kb'] < PYTHON_PEAK_KB, name
+        assert name != '2MB email' or report['python_peak_kb'] < EMAIL_PEAK_KB, name
+        assert report['seconds'] < INVOCATION_SECONDS, name
+        # peak of the whole test process, an upper bound of what the function needs
+        assert report['peak_rss_mb'] is None or report['peak_rss_mb'] < MEMORY_SIZE, name
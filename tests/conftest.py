@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# melodywoods is deployed as a Lambda Layer, locally put it on the path like the layer would be.
+sys.path.insert(0, os.path.join(ROOT, 'shared'))
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+@pytest.fixture(autouse=True)
+def clear_runtime_cache():
+    from simulator import reset_state
+    reset_state()
+    yield
+    reset_state()
@@ -0,0 +1,322 @@
+""" Offline simulator for the Lambda handlers.
+
+Fake Sensaphone, SSM, WorkMail and Lambda plus a virtual clock, so the handlers can be run without
+sensaphone.net or AWS, ex.
+
+    with Simulation() as sim:
+        record = sim.invoke('supply', {"sentinel_name": "Well#3", ...})
+        sim.clock.advance(minutes=15)
+"""
+import copy
+import datetime
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+from email.mime.text import MIMEText
+from unittest import mock
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+EVENTS = os.path.join(ROOT, 'events')
+
+if os.path.join(ROOT, 'shared') not in sys.path:
+    sys.path.insert(0, os.path.join(ROOT, 'shared'))
+
+from melodywoods import runtime, reporting, tracing, dedupe, schedule, scheduler, store, resilience, verify, \
+    profiling, invocation  # noqa: E402
+
+_apps = {}
+
+
+def load_app(function_dir):
+    """ Import <function_dir>/app.py, each Lambda has its own app.py so they are loaded by path."""
+    path = os.path.join(ROOT, function_dir, 'app.py')
+    spec = importlib.util.spec_from_file_location('app_' + function_dir, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_app(function_dir):
+    """ load_app() once per function, like a warm Lambda container."""
+    if function_dir not in _apps:
+        _apps[function_dir] = load_app(function_dir)
+    return _apps[function_dir]
+
+
+def reset_state():
+    """ Forget everything kept between warm invocations, like a cold start."""
+    runtime.clear()
+    resilience.clear()
+    invocation.end()
+    dedupe._store = None
+    store._store = None
+    scheduler._scheduler = None
+
+
+def load_event(name):
+    with open(os.path.join(EVENTS, name)) as fp:
+        return json.load(fp)
+
+
+PARAMETERS = {'well3_on': '20:00', 'well3_off': '7:30', 'well5_on': '0:00', 'well5_off': '0:00',
+              'spring_on': '0:00', 'spring_off': '0:00', 'shutoff_level_88k': '23.3',
+              'shutoff_noon_level_88k': '23.0'}
+
+DEVICES = [
+    {"name": "TreatmentPlant", "device_id": 1, "description": "", "is_online": True, "power_value": "On",
+     "power_status": "", "battery_value": "", "battery_status": "",
+     "zone": [{"name": "Spring Pump", "zone_id": 11, "sensor_type": "output", "units": "", "value": "On"},
+              {"name": "88k Pump", "zone_id": 12, "sensor_type": "output", "units": "", "value": "Off"},
+              {"name": "Chlorine Barrel Level", "zone_id": 13, "sensor_type": "analog", "units": "Gal",
+               "value": "25.00 Gal"}]},
+    {"name": "Well#3", "device_id": 3, "description": "", "is_online": True, "power_value": "On",
+     "power_status": "", "battery_value": "", "battery_status": "",
+     "zone": [{"name": "#3 Well Pump", "zone_id": 31, "sensor_type": "output", "units": "", "value": "Off"},
+              {"name": "Chlorine Barrel Level", "zone_id": 32, "sensor_type": "analog", "units": "Gal",
+               "value": "20.00 Gal"}]},
+    {"name": "88kTank", "device_id": 2, "description": "", "is_online": True, "power_value": "On",
+     "power_status": "", "battery_value": "", "battery_status": "",
+     "zone": [{"name": "88k Level", "zone_id": 21, "sensor_type": "analog", "units": "Ft", "value": "22.00 Ft"}]},
+]
+
+# email bodies for the messageIds in events/email_test_*.json
+EMAILS = {
+    # email_test_tp.json
+    'f2aa54f9-e90a-3cba-9168-6fd9cf729969': "From:\nTreatmentPlant\nLow level alarm on Chlorine Barrel Level. "
+                                            "Alarm limit 10.00 Gal. Current reading 9.50 Gal.\n",
+    # email_test_well3.json
+    '81886ca6-0185-323e-861b-77cf6d6fd7bf': "From:\nWell#3\nThe power is OFF. Check the Sentinel.\n",
+    # email_test_well5.json
+    '09f74633-a5c2-3411-b8e9-0076e4e10dbf': "From:\nWell#5\nLow level alarm on Chlorine Barrel Level. "
+                                            "Alarm limit 10.00 Gal. Current reading 8.00 Gal.\n",
+}
+
+
+class VirtualClock:
+    """ Simulated time, replaces schedule.now(), time.time() used for cache expiry and time.sleep() for backoff."""
+
+    def __init__(self, start=None):
+        self.current = start or datetime.datetime(2024, 6, 3, 0, 0, tzinfo=schedule.PACIFIC)
+
+    def now(self):
+        return self.current
+
+    def time(self):
+        return self.current.timestamp()
+
+    def advance(self, **kwargs):
+        # real elapsed time, not wall clock, so DST changes don't repeat or skip ticks
+        utc = self.current.astimezone(datetime.timezone.utc) + datetime.timedelta(**kwargs)
+        self.current = utc.astimezone(schedule.PACIFIC)
+        return self.current
+
+    def sleep(self, seconds):
+        # retry backoff (melodywoods.resilience) passes simulated time instead of waiting
+        self.advance(seconds=seconds)
+
+
+class FakeSensaphone:
+    """ sensaphone.net, keeps the zone values and applies output changes."""
+
+    def __init__(self, devices=None, actuation_delay=0):
+        self.devices = copy.deepcopy(devices or DEVICES)
+        self.calls = {}
+        self.logins = 0
+        # sensaphone.net outage, every request fails like pysensaphone does when it can't connect (returns None)
+        self.down = False
+        # (device_id, zone_id) of outputs whose changes sensaphone.net refuses, pysensaphone returns False
+        self.rejects = set()
+        # seconds before a Sentinel shows an output change, needs a clock (set by Simulation)
+        self.actuation_delay = actuation_delay
+        self.clock = None
+        self._pending = []
+
+    def _actuate(self):
+        now = self.clock.time() if self.clock else float('inf')
+        for change in [c for c in self._pending if c[0] <= now]:
+            change[1]['value'] = change[2]
+            self._pending.remove(change)
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return not self.down
+
+    def login(self):
+        if not self._count('login'):
+            return None
+        return {'session': 'sim', 'acctid': 1, 'session_expiration': '2999-01-01 00:00:00'}
+
+    def system_status(self, creds):
+        if not self._count('system_status'):
+            return None
+        self._actuate()
+        return copy.deepcopy(self.devices)
+
+    def device_zone_info(self, creds, device_id, zone_id):
+        if not self._count('device_zone_info'):
+            return None
+        self._actuate()
+        for d in self.devices:
+            for z in d['zone']:
+                if d['device_id'] == device_id and z['zone_id'] == zone_id:
+                    return {'result': {'success': True},
+                            'response': {'device': [{'device_id': device_id, 'zone': [copy.deepcopy(z)]}]}}
+        return False
+
+    def change_device_output(self, creds, device_id, zone_id, pump_value):
+        if not self._count('change_device_output'):
+            return None
+        if (device_id, zone_id) in self.rejects:
+            return False
+        for d in self.devices:
+            for z in d['zone']:
+                if d['device_id'] == device_id and z['zone_id'] == zone_id:
+                    value = 'On' if pump_value else 'Off'
+                    if self.actuation_delay and self.clock:
+                        self._pending.append((self.clock.time() + self.actuation_delay, z, value))
+                    else:
+                        z['value'] = value
+                    return {'result': {'success': True, 'code': 0}}
+        return {'result': {'success': False, 'code': 404}}
+
+    def zone(self, sentinel_name, zone_name):
+        for d in self.devices:
+            for z in d['zone']:
+                if d['name'] == sentinel_name and z['name'] == zone_name:
+                    return z
+        raise KeyError((sentinel_name, zone_name))
+
+    def device(self, sentinel_name):
+        for d in self.devices:
+            if d['name'] == sentinel_name:
+                return d
+        raise KeyError(sentinel_name)
+
+
+class FakeAWS:
+    """ boto3 clients for ssm, workmailmessageflow and lambda."""
+
+    def __init__(self, parameters=None, emails=None, supply=None):
+        self.parameters = dict(parameters or PARAMETERS)
+        self.emails = dict(emails or EMAILS)
+        self.invoked = []
+        self.calls = {}
+        # called with the payload of every lambda.invoke, ex. run the supply handler in process
+        self.supply = supply
+
+    def client(self, service, **kwargs):
+        return {'ssm': FakeSSM, 'workmailmessageflow': FakeWorkMail, 'lambda': FakeLambda,
+                'dynamodb': FakeClient, 'scheduler': FakeClient}[service](self)
+
+
+class FakeClient:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def _count(self, name):
+        self.aws.calls[name] = self.aws.calls.get(name, 0) + 1
+
+
+class FakeSSM(FakeClient):
+    def get_parameter(self, Name):
+        self._count('ssm.get_parameter')
+        return {'Parameter': {'Name': Name, 'Value': self.aws.parameters[Name]}}
+
+    def get_parameters(self, Names):
+        self._count('ssm.get_parameters')
+        return {'Parameters': [{'Name': n, 'Value': self.aws.parameters[n]} for n in Names if n in self.aws.parameters],
+                'InvalidParameters': [n for n in Names if n not in self.aws.parameters]}
+
+
+class FakeWorkMail(FakeClient):
+    def get_raw_message_content(self, messageId):
+        self._count('workmail.get_raw_message_content')
+        return {'messageContent': io.BytesIO(MIMEText(self.aws.emails[messageId]).as_bytes())}
+
+
+class FakeLambda(FakeClient):
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self._count('lambda.invoke')
+        payload = json.loads(Payload)
+        self.aws.invoked.append(payload)
+        if self.aws.supply:
+            self.aws.supply(payload)
+        return {'StatusCode': 202}
+
+
+class Simulation:
+    """
+    Patches pysensaphone, boto3 and the clock for the duration of the with block.
+    invoke() runs a handler and returns a record with latency, external call counts and the decision.
+    """
+
+    def __init__(self, clock=None, sensaphone=None, aws=None):
+        self.clock = clock or VirtualClock()
+        self.sensaphone = sensaphone or FakeSensaphone()
+        self.sensaphone.clock = self.clock
+        self.aws = aws or FakeAWS()
+        self.logs = []
+        self.metrics = []
+        # melodywoods.profiling reports, when PROFILING is on
+        self.profiles = []
+        self._patches = []
+
+    def __enter__(self):
+        from pysensaphone import get_sensaphone, set_sensaphone, sensaphone_auth
+        self._patches = [
+            mock.patch.object(get_sensaphone, 'system_status', self.sensaphone.system_status),
+            mock.patch.object(get_sensaphone, 'device_zone_info', self.sensaphone.device_zone_info),
+            mock.patch.object(set_sensaphone, 'change_device_output', self.sensaphone.change_device_output),
+            mock.patch.object(sensaphone_auth, 'check_valid_session', self.sensaphone.login),
+            mock.patch.object(sensaphone_auth, 'sensaphone_login', self.sensaphone.login),
+            mock.patch('boto3.client', self.aws.client),
+            mock.patch.object(schedule, 'now', self.clock.now),
+            mock.patch.object(runtime, 'time', self.clock),
+            mock.patch.object(dedupe, 'time', self.clock),
+            mock.patch.object(resilience, 'time', self.clock),
+            mock.patch.object(verify, 'time', self.clock),
+            mock.patch.object(reporting, 'sink', self.logs.append),
+            mock.patch.object(tracing, 'sink', self.metrics.append),
+            mock.patch.object(profiling, 'sink', self.profiles.append),
+        ]
+        for p in self._patches:
+            p.start()
+        reset_state()
+        return self
+
+    def __exit__(self, *exc):
+        for p in reversed(self._patches):
+            p.stop()
+        reset_state()
+
+    def due_schedules(self):
+        """
+        One-shot schedules (melodywoods.scheduler.LocalScheduler) due at the current simulated time.
+        Returns:
+            list: (name, at, target_arn, payload)
+        """
+        return scheduler.get_scheduler().due(self.clock.now())
+
+    def external_calls(self):
+        calls = dict(self.sensaphone.calls)
+        calls.update(self.aws.calls)
+        return calls
+
+    def invoke(self, function_dir, event):
+        """
+        Run a handler with a copy of event.
+        Returns:
+            dict: function, time, seconds (real latency), calls (external calls made), result
+        """
+        app = get_app(function_dir)
+        before = self.external_calls()
+        start = time.perf_counter()
+        result = app.lambda_handler(copy.deepcopy(event), None)
+        seconds = time.perf_counter() - start
+        after = self.external_calls()
+        return {'function': function_dir, 'time': self.clock.now(), 'seconds': seconds,
+                'calls': {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)},
+                'result': result}
@@ -0,0 +1,78 @@
+import io
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from melodywoods import alerts
+
+BODY = """Sensaphone.net Alert
+
+From:
+TreatmentPlant
+Low level alarm on Chlorine Barrel Level. Alarm limit 10.00 Gal. Current reading 9.50 Gal.
+The power is OFF. Please check.
+
+From:
+Well#3
+The power has returned to normal.
+Low level alarm on Chlorine Barrel Level. Alarm limit 10.00 Gal. Current reading -1.00 Gal.
+High level alarm on 88k Level. Alarm limit 23.50 Ft.
+"""
+
+
+def test_parse_alerts():
+    parsed = alerts.parse_alerts(BODY.encode())
+
+    assert [(a.sentinel, a.alarm_type, a.zone, a.level, a.power) for a in parsed] == [
+        ('TreatmentPlant', 'low_level', 'Chlorine Barrel Level', 9.5, None),
+        ('TreatmentPlant', 'power', None, None, False),
+        ('Well#3', 'power', None, None, True),
+        ('Well#3', 'low_level', 'Chlorine Barrel Level', -1.0, None),
+        ('Well#3', 'high_level', '88k Level', 23.5, None),
+    ]
+    assert [alerts.is_chlorine_low(a) for a in parsed] == [True, False, False, False, False]
+
+
+def test_read_message_multipart():
+    msg = MIMEMultipart()
+    msg['Subject'] = 'Zone Alarm'
+    attachment = MIMEText('not this one')
+    attachment.add_header('Content-Disposition', 'attachment', filename='log.txt')
+    msg.attach(attachment)
+    msg.attach(MIMEText(BODY))
+
+    assert alerts.read_message(io.BytesIO(msg.as_bytes()), chunk_size=100) == BODY.encode()
+
+
+def test_read_message_drops_attachments_while_reading():
+    msg = MIMEMultipart()
+    msg.attach(MIMEApplication(b'x' * 200000))
+    attachment = MIMEText('y' * 200000)
+    attachment.add_header('Content-Disposition', 'attachment', filename='log.txt')
+    msg.attach(attachment)
+    alternative = MIMEMultipart('alternative')
+    alternative.attach(MIMEText('<p>Zone Alarm</p>', 'html'))
+    alternative.attach(MIMEText(BODY))
+    msg.attach(alternative)
+
+    assert alerts.read_message(io.BytesIO(msg.as_bytes()), chunk_size=1000, max_bytes=10000) == BODY.encode()
+
+
+def test_read_message_stops_at_max_bytes():
+    msg = MIMEText(BODY + 'History 23.10 Ft\n' * 10000)
+
+    body = alerts.read_message(io.BytesIO(msg.as_bytes()), max_bytes=1000)
+
+    assert len(body) < 1000
+    assert body.startswith(BODY.encode())
+
+
+def test_large_digest():
+    block = "From:\nWell#3\nLow level alarm on Chlorine Barrel Level. Alarm limit 10.00 Gal. Current reading 9.50 Gal.\n"
+    msg = MIMEText(block * 5000)
+
+    body = alerts.read_message(io.BytesIO(msg.as_bytes()))
+    parsed = alerts.parse_alerts(body)
+
+    assert len(parsed) == 5000
+    assert all(alerts.is_chlorine_low(a) for a in parsed)
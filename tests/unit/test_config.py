@@ -0,0 +1,45 @@
+from melodywoods import config
+from melodywoods import runtime
+
+PARAMETERS = {'well3_on': '20:00', 'well3_off': '7:30', 'well5_on': '0:00', 'well5_off': '23:59',
+              'spring_on': '25:00', 'spring_off': '6:00', 'shutoff_level_88k': '23.3',
+              'shutoff_noon_level_88k': '23.0'}
+
+
+class FakeSSM:
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+
+    def get_parameters(self, Names):
+        self.calls.append(Names)
+        return {'Parameters': [{'Name': n, 'Value': self.values[n]} for n in Names if n in self.values],
+                'InvalidParameters': [n for n in Names if n not in self.values]}
+
+
+def test_load_config_single_request(mocker):
+    ssm = FakeSSM(PARAMETERS)
+    mocker.patch.object(runtime, 'get_client', return_value=ssm)
+
+    cfg = config.load_config()
+
+    assert len(ssm.calls) == 1
+    assert cfg.pumps['well3'] == config.PumpSchedule(config.Timer(20, 0), config.Timer(7, 30))
+    assert cfg.shutoff_level == 23.3
+    assert cfg.shutoff_noon_level == 23.0
+    # hour out of range
+    assert cfg.pumps['spring'].on is None
+
+    assert config.load_config() is cfg
+    assert len(ssm.calls) == 1
+
+
+def test_missing_parameter(mocker):
+    values = dict(PARAMETERS)
+    del values['well5_off']
+    mocker.patch.object(runtime, 'get_client', return_value=FakeSSM(values))
+
+    cfg = config.load_config()
+
+    assert cfg.pumps['well5'].off is None
+    assert cfg.pumps['well3'].off == config.Timer(7, 30)
@@ -0,0 +1,38 @@
+from melodywoods import dedupe
+
+
+def test_repeats_inside_window():
+    store = dedupe.MemoryStore()
+
+    assert dedupe.first_alarm('TreatmentPlant', 'power', 'off', store=store, window=900, now=0)
+    assert not dedupe.first_alarm('TreatmentPlant', 'power', 'off', store=store, window=900, now=600)
+    # other sentinel / alarm are separate
+    assert dedupe.first_alarm('Well#3', 'power', 'off', store=store, window=900, now=600)
+    assert dedupe.first_alarm('TreatmentPlant', 'chlorine_low', 'off', store=store, window=900, now=600)
+    # window passed
+    assert dedupe.first_alarm('TreatmentPlant', 'power', 'off', store=store, window=900, now=901)
+
+
+def test_flapping_power_acts_on_every_change():
+    store = dedupe.MemoryStore()
+
+    assert dedupe.first_alarm('Well#3', 'power', 'off', store=store, now=0)
+    assert dedupe.first_alarm('Well#3', 'power', 'on', store=store, now=60)
+    assert not dedupe.first_alarm('Well#3', 'power', 'on', store=store, now=90)
+    assert dedupe.first_alarm('Well#3', 'power', 'off', store=store, now=120)
+
+
+def test_dynamodb_store(mocker):
+    class ConditionalCheckFailedException(Exception):
+        pass
+
+    client = mocker.Mock()
+    client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+    mocker.patch.object(dedupe.runtime, 'get_client', return_value=client)
+    store = dedupe.DynamoDBStore('alarms')
+
+    assert store.put_if_absent('Well#3|power|off', 100, 1000)
+    assert client.put_item.call_args.kwargs['Item'] == {'pk': {'S': 'Well#3|power|off'}, 'expires_at': {'N': '1000'}}
+
+    client.put_item.side_effect = ConditionalCheckFailedException()
+    assert not store.put_if_absent('Well#3|power|off', 200, 1100)
@@ -0,0 +1,75 @@
+import io
+from email.mime.text import MIMEText
+
+import pytest
+
+from simulator import load_app
+from .test_alerts import BODY
+
+app = load_app('email')
+
+
+class FakeWorkMail:
+    def __init__(self, body):
+        self.raw = MIMEText(body).as_bytes()
+
+    def get_raw_message_content(self, messageId):
+        return {'messageContent': io.BytesIO(self.raw)}
+
+
+@pytest.fixture()
+def invoked(mocker):
+    payloads = []
+
+    def invoke(payload):
+        payloads.append(payload)
+        return {'success': True, 'HTTPStatusCode': 202, 'pump': payload['pump_name'], "executed": payload}
+
+    mocker.patch.object(app, 'invoke_supply_lambda', side_effect=invoke)
+    return payloads
+
+
+def test_alerts_to_pump_changes(mocker, invoked):
+    mocker.patch.object(app.runtime, 'get_client', return_value=FakeWorkMail(BODY))
+
+    msg = app.lambda_handler({'messageId': '1'}, None)
+
+    # TP chlorine low and power off shut off spring + well3 (sent once), Well#3 power returned turns well3 back on
+    # invoked at the same time, msg keeps the order
+    expected = [('Spring Pump', 'off'), ('#3 Well Pump', 'off'), ('#3 Well Pump', 'on')]
+    assert sorted((p['pump_name'], p['pump']) for p in invoked) == sorted(expected)
+    assert [(m['executed']['pump_name'], m['executed']['pump']) for m in msg] == expected
+    assert all(m['success'] for m in msg)
+
+
+def test_no_match(mocker, invoked):
+    mocker.patch.object(app.runtime, 'get_client', return_value=FakeWorkMail('Nothing to see here'))
+
+    assert app.lambda_handler({'messageId': '1'}, None) == 'Email Alert body has no match - no-op'
+    assert invoked == []
+
+
+def test_repeat_alarm_skipped(mocker, invoked):
+    mocker.patch.object(app.runtime, 'get_client', return_value=FakeWorkMail(BODY))
+
+    app.lambda_handler({'messageId': '1'}, None)
+    invoked.clear()
+    msg = app.lambda_handler({'messageId': '2'}, None)
+
+    assert invoked == []
+    assert msg.startswith('Repeat alarm already acted on, skipped - TreatmentPlant|chlorine_low|off')
+
+
+def test_failed_invoke_is_not_recorded(mocker, invoked):
+    mocker.patch.object(app.runtime, 'get_client', return_value=FakeWorkMail(BODY))
+    failed = {'success': False, 'HTTPStatusCode': 500, 'pump': 'Spring Pump', 'executed': {}}
+    mocker.patch.object(app, 'invoke_supply_lambda', side_effect=lambda payload: dict(failed, executed=payload))
+
+    app.lambda_handler({'messageId': '1'}, None)
+    mocker.patch.object(app, 'invoke_supply_lambda', side_effect=lambda payload: invoked.append(payload) or
+                        {'success': True, 'HTTPStatusCode': 202, 'pump': payload['pump_name'], 'executed': payload})
+    app.lambda_handler({'messageId': '2'}, None)
+
+    # the repeat is acted on
+    assert sorted((p['pump_name'], p['pump']) for p in invoked) == sorted(
+        [('Spring Pump', 'off'), ('#3 Well Pump', 'off'), ('#3 Well Pump', 'on')])
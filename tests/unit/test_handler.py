@@ -1,73 +1,98 @@
-import json
+import datetime
 
 import pytest
 
-from hello_world import app
-
-
-@pytest.fixture()
-def apigw_event():
-    """ Generates API GW Event"""
-
-    return {
-        "body": '{ "test": "body"}',
-        "resource": "/{proxy+}",
-        "requestContext": {
-            "resourceId": "123456",
-            "apiId": "1234567890",
-            "resourcePath": "/{proxy+}",
-            "httpMethod": "POST",
-            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
-            "accountId": "123456789012",
-            "identity": {
-                "apiKey": "",
-                "userArn": "",
-                "cognitoAuthenticationType": "",
-                "caller": "",
-                "userAgent": "Custom User Agent String",
-                "user": "",
-                "cognitoIdentityPoolId": "",
-                "cognitoIdentityId": "",
-                "cognitoAuthenticationProvider": "",
-                "sourceIp": "127.0.0.1",
-                "accountId": "",
-            },
-            "stage": "prod",
-        },
-        "queryStringParameters": {"foo": "bar"},
-        "headers": {
-            "Via": "1.1 08f323deadbeefa7af34d5feb414ce27.cloudfront.net (CloudFront)",
-            "Accept-Language": "en-US,en;q=0.8",
-            "CloudFront-Is-Desktop-Viewer": "true",
-            "CloudFront-Is-SmartTV-Viewer": "false",
-            "CloudFront-Is-Mobile-Viewer": "false",
-            "X-Forwarded-For": "127.0.0.1, 127.0.0.2",
-            "CloudFront-Viewer-Country": "US",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Upgrade-Insecure-Requests": "1",
-            "X-Forwarded-Port": "443",
-            "Host": "1234567890.execute-api.us-east-1.amazonaws.com",
-            "X-Forwarded-Proto": "https",
-            "X-Amz-Cf-Id": "aaaaaaaaaae3VYQb9jd-nvCd-de396Uhbp027Y2JvkCPNLmGJHqlaA==",
-            "CloudFront-Is-Tablet-Viewer": "false",
-            "Cache-Control": "max-age=0",
-            "User-Agent": "Custom User Agent String",
-            "CloudFront-Forwarded-Proto": "https",
-            "Accept-Encoding": "gzip, deflate, sdch",
-        },
-        "pathParameters": {"proxy": "/examplepath"},
-        "httpMethod": "POST",
-        "stageVariables": {"baz": "qux"},
-        "path": "/examplepath",
-    }
-
-
-def test_lambda_handler(apigw_event, mocker):
-
-    ret = app.lambda_handler(apigw_event, "")
-    data = json.loads(ret["body"])
-
-    assert ret["statusCode"] == 200
-    assert "message" in ret["body"]
-    assert data["message"] == "hello world"
-    # assert "location" in data.dict_keys()
+from melodywoods.schedule import PACIFIC
+from simulator import Simulation, VirtualClock, get_app, load_event
+
+
+def at(hour, minute=0):
+    return VirtualClock(datetime.datetime(2024, 6, 3, hour, minute, tzinfo=PACIFIC))
+
+
+@pytest.mark.parametrize('event_file, hour, status_code, msg, well3, downloads', [
+    # test event asks for well3 off, at 7:20 the 7:30 off timer is due
+    ('supply_well3_test_event.json', 7, 200, 'Requested Pump Value Change Not Required, Value Already Set', 'Off',
+     1),
+    # nothing to change, the system status isn't needed
+    ('supply_well3_test_event.json', 12, 200, 'well3 - Not time to change pump output', 'Off', 0),
+    ('supply_well3_email_alarm.json', 21, 200, 'Success', 'On', 1),
+    ('supply_well3_email_alarm.json', 12, 200, 'email_alarm Well#3 - Not time to change pump output', 'Off', 0),
+])
+def test_supply_events(event_file, hour, status_code, msg, well3, downloads):
+    with Simulation(clock=at(hour, 20 if hour == 7 else 0)) as sim:
+        record = sim.invoke('supply', load_event(event_file))
+
+    assert record['result']['statusCode'] == status_code
+    assert record['result']['body']['msg'] == msg
+    assert sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] == well3
+    assert record['calls'].get('system_status', 0) == downloads
+    assert record['calls']['ssm.get_parameters'] == 1
+
+
+def test_supply_batch_event():
+    with Simulation(clock=at(20, 0)) as sim:
+        record = sim.invoke('supply', load_event('supply_batch_test_event.json'))
+
+    assert [r['body']['msg'] for r in record['result']['body']['results']] == [
+        'Success', 'spring - Not time to change pump output']
+    assert record['calls']['system_status'] == 1
+
+
+@pytest.mark.parametrize('event_file, hour, pump_88k, summary', [
+    ('88k_tank_test_event.json', 12, 'Off', None),
+    ('88k_tank_test_event_hourly.json', 5, 'On', '88k Level Morning Low Optimization 22.0'),
+    ('88k_tank_test_event_hourly.json', 15, 'Off', 'No Output Change Needed'),
+])
+def test_88k_events(event_file, hour, pump_88k, summary):
+    with Simulation(clock=at(hour)) as sim:
+        record = sim.invoke('88k_tank', load_event(event_file))
+
+    assert record['result']['statusCode'] == 200
+    if summary:
+        assert record['result']['body']['summary'] == summary
+    assert sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] == pump_88k
+
+
+@pytest.mark.parametrize('event_file, invoked', [
+    ('email_test_tp.json', [('Spring Pump', 'off'), ('#3 Well Pump', 'off')]),
+    ('email_test_well3.json', [('#3 Well Pump', 'off')]),
+    ('email_test_well5.json', []),
+])
+def test_email_events(event_file, invoked):
+    with Simulation() as sim:
+        sim.invoke('email', load_event(event_file))
+
+    assert sorted((p['pump_name'], p['pump']) for p in sim.aws.invoked) == sorted(invoked)
+
+
+def test_email_in_process_dispatch(mocker):
+    mocker.patch.object(get_app('email'), 'DISPATCH_MODE', 'inprocess')
+    with Simulation() as sim:
+        sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] = 'On'
+        record = sim.invoke('email', load_event('email_test_tp.json'))
+
+    # actual results, one status download for both pumps, no supply invocations
+    assert [(r['pump'], r['statusCode'], r['msg']) for r in record['result']] == [
+        ('Spring Pump', 200, 'Success'), ('#3 Well Pump', 200, 'Success')]
+    assert sim.sensaphone.zone('TreatmentPlant', 'Spring Pump')['value'] == 'Off'
+    assert sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] == 'Off'
+    assert record['calls']['system_status'] == 1
+    assert 'lambda.invoke' not in record['calls']
+    assert sim.aws.invoked == []
+
+
+def test_email_repeat_acted_on_after_failed_shutoff(mocker):
+    mocker.patch.object(get_app('email'), 'DISPATCH_MODE', 'inprocess')
+    with Simulation() as sim:
+        sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] = 'On'
+        sim.sensaphone.down = True
+        failed = sim.invoke('email', load_event('email_test_tp.json'))
+        sim.sensaphone.down = False
+        sim.clock.advance(minutes=5)
+        repeat = sim.invoke('email', load_event('email_test_tp.json'))
+
+    assert [r['statusCode'] for r in failed['result']] == [503, 503]
+    assert [(r['pump'], r['statusCode']) for r in repeat['result']] == [('Spring Pump', 200), ('#3 Well Pump', 200)]
+    assert sim.sensaphone.zone('TreatmentPlant', 'Spring Pump')['value'] == 'Off'
+    assert sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] == 'Off'
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from simulator import ROOT
+
+# Cold start import budget for each handler module (seconds), about twice what they take (30 - 50ms),
+# it is here to catch a heavy import sneaking back in at module level.
+IMPORT_BUDGET = float(os.environ.get('IMPORT_BUDGET', 0.1))
+# imported on first use only (melodywoods.runtime, melodywoods.profiling)
+HEAVY = ['boto3', 'botocore', 'pysensaphone', 'requests', 'cProfile', 'pstats', 'tracemalloc']
+
+SCRIPT = '''
+import importlib.util, json, sys, time
+sys.path.insert(0, {shared!r})
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('app', {path!r})
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def import_app(function_dir):
+    script = SCRIPT.format(shared=os.path.join(ROOT, 'shared'), path=os.path.join(ROOT, function_dir, 'app.py'))
+    # run from the tests folder so the repo's email/ folder does not hide the standard library email package
+    out = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(__file__))
+    return json.loads(out.stdout)
+
+
+@pytest.mark.parametrize('function_dir', ['supply', '88k_tank', 'email'])
+def test_lazy_imports(function_dir):
+    result = import_app(function_dir)
+
+    for heavy in HEAVY:
+        assert heavy not in result['modules']
+    assert result['seconds'] < IMPORT_BUDGET
@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from melodywoods import optimizer, tariff, runlog, query, store
+from melodywoods.schedule import PACIFIC
+from simulator import Simulation, VirtualClock, load_event
+
+TARIFF = tariff.Tariff({'periods': [{'name': 'off_peak', 'start': 21, 'end': 12, 'price': 0.18},
+                                    {'name': 'on_peak', 'start': 12, 'end': 21, 'price': 0.36}]})
+PROFILE = optimizer.Profile(0.35, [0.12] * 24)
+
+
+def at(day, hour, minute=5):
+    return datetime.datetime(2024, 6, day, hour, minute, tzinfo=PACIFIC)
+
+
+def test_tariff_periods():
+    assert TARIFF.period(at(3, 23)) == ('off_peak', 0.18)
+    assert TARIFF.period(at(3, 11)) == ('off_peak', 0.18)
+    assert TARIFF.price(at(3, 12, 0)) == 0.36
+    # days, the first matching period wins
+    weekends = tariff.Tariff({'periods': [{'name': 'weekend', 'start': 0, 'end': 0, 'price': 0.1, 'days': [5, 6]},
+                                          {'name': 'flat', 'start': 0, 'end': 0, 'price': 0.2}]})
+    assert weekends.price(at(8, 14)) == 0.1
+    assert weekends.price(at(10, 14)) == 0.2
+    with pytest.raises(ValueError):
+        tariff.Tariff({'periods': [{'name': 'day', 'start': 6, 'end': 18, 'price': 0.2}]})
+
+
+def test_plan_fills_off_peak():
+    plan = optimizer.plan(21.0, at(3, 22), PROFILE, TARIFF, 19.0, 23.3, 3.73, False)
+
+    on_peak = [on for s, on in enumerate(plan.on) if 12 <= (22 + s) % 24 < 21]
+    assert not any(on_peak)
+    assert sum(plan.on) == 9
+    assert 19.0 <= min(plan.levels) and max(plan.levels) <= 23.3
+    assert plan.levels[-1] >= 21.0
+    assert plan.cost == round(9 * 0.18 * 3.73, 2)
+
+
+def test_plan_pumps_on_peak_to_stay_above_low_level():
+    plan = optimizer.plan(19.5, at(3, 12), PROFILE, TARIFF, 19.0, 23.3, 3.73, False)
+
+    # 9 hours of on-peak usage would take it to 18.4
+    assert any(plan.on[:9])
+    assert min(plan.levels) >= 19.0
+
+
+def test_consumption_profile_from_run_log():
+    kv = store.MemoryStore()
+    rows = []
+    level = 22.0
+    # off 08:00 - 20:00 using 0.1 ft/hour, on 20:00 - 08:00 adding 0.4 ft/hour on top of 0.05 ft/hour usage
+    for hour in range(24 * 3):
+        t = at(3, 8, 0) + datetime.timedelta(hours=hour)
+        on = not 8 <= t.hour < 20
+        rows.append(('88k', t.timestamp(), on, level, 200, 'other'))
+        level += 0.35 if on else -0.1
+    runlog.append(rows, kv)
+
+    profile = optimizer.consumption_profile(query.load('88k', at(3, 0), at(6, 0), kv), usage_rate=0.05)
+    assert [round(u, 3) for u in profile.usage[8:20]] == [0.1] * 12
+    assert profile.usage[22] == pytest.approx(0.1)
+    assert profile.fill_rate == pytest.approx(0.45)
+    assert optimizer.consumption_profile(query.load('88k', at(3, 0), at(3, 1), kv)) == \
+        (optimizer.FILL_RATE, [optimizer.USAGE_RATE] * 24)
+
+
+def test_handler_runs_plan(mocker):
+    mocker.patch.object(optimizer, 'TANK_OPTIMIZER', True)
+    with Simulation(clock=VirtualClock(at(3, 22))) as sim:
+        sim.sensaphone.zone('88kTank', '88k Level')['value'] = '20.50 Ft'
+        record = sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+        pump = sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value']
+        sim.clock.advance(hours=14)
+        noon = sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+
+    assert record['result']['body']['summary'] == '88k Plan On 20.5'
+    assert pump == 'On'
+    assert noon['result']['body']['summary'] == '88k Plan Off 20.5'
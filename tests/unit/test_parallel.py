@@ -0,0 +1,42 @@
+import threading
+import time
+
+from melodywoods import parallel, invocation
+
+
+def test_results_in_order_and_concurrent():
+    barrier = threading.Barrier(3, timeout=2)
+
+    def change(pump):
+        # all three calls must be running at the same time to get past the barrier
+        barrier.wait()
+        return pump
+
+    results = parallel.run_concurrently([(change, (p,)) for p in ['spring', 'well3', 'well5']], max_workers=3)
+
+    assert [r['result'] for r in results] == ['spring', 'well3', 'well5']
+    assert all(r['error'] is None for r in results)
+
+
+def test_errors_and_timeouts():
+    def fail():
+        raise ValueError('Sensaphone down')
+
+    def hang():
+        time.sleep(1)
+
+    results = parallel.run_concurrently([(fail, ()), (hang, ()), (len, ('ok',))], timeout=0.2)
+
+    assert results[0]['error'] == "ValueError('Sensaphone down')"
+    assert results[1]['error'] == 'Timeout after 0.2s'
+    assert results[2]['result'] == 2
+
+
+def test_calls_waited_for_until_the_invocation_deadline(mocker):
+    mocker.patch.object(parallel, 'RETURN_GRACE', 0.1)
+    mocker.patch.object(invocation, '_deadline', {'at': time.monotonic() + 0.1})
+
+    results = parallel.run_concurrently([(time.sleep, (1,))], timeout=5)
+
+    assert results[0]['error'] == 'Timeout after 5s'
+    assert results[0]['seconds'] < 0.5
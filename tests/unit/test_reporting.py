@@ -0,0 +1,52 @@
+import copy
+import json
+
+from melodywoods import reporting, store
+
+DEVICES = [
+    {"name": "88kTank", "device_id": 2, "is_online": True, "power_value": "On",
+     "zone": [{"name": "88k Level", "zone_id": 21, "value": "23.12 Ft"}]},
+]
+
+
+def test_compact_logs_snapshot_then_changes(capsys):
+    result = {"statusCode": 200, "body": {"summary": "No Output Change Needed", "system_status": DEVICES}}
+    record = {"statusCode": 200, "summary": "No Output Change Needed"}
+
+    first = reporting.log_result(result, DEVICES, record, mode='compact')
+    assert first['system_status'] == DEVICES
+
+    devices = copy.deepcopy(DEVICES)
+    devices[0]['zone'][0]['value'] = '23.20 Ft'
+    second = reporting.log_result(result, devices, record, mode='compact')
+    assert 'system_status' not in second
+    assert second['status_changes'] == {'88kTank/88k Level': ['23.12 Ft', '23.20 Ft']}
+
+    third = reporting.log_result(result, devices, record, mode='compact')
+    assert third['status_changes'] == {}
+
+    logged = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert logged == [first, second, third]
+
+
+def test_last_snapshot_shared_by_containers(mocker):
+    mocker.patch.object(reporting, 'LOG_SNAPSHOT_EVERY', 3)
+    result = {"statusCode": 200, "body": {}}
+    kv = store.MemoryStore()
+
+    # each run is a cold start, only the store is shared
+    logged = [reporting.log_result(result, DEVICES, {"statusCode": 200}, mode='compact', kv=kv) for _ in range(4)]
+    assert ['system_status' in r for r in logged] == [True, False, True, False]
+    assert logged[1]['status_changes'] == {}
+    assert reporting.load_last(kv)['runs'] == 4
+
+    # the store can't be read, the full system status is logged
+    mocker.patch.object(kv, 'get', side_effect=ConnectionError('dynamodb'))
+    assert 'system_status' in reporting.log_result(result, DEVICES, {"statusCode": 200}, mode='compact', kv=kv)
+
+
+def test_verbose_logs_full_result(capsys):
+    result = {"statusCode": 200, "body": {"summary": "x", "system_status": DEVICES}}
+
+    assert reporting.log_result(result, DEVICES, {"statusCode": 200}, mode='verbose') is result
+    assert json.loads(capsys.readouterr().out) == result
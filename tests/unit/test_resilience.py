@@ -0,0 +1,160 @@
+import time
+import threading
+
+import pytest
+
+from melodywoods import resilience, invocation, tracing, runtime
+from simulator import Simulation, load_event, get_app
+
+
+@pytest.fixture()
+def no_wait(mocker):
+    return mocker.patch.object(resilience, 'backoff', return_value=0)
+
+
+def flaky(failures):
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise ConnectionError('sensaphone.net')
+        return 'ok'
+    return func, calls
+
+
+def test_backoff_is_jittered_and_capped():
+    for attempt in range(1, 10):
+        wait = resilience.backoff(attempt, base=0.5, cap=4)
+        assert 0 <= wait <= min(4, 0.5 * 2 ** (attempt - 1))
+
+
+def test_retries_until_success(no_wait):
+    func, calls = flaky(2)
+
+    assert resilience.call('sensaphone', func, attempts=3) == 'ok'
+    assert len(calls) == 3
+    assert no_wait.call_count == 2
+    assert resilience.breaker('sensaphone').state == 'closed'
+
+
+def test_retries_exhausted(no_wait):
+    func, calls = flaky(5)
+
+    with pytest.raises(resilience.RetriesExhausted) as err:
+        resilience.call('aws', func, attempts=2)
+    assert isinstance(err.value.__cause__, ConnectionError)
+    assert len(calls) == 2
+
+
+def test_deadline():
+    release = threading.Event()
+
+    with pytest.raises(resilience.RetriesExhausted) as err:
+        resilience.call('sensaphone', release.wait, 5, attempts=1, deadline=0.05)
+    release.set()
+    assert isinstance(err.value.__cause__, resilience.CallTimeout)
+
+
+def test_no_retry_past_the_budget(mocker):
+    mocker.patch.object(resilience, 'backoff', return_value=0.3)
+    func, calls = flaky(5)
+
+    with pytest.raises(resilience.RetriesExhausted):
+        resilience.call('sensaphone', func, attempts=5, budget=0.5)
+    # the third attempt would start after the budget
+    assert len(calls) == 2
+
+
+class Context:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.seconds * 1000
+
+
+def test_invocation_deadline_caps_calls():
+    release = threading.Event()
+
+    @tracing.handler('test')
+    def handler(event, context):
+        assert invocation.remaining(10) == pytest.approx(0.1, abs=0.05)
+        with pytest.raises(resilience.CallError):
+            resilience.call('sensaphone', release.wait, 5, deadline=10)
+        return invocation.remaining()
+
+    started = time.monotonic()
+    assert handler({}, Context(invocation.INVOCATION_MARGIN + 0.1)) == 0
+    release.set()
+    assert time.monotonic() - started < 1
+    # no deadline outside an invocation
+    assert invocation.remaining(10) == 10
+
+
+def test_breaker_opens_and_recovers(no_wait, mocker):
+    now = mocker.patch.object(resilience.time, 'time', return_value=1000.0)
+    func, calls = flaky(2 * resilience.BREAKER_FAILURES)
+
+    # each failed call counts once, not once per attempt
+    for _ in range(resilience.BREAKER_FAILURES):
+        assert resilience.breaker('sensaphone').state == 'closed'
+        with pytest.raises(resilience.RetriesExhausted):
+            resilience.call('sensaphone', func, attempts=2)
+    # open, fails without calling
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.call('sensaphone', func)
+    assert len(calls) == 2 * resilience.BREAKER_FAILURES
+
+    # one trial call after the reset timeout closes it again
+    now.return_value = 1000.0 + resilience.BREAKER_RESET
+    assert resilience.call('sensaphone', func) == 'ok'
+    assert resilience.breaker('sensaphone').state == 'closed'
+
+
+def test_half_open_failure_opens_again(no_wait, mocker):
+    now = mocker.patch.object(resilience.time, 'time', return_value=1000.0)
+    func, calls = flaky(100)
+    for _ in range(resilience.BREAKER_FAILURES):
+        with pytest.raises(resilience.CallError):
+            resilience.call('sensaphone', func, attempts=3)
+
+    # the trial call runs its attempts, then the breaker is open again
+    now.return_value = 1000.0 + resilience.BREAKER_RESET
+    with pytest.raises(resilience.RetriesExhausted):
+        resilience.call('sensaphone', func, attempts=3)
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.call('sensaphone', func, attempts=3)
+    assert len(calls) == 3 * (resilience.BREAKER_FAILURES + 1)
+
+
+def test_rejected_output_change_does_not_open_breaker(mocker):
+    mocker.patch.object(get_app('email'), 'DISPATCH_MODE', 'inprocess')
+    with Simulation() as sim:
+        sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] = 'On'
+        # Well#3 #3 Well Pump
+        sim.sensaphone.rejects.add((3, 31))
+        email = sim.invoke('email', load_event('email_test_tp.json'))
+        tank = sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+
+    assert [(r['pump'], r['statusCode']) for r in email['result']] == [('Spring Pump', 200),
+                                                                       ('#3 Well Pump', runtime.REJECTED_CODE)]
+    # refused once, no retries or logins
+    assert email['calls']['change_device_output'] == 2
+    assert email['calls']['login'] == 1
+    assert resilience.breaker('sensaphone').state == 'closed'
+    assert tank['result']['statusCode'] == 200
+
+
+def test_handlers_fail_fast_when_sensaphone_is_down():
+    with Simulation() as sim:
+        sim.sensaphone.down = True
+        # spring 'on' at midnight needs the system status, well3 doesn't
+        supply = [sim.invoke('supply', load_event('supply_batch_test_event.json'))
+                  for _ in range(resilience.BREAKER_FAILURES)]
+        tank = sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+
+    assert [r['statusCode'] for r in supply[0]['result']['body']['results']] == [200, 503]
+    assert tank['result']['statusCode'] == 503
+    # breaker opened after the supply runs failed, the 88k run makes no requests
+    assert 'system_status' not in tank['calls'] and 'login' not in tank['calls']
@@ -0,0 +1,97 @@
+import datetime
+
+from melodywoods import runlog, query, store, tariff
+from melodywoods.schedule import PACIFIC
+from simulator import Simulation, VirtualClock, load_event
+
+START = datetime.datetime(2024, 6, 3, tzinfo=PACIFIC)
+
+
+def at(hours):
+    return (START + datetime.timedelta(hours=hours)).timestamp()
+
+
+def test_segment_round_trip():
+    segment = runlog.Segment()
+    segment.append(at(0), 'On', 22.5, 200, 'morning_fill')
+    segment.append(at(1), False, None, 503, 'not a reason')
+
+    loaded = runlog.Segment.from_bytes(segment.to_bytes())
+    assert len(segment.to_bytes()) == 2 * runlog.ROW_BYTES
+    assert list(loaded.columns['on']) == [1, 0]
+    assert loaded.columns['level'][0] == 22.5
+    assert list(loaded.columns['status']) == [200, 503]
+    assert [runlog.REASONS[r] for r in loaded.columns['reason']] == ['morning_fill', 'other']
+    assert len(runlog.Segment.from_bytes(b'\x00' * 7)) == 0
+
+
+def test_append_one_segment_per_pump_and_day():
+    kv = store.MemoryStore()
+    written = runlog.append([('well3', at(1), 'On', None, 200, 'timer'),
+                             ('well3', at(23), 'Off', None, 200, 'timer'),
+                             ('well3', at(25), None, None, 503, 'timer'),
+                             ('88k', at(1), 'Off', 22.0, 200, 'other')], kv)
+
+    assert written == 4
+    assert sorted(kv.items) == ['runlog/88k/2024-06-03', 'runlog/well3/2024-06-03', 'runlog/well3/2024-06-04']
+    runlog.append([('well3', at(2), 'On', None, 200, 'alarm')], kv)
+    assert len(runlog.Segment.from_bytes(kv.items['runlog/well3/2024-06-03'])) == 3
+
+
+def test_append_retries_when_another_run_wrote_first(tmp_path):
+    for kv in (store.MemoryStore(), store.SQLiteStore(str(tmp_path / 'state.db'))):
+        runlog.append([('well3', at(1), 'On', None, 200, 'timer')], kv)
+        get_versioned = kv.get_versioned
+
+        # an email alarm run appends to the segment between this run's read and write
+        def interleaved(key):
+            read = get_versioned(key)
+            kv.get_versioned = get_versioned
+            runlog.append([('well3', at(2), 'Off', None, 200, 'alarm')], kv)
+            return read
+
+        kv.get_versioned = interleaved
+        assert runlog.append([('well3', at(3), 'On', None, 200, 'timer')], kv) == 1
+        segment = runlog.Segment.from_bytes(kv.get('runlog/well3/2024-06-03'))
+        assert [runlog.REASONS[r] for r in segment.columns['reason']] == ['timer', 'alarm', 'timer']
+        assert kv.put_versioned('runlog/well3/2024-06-03', b'', 1) is False
+
+
+def test_runtime_and_energy():
+    kv = store.MemoryStore()
+    # on 20:00 - 02:00 over midnight, 13:00 - 14:30 the next day, then on at 16:00 and nothing more in the log
+    runlog.append([('88k', at(h), on, None, 200, 'other')
+                   for h, on in ((20, 'On'), (26, 'Off'), (37, 'On'), (38.5, 'Off'), (40, 'On'))], kv)
+    rows = query.load('88k', START, START + datetime.timedelta(days=3), kv)
+
+    hours = query.runtime_hours(rows, max_gap=6 * 3600)
+    # the last run only counts for max_gap
+    assert hours == {datetime.date(2024, 6, 3): 4.0, datetime.date(2024, 6, 4): 2.0 + 1.5 + 6.0}
+    energy = query.energy_kwh(rows, 2.0, max_gap=6 * 3600)
+    assert energy == {'on_peak': 2.0 * (1 + 1.5 + 5), 'off_peak': 2.0 * (5 + 1)}
+    flat = tariff.Tariff({'periods': [{'name': 'flat', 'start': 0, 'end': 0, 'price': 0.2}]})
+    assert query.energy_kwh(rows, 2.0, flat, max_gap=6 * 3600) == {'flat': 2.0 * (4 + 9.5)}
+
+
+def test_load_time_range_and_reasons():
+    kv = store.MemoryStore()
+    runlog.append([('88k', at(h), 'Off', 20 + h / 10, 200, reason)
+                   for h, reason in ((1, 'noon_limit'), (1.5, 'noon_limit'), (2, 'high_limit'), (5, 'other'))], kv)
+    rows = query.load('88k', START + datetime.timedelta(hours=1), START + datetime.timedelta(hours=5), kv)
+
+    assert len(rows.time) == 3
+    assert query.reason_counts(rows) == {'noon_limit': 2, 'high_limit': 1}
+    assert [(t, round(level, 3)) for t, level in query.level_curve(rows)] == [(at(1), 20.125), (at(2), 20.2)]
+
+
+def test_handlers_write_run_log():
+    clock = VirtualClock(datetime.datetime(2024, 6, 3, 22, 5, tzinfo=PACIFIC))
+    with Simulation(clock=clock) as sim:
+        sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+        sim.invoke('supply', {'pumps': 'timers'})
+        tank_rows = query.load('88k', START, clock.now() + datetime.timedelta(hours=1))
+        well_rows = query.load('well3', START, clock.now() + datetime.timedelta(hours=1))
+
+    assert list(tank_rows.status) == [200]
+    assert tank_rows.level[0] == 22.0
+    assert [runlog.REASONS[r] for r in well_rows.reason] == ['timer']
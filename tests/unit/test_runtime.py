@@ -0,0 +1,68 @@
+from melodywoods import runtime
+
+
+class FakeSSM:
+    def __init__(self, values):
+        self.values = values
+        self.calls = 0
+
+    def get_parameters(self, Names):
+        self.calls += 1
+        return {'Parameters': [{'Name': n, 'Value': self.values[n]} for n in Names]}
+
+
+def test_get_client_is_reused(mocker):
+    client = mocker.patch('boto3.client', side_effect=lambda *a, **kw: object())
+
+    assert runtime.get_client('ssm') is runtime.get_client('ssm')
+    assert runtime.get_client('lambda') is not runtime.get_client('ssm')
+    assert client.call_count == 2
+
+
+def test_ssm_value_cached_until_ttl(mocker):
+    ssm = FakeSSM({'well3_on': '20:00'})
+    mocker.patch.object(runtime, 'get_client', return_value=ssm)
+    now = mocker.patch.object(runtime.time, 'time', return_value=1000.0)
+
+    assert runtime.get_ssm_values(['well3_on']) == {'well3_on': '20:00'}
+    # longer than the supply and 88k_tank run intervals
+    now.return_value = 1000.0 + 3600
+    assert runtime.get_ssm_values(['well3_on']) == {'well3_on': '20:00'}
+    assert ssm.calls == 1
+
+    runtime.get_ssm_values(['well3_on'], force=True)
+    assert ssm.calls == 2
+    now.return_value = 1000.0 + 3600 + runtime.SSM_TTL
+    runtime.get_ssm_values(['well3_on'])
+    assert ssm.calls == 3
+
+
+def test_session_cached_and_refreshed_on_failure(mocker):
+    creds = {'session': 'a', 'acctid': 1, 'session_expiration': '2999-01-01 00:00:00'}
+    fresh = {'session': 'b', 'acctid': 1, 'session_expiration': '2999-01-01 00:00:00'}
+    check = mocker.patch('pysensaphone.sensaphone_auth.check_valid_session', return_value=creds)
+    login = mocker.patch('pysensaphone.sensaphone_auth.sensaphone_login', return_value=fresh)
+    mocker.patch.object(runtime.resilience, 'backoff', return_value=0)
+
+    assert runtime.get_session() is creds
+    assert runtime.get_session() is creds
+    assert check.call_count == 1
+
+    # system_status() fails with a TypeError reading the response when the session is rejected
+    def status(c):
+        if c['session'] != 'b':
+            raise TypeError("'bool' object is not subscriptable")
+        return [{'name': 'Well#3'}]
+
+    assert runtime.call_sensaphone(status) == [{'name': 'Well#3'}]
+    assert login.call_count == 1
+    assert runtime.get_session() is fresh
+
+
+def test_session_expiration_limits_ttl(mocker):
+    creds = {'session': 'a', 'acctid': 1, 'session_expiration': '2000-01-01 00:00:00'}
+    check = mocker.patch('pysensaphone.sensaphone_auth.check_valid_session', return_value=creds)
+
+    runtime.get_session()
+    runtime.get_session()
+    assert check.call_count == 2
@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+
+from melodywoods.config import Timer
+from melodywoods.schedule import PACIFIC, Schedule, pump_schedule
+
+
+def pacific(*args):
+    return datetime.datetime(*args, tzinfo=PACIFIC)
+
+
+def test_overnight_state():
+    s = pump_schedule(Timer(20, 0), Timer(7, 30))
+
+    assert s.state_at(pacific(2024, 6, 1, 23, 0)) == 'on'
+    assert s.state_at(pacific(2024, 6, 1, 3, 0)) == 'on'
+    assert s.state_at(pacific(2024, 6, 1, 7, 30)) == 'off'
+    assert s.state_at(pacific(2024, 6, 1, 12, 0)) == 'off'
+    # UTC input is converted to Pacific, 04:00 UTC is 9PM PDT
+    assert s.state_at(datetime.datetime(2024, 6, 2, 4, 0, tzinfo=datetime.timezone.utc)) == 'on'
+
+
+def test_daytime_state():
+    s = pump_schedule(Timer(8, 0), Timer(17, 0))
+
+    assert s.state_at(pacific(2024, 6, 1, 6, 0)) == 'off'
+    assert s.state_at(pacific(2024, 6, 1, 12, 0)) == 'on'
+    assert s.state_at(pacific(2024, 6, 1, 20, 0)) == 'off'
+
+
+def test_next_transition_wraps_midnight():
+    s = pump_schedule(Timer(20, 0), Timer(7, 30))
+
+    assert s.next_transition(pacific(2024, 6, 1, 21, 0)) == (pacific(2024, 6, 2, 7, 30), 'off')
+    assert s.next_transition(pacific(2024, 6, 1, 20, 0)) == (pacific(2024, 6, 2, 7, 30), 'off')
+    assert s.next_transition(pacific(2024, 6, 1, 19, 59)) == (pacific(2024, 6, 1, 20, 0), 'on')
+
+
+def test_dst():
+    s = Schedule([(Timer(2, 30), 'on'), (Timer(12, 0), 'off')])
+
+    # 2:30 AM does not exist on 2024-03-10, clocks go from 2:00 PST to 3:00 PDT
+    at, state = s.next_transition(pacific(2024, 3, 10, 1, 0))
+    assert (at.hour, at.minute, state) == (3, 30, 'on')
+    assert at.utcoffset() == datetime.timedelta(hours=-7)
+    # 24 hours of wall clock is 25 real hours when the clocks go back
+    start = pacific(2024, 11, 2, 12, 0)
+    at, state = s.next_transition(s.next_transition(start)[0])
+    assert at.astimezone(datetime.timezone.utc) - start.astimezone(datetime.timezone.utc) == \
+        datetime.timedelta(hours=25)
+
+
+@pytest.mark.parametrize('minute, due', [(44, None), (45, None), (46, 'on'), (60, 'on'), (61, None)])
+def test_due_window(minute, due):
+    s = pump_schedule(Timer(20, 0), Timer(7, 30))
+    when = pacific(2024, 6, 1, 19, 0) + datetime.timedelta(minutes=minute)
+
+    assert s.due(when) == due
+
+
+def test_next_due_skips_transition_already_due():
+    s = pump_schedule(Timer(20, 0), Timer(7, 30))
+
+    assert s.next_due(pacific(2024, 6, 1, 7, 20)) == (pacific(2024, 6, 1, 20, 0), 'on')
+    assert s.next_due(pacific(2024, 6, 1, 7, 30)) == (pacific(2024, 6, 1, 20, 0), 'on')
+    assert s.next_due(pacific(2024, 6, 1, 7, 0)) == (pacific(2024, 6, 1, 7, 30), 'off')
+
+
+def test_simulated_year_matches_state():
+    s = pump_schedule(Timer(20, 0), Timer(7, 30))
+    when = pacific(2024, 1, 1, 0, 0)
+    state = s.state_at(when)
+    for _ in range(365 * 2):
+        at, new_state = s.next_transition(when)
+        assert new_state != state
+        assert s.state_at(at - datetime.timedelta(seconds=1)) == state
+        assert s.state_at(at) == new_state
+        when, state = at, new_state
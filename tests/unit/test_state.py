@@ -0,0 +1,86 @@
+from melodywoods import state, store
+from melodywoods.status import SystemStatus
+from simulator import DEVICES, Simulation, load_event
+
+
+def test_values_expire():
+    plant = state.PlantState()
+    plant.update_status(SystemStatus(DEVICES), 1000)
+
+    assert plant.value('Well#3', '#3 Well Pump', 1000 + 60) == 'Off'
+    assert plant.value('Well#3', '#3 Well Pump', 1000 + state.STATE_FRESHNESS) is None
+    # sensor readings aren't outputs
+    assert plant.value('88kTank', '88k Level', 1000) is None
+
+
+def test_repeated_command():
+    plant = state.PlantState()
+    plant.record_command('TreatmentPlant', '88k Pump', 'Off', 1000, confirmed=False)
+
+    assert plant.repeated_command('TreatmentPlant', '88k Pump', 'off', 1000 + 3600)
+    assert not plant.repeated_command('TreatmentPlant', '88k Pump', 'On', 1000 + 3600)
+    assert not plant.repeated_command('TreatmentPlant', '88k Pump', 'Off', 1000 + state.STATE_COMMAND_FRESHNESS)
+    assert plant.value('TreatmentPlant', '88k Pump', 1000) is None
+
+
+def test_save_merges_newer_entries(tmp_path):
+    kv = store.SQLiteStore(str(tmp_path / 'state.db'))
+    first = state.load_state(kv)
+    second = state.load_state(kv)
+    first.record_command('Well#3', '#3 Well Pump', 'On', 2000)
+    second.update_status(SystemStatus(DEVICES), 1000)
+    state.save_state(first, kv)
+    state.save_state(second, kv)
+
+    loaded = state.load_state(kv)
+    assert loaded.value('Well#3', '#3 Well Pump', 2000) == 'On'
+    assert loaded.value('TreatmentPlant', 'Spring Pump', 1000) == 'On'
+
+
+def test_save_retries_when_another_run_saved_first():
+    kv = store.MemoryStore()
+    plant = state.load_state(kv)
+    plant.record_command('Well#3', '#3 Well Pump', 'On', 2000)
+    get_versioned = kv.get_versioned
+
+    # an 88k run saves its status between this run's read and write
+    def interleaved(key):
+        read = get_versioned(key)
+        kv.get_versioned = get_versioned
+        other = state.load_state(kv)
+        other.update_status(SystemStatus(DEVICES), 1000)
+        state.save_state(other, kv)
+        return read
+
+    kv.get_versioned = interleaved
+    assert state.save_state(plant, kv)
+    loaded = state.load_state(kv)
+    assert loaded.value('Well#3', '#3 Well Pump', 2000) == 'On'
+    assert loaded.value('TreatmentPlant', 'Spring Pump', 1000) == 'On'
+
+
+def test_supply_uses_last_known_value():
+    event = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "off",
+             "reason": {"type": "email_alarm", "value": True}}
+    with Simulation() as sim:
+        # 88k hourly check downloads the system status, well3 is Off
+        sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+        record = sim.invoke('supply', event)
+
+    assert record['result']['body']['msg'] == 'Requested Pump Value Change Not Required, Value Already Set (last known)'
+    assert 'system_status' not in record['calls']
+
+
+def test_88k_outage_off_not_repeated_every_run():
+    hourly = load_event('88k_tank_test_event_hourly.json')
+    with Simulation() as sim:
+        sim.sensaphone.device('88kTank')['power_value'] = 'Off'
+        records = []
+        for _ in range(6):
+            records.append(sim.invoke('88k_tank', hourly))
+            sim.clock.advance(hours=1)
+
+    sent = [r['calls'].get('change_device_output', 0) for r in records]
+    # sent on the first run and again once STATE_COMMAND_FRESHNESS (4h) has passed
+    assert sent == [1, 0, 0, 0, 1, 0]
+    assert all(r['result']['statusCode'] == 503 for r in records)
@@ -0,0 +1,37 @@
+import pytest
+
+from melodywoods.status import SystemStatus, StatusLookupError, parse_value
+
+DEVICES = [
+    {"name": "TreatmentPlant", "device_id": 1, "is_online": True, "power_value": "On",
+     "zone": [{"name": "Spring Pump", "zone_id": 11, "value": "On"},
+              {"name": "88k Pump", "zone_id": 12, "value": "Off"}]},
+    {"name": "88kTank", "device_id": 2, "is_online": True, "power_value": "Off",
+     "zone": [{"name": "88k Level", "zone_id": 21, "value": "23.12 Ft"}]},
+]
+
+
+def test_lookup():
+    status = SystemStatus(DEVICES)
+
+    assert status.device('88kTank')['device_id'] == 2
+    assert status.zone('TreatmentPlant', '88k Pump')['zone_id'] == 12
+    assert status.value('88kTank', '88k Level') == 23.12
+    assert status.value('TreatmentPlant', 'Spring Pump') is True
+    assert status.power('TreatmentPlant') is True
+    assert status.power('88kTank') is False
+
+
+def test_lookup_missing():
+    status = SystemStatus(DEVICES)
+
+    with pytest.raises(StatusLookupError, match='Sentinel Well#3 not found'):
+        status.zone('Well#3', '#3 Well Pump')
+    with pytest.raises(StatusLookupError, match='Zone #3 Well Pump not found on Sentinel TreatmentPlant'):
+        status.zone('TreatmentPlant', '#3 Well Pump')
+
+
+@pytest.mark.parametrize('value, expected', [('23.1Ft', 23.1), ('-0.5 Gal', -0.5), ('Off', False), (' on', True),
+                                             ('Normal', 'Normal'), (12, 12.0)])
+def test_parse_value(value, expected):
+    assert parse_value(value) == expected
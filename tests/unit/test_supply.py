@@ -0,0 +1,156 @@
+import copy
+import datetime
+
+import pytest
+
+from melodywoods import config
+from melodywoods.schedule import PACIFIC
+from simulator import load_app, Simulation
+
+app = load_app('supply')
+
+CONFIG = config.Config({'well3': config.PumpSchedule(config.Timer(20, 0), config.Timer(7, 0)),
+                        'well5': config.PumpSchedule(config.Timer(0, 0), config.Timer(0, 0)),
+                        'spring': config.PumpSchedule(config.Timer(0, 0), config.Timer(0, 0))}, 23.3, 23.0)
+
+DEVICES = [
+    {"name": "TreatmentPlant", "device_id": 1, "is_online": True, "power_value": "On",
+     "zone": [{"name": "Spring Pump", "zone_id": 11, "value": "On"}]},
+    {"name": "Well#3", "device_id": 3, "is_online": True, "power_value": "On",
+     "zone": [{"name": "#3 Well Pump", "zone_id": 31, "value": "On"}]},
+]
+
+
+@pytest.fixture()
+def sensaphone(mocker):
+    mocker.patch.object(app.config, 'load_config', return_value=CONFIG)
+    calls = []
+
+    def call_sensaphone(func, *args):
+        calls.append((func.__name__, args))
+        if func.__name__ == 'system_status':
+            return copy.deepcopy(DEVICES)
+        return {'result': {'success': True}}
+
+    mocker.patch.object(app.control.runtime, 'call_sensaphone', side_effect=call_sensaphone)
+    return calls
+
+
+def test_email_alarm_off(sensaphone):
+    event = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "off",
+             "reason": {"type": "email_alarm", "value": True}}
+
+    result = app.lambda_handler(event, None)
+
+    assert result['statusCode'] == 200
+    assert result['body']['msg'] == 'Success'
+    assert sensaphone[-1] == ('change_device_output', (3, 31, 0))
+
+
+def test_unknown_sentinel(sensaphone):
+    event = {"sentinel_name": "Well#5", "pump_name": "#5 Well Pump", "pump": "off",
+             "reason": {"type": "email_alarm", "value": True}}
+
+    result = app.lambda_handler(event, None)
+
+    assert result['statusCode'] == 404
+    assert result['body']['msg'] == 'Sentinel Well#5 not found in system status'
+
+
+def test_batch(sensaphone, mocker):
+    # well3 off timer is due, spring is not
+    mocker.patch.object(app.schedule, 'now', return_value=datetime.datetime(2024, 6, 1, 6, 50, tzinfo=PACIFIC))
+    event = {"pumps": [
+        {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "", "reason": {"type": "well3"}},
+        {"sentinel_name": "TreatmentPlant", "pump_name": "Spring Pump", "pump": "", "reason": {"type": "spring"}}]}
+
+    result = app.lambda_handler(event, None)
+
+    assert result['statusCode'] == 200
+    assert [r['body']['msg'] for r in result['body']['results']] == ['Success',
+                                                                     'spring - Not time to change pump output']
+    # one status fetch for both pumps
+    assert [c[0] for c in sensaphone] == ['system_status', 'change_device_output']
+
+
+@pytest.mark.parametrize('hour, changed', [(21, True), (6, True), (12, False)])
+def test_email_alarm_on_well3_schedule(sensaphone, mocker, hour, changed):
+    mocker.patch.object(app.schedule, 'now', return_value=datetime.datetime(2024, 6, 1, hour, tzinfo=PACIFIC))
+    DEVICES[1]['zone'][0]['value'] = 'Off'
+    event = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "on",
+             "reason": {"type": "email_alarm", "value": True}}
+
+    try:
+        app.lambda_handler(event, None)
+    finally:
+        DEVICES[1]['zone'][0]['value'] = 'On'
+
+    assert (('change_device_output', (3, 31, 1)) in sensaphone) is changed
+
+
+def test_timer_run_arms_next_transition(sensaphone, mocker):
+    mocker.patch.object(app.schedule, 'now', return_value=datetime.datetime(2024, 6, 1, 6, 50, tzinfo=PACIFIC))
+    event = {"pumps": [
+        {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "", "reason": {"type": "well3"}},
+        {"sentinel_name": "TreatmentPlant", "pump_name": "Spring Pump", "pump": "", "reason": {"type": "spring"}}]}
+
+    app.lambda_handler(copy.deepcopy(event), None)
+
+    # well3 off at 7:00 is run now, next is well3 on at 20:00 (spring is at midnight)
+    at, target, payload = app.scheduler.get_scheduler().schedules['supply-timers-20240601T2000']
+    assert at == datetime.datetime(2024, 6, 1, 20, 0, tzinfo=PACIFIC)
+    assert payload == event
+
+
+def test_scheduled_run_arms_under_a_new_name(sensaphone, mocker):
+    now = datetime.datetime(2024, 6, 1, 20, 0, tzinfo=PACIFIC)
+    mocker.patch.object(app.schedule, 'now', return_value=now)
+    event = {"pumps": [
+        {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "", "reason": {"type": "well3"}}]}
+    schedules = app.scheduler.get_scheduler().schedules
+    # the schedule that started this run, EventBridge Scheduler deletes it after the run
+    schedules['supply-timers-20240601T2000'] = (now, None, event)
+
+    app.lambda_handler(copy.deepcopy(event), None)
+
+    assert sorted(schedules) == ['supply-timers-20240601T2000', 'supply-timers-20240602T0700']
+
+
+def test_timer_change_event_reads_new_parameters():
+    with Simulation() as sim:
+        sim.invoke('supply', {"pumps": "timers"})
+        sim.aws.parameters['well3_off'] = '8:00'
+        cached = sim.invoke('supply', {"pumps": "timers"})
+        changed = sim.invoke('supply', {"pumps": "timers", "refresh": True})
+        schedules = dict(app.scheduler.get_scheduler().schedules)
+
+    assert 'ssm.get_parameters' not in cached['calls']
+    assert changed['calls']['ssm.get_parameters'] == 1
+    assert sorted(schedules) == ['supply-timers-20240603T0730', 'supply-timers-20240603T0800']
+    assert schedules['supply-timers-20240603T0800'][2] == {"pumps": "timers"}
+
+
+def test_email_alarm_does_not_arm(sensaphone):
+    event = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "off",
+             "reason": {"type": "email_alarm", "value": True}}
+
+    app.lambda_handler(event, None)
+
+    assert app.scheduler.get_scheduler().schedules == {}
+
+
+def test_scheduler_failure_does_not_block_pumps(sensaphone, mocker):
+    mocker.patch.object(app.schedule, 'now', return_value=datetime.datetime(2024, 6, 1, 20, 0, tzinfo=PACIFIC))
+    mocker.patch.object(app.scheduler.get_scheduler(), 'schedule_once', side_effect=RuntimeError('AccessDenied'))
+    event = {"pumps": [
+        {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "", "reason": {"type": "well3"}}]}
+
+    DEVICES[1]['zone'][0]['value'] = 'Off'
+    try:
+        result = app.lambda_handler(event, None)
+    finally:
+        DEVICES[1]['zone'][0]['value'] = 'On'
+
+    # well3 is turned on at its 20:00 transition even though the next run couldn't be scheduled
+    assert result['statusCode'] == 200
+    assert ('change_device_output', (3, 31, 1)) in sensaphone
@@ -0,0 +1,151 @@
+import datetime
+
+from melodywoods import tank, scheduler, store, reporting
+from melodywoods.schedule import PACIFIC
+from simulator import Simulation, VirtualClock, load_event
+
+
+def filling(history, start, level, rate, count, step=3600):
+    for i in range(count):
+        history.append(start + i * step, level + rate * i, True)
+
+
+def test_ring_buffer_keeps_latest():
+    history = tank.LevelHistory(size=3)
+    for i in range(5):
+        history.append(i, 20 + i, False)
+
+    assert len(history) == 3
+    assert list(history.readings[::3]) == [2, 3, 4]
+
+
+def test_trend_uses_current_pump_run():
+    history = tank.LevelHistory()
+    history.append(0, 22.5, False)
+    filling(history, 3600, 21.0, 0.3, 3)
+    now = 3 * 3600
+
+    rate, level = history.trend(now)
+    assert round(rate, 3) == 0.3
+    assert round(level, 2) == 21.6
+    # readings outside the window are ignored
+    assert history.trend(now, window=1800) is None
+
+
+def test_seconds_to_level():
+    history = tank.LevelHistory()
+    filling(history, 0, 22.0, 0.3, 3)
+
+    assert round(history.seconds_to_level(23.0, 2 * 3600)) == 4800
+    assert history.seconds_to_level(22.0, 2 * 3600) == 0
+    draining = tank.LevelHistory()
+    draining.append(0, 23.0, False)
+    draining.append(3600, 22.9, False)
+    assert draining.seconds_to_level(23.0, 3600) is None
+
+
+def test_bytes_round_trip():
+    history = tank.LevelHistory()
+    filling(history, 0, 22.0, 0.3, 4)
+    kv = store.MemoryStore()
+    tank.save_history(history, kv)
+
+    loaded = tank.load_history(kv)
+    assert list(loaded.readings) == list(history.readings)
+    assert len(tank.LevelHistory.from_bytes(b'\x00' * 7)) == 0
+
+
+def run_hourly(sim, levels):
+    hourly = load_event('88k_tank_test_event_hourly.json')
+    records = []
+    for level in levels:
+        sim.sensaphone.zone('88kTank', '88k Level')['value'] = '{a:.2f} Ft'.format(a=level)
+        records.append(sim.invoke('88k_tank', hourly))
+        sim.clock.advance(hours=1)
+    return records
+
+
+def test_handler_schedules_predicted_shutoff():
+    clock = VirtualClock(datetime.datetime(2024, 6, 3, 1, 5, tzinfo=PACIFIC))
+    with Simulation(clock=clock) as sim:
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'On'
+        records = run_hourly(sim, [22.5, 22.8, 23.1])
+        due = scheduler.get_scheduler().schedules
+
+    assert records[-1]['result']['body']['summary'].startswith('88k Level 23.1 Pump Off scheduled at 03:45')
+    at, target, payload = due['88k-predicted-limit-20240603T0345']
+    assert at == datetime.datetime(2024, 6, 3, 3, 45, tzinfo=PACIFIC)
+    assert payload == {'pump': 'off', 'reason': 'Predicted Limit 23.3'}
+
+
+def test_handler_cancels_predicted_shutoff_once_pump_is_off():
+    clock = VirtualClock(datetime.datetime(2024, 6, 3, 1, 5, tzinfo=PACIFIC))
+    with Simulation(clock=clock) as sim:
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'On'
+        run_hourly(sim, [22.5, 22.8])
+        sim.sensaphone.zone('88kTank', '88k Level')['value'] = '23.10 Ft'
+        sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+        armed = dict(scheduler.get_scheduler().schedules)
+        assert tank.pending_shutoff() == '88k-predicted-limit-20240603T0345'
+        # turned off by hand before the predicted time, the next run drops the stale 'off'
+        sim.clock.advance(minutes=10)
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'Off'
+        sim.invoke('88k_tank', load_event('88k_tank_test_event_hourly.json'))
+        due = scheduler.get_scheduler().schedules
+        pending = tank.pending_shutoff()
+
+    assert list(armed) == ['88k-predicted-limit-20240603T0345']
+    assert due == {}
+    assert pending is None
+
+
+def test_handler_turns_off_when_limit_is_close():
+    clock = VirtualClock(datetime.datetime(2024, 6, 3, 1, 5, tzinfo=PACIFIC))
+    with Simulation(clock=clock) as sim:
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'On'
+        records = run_hourly(sim, [20.85, 22.05, 23.25])
+
+    assert records[-1]['result']['body']['summary'].startswith('88k Level Predicted Limit 23.3 in ')
+    assert sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] == 'Off'
+
+
+def test_handler_high_limit_on_raw_reading():
+    clock = VirtualClock(datetime.datetime(2024, 6, 3, 1, 5, tzinfo=PACIFIC))
+    with Simulation(clock=clock) as sim:
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'On'
+        # a jump the smoothed level is still well below
+        records = run_hourly(sim, [22.0, 22.0, 22.0, 23.4])
+
+    assert records[-1]['result']['body']['summary'] == '88k Level at High Limit 23.4'
+    assert sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] == 'Off'
+
+
+def test_handler_power_out_turns_off_once():
+    clock = VirtualClock(datetime.datetime(2024, 6, 3, 1, 5, tzinfo=PACIFIC))
+    with Simulation(clock=clock) as sim:
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'On'
+        sim.sensaphone.device('88kTank')['power_value'] = 'Off'
+        records = run_hourly(sim, [20.0, 20.0])
+
+    assert [r['result']['statusCode'] for r in records] == [503, 503]
+    assert records[0]['result']['body']['summary'] == 'Power Out - TP On - 88k Off'
+    assert records[1]['result']['body']['summary'] == 'Power Out - TP On - 88k Off - Off already sent'
+    assert sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] == 'Off'
+
+
+def test_handler_status_lookup_and_level_errors(mocker):
+    logged = mocker.spy(reporting, 'log_result')
+    hourly = load_event('88k_tank_test_event_hourly.json')
+    with Simulation() as sim:
+        zone = sim.sensaphone.zone('88kTank', '88k Level')
+        zone['value'] = 'Not Connected'
+        bad_level = sim.invoke('88k_tank', hourly)
+        zone['name'] = '88k Tank Level'
+        renamed = sim.invoke('88k_tank', hourly)
+
+    assert bad_level['result']['statusCode'] == 500
+    assert bad_level['result']['body']['summary'] == "88k Level not a number - 'Not Connected'"
+    assert renamed['result']['statusCode'] == 404
+    assert renamed['result']['body']['summary'] == 'Zone 88k Level not found on Sentinel 88kTank'
+    assert [call.args[2]['statusCode'] for call in logged.call_args_list] == [500, 404]
+    assert 'change_device_output' not in renamed['calls']
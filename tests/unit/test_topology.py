@@ -0,0 +1,40 @@
+import json
+
+from melodywoods import topology
+from simulator import Simulation
+
+
+def test_fanout_tables():
+    topo = topology.load()
+
+    assert [p.name for p in topo.pumps_for_alarm('TreatmentPlant', 'chlorine_low')] == ['spring', 'well3']
+    assert [p.name for p in topo.pumps_for_alarm('Well#3', 'power')] == ['well3']
+    # well #5 is disabled
+    assert topo.pumps_for_alarm('Well#5', 'power') == ()
+    assert topo.pumps_for_alarm('88kTank', 'power') is None
+    assert topo.pump_at('Well#3', '#3 Well Pump').restore == 'schedule'
+    assert [e['pump_name'] for e in topo.timer_events()] == ['#3 Well Pump']
+
+
+def test_enabling_a_pump_is_a_config_change(tmp_path):
+    with open(topology.TOPOLOGY_FILE) as fp:
+        declaration = json.load(fp)
+    declaration['pumps']['well5'].update({'enabled': True, 'scheduled': True})
+    path = tmp_path / 'topology.json'
+    path.write_text(json.dumps(declaration))
+
+    topo = topology.load(str(path))
+    assert [p.name for p in topo.pumps_for_alarm('TreatmentPlant', 'power')] == ['spring', 'well3', 'well5']
+    assert [p.name for p in topo.timer_pumps] == ['well3', 'well5']
+    assert topo.pump_event(topo.pumps['well5'], 'off', 'email_alarm') == {
+        "sentinel_name": "Well#5", "pump_name": "#5 Well Pump", "pump": "off",
+        "reason": {"type": "email_alarm", "value": True}}
+
+
+def test_supply_timers_batch():
+    with Simulation() as sim:
+        sim.clock.advance(hours=20)
+        record = sim.invoke('supply', {"pumps": "timers"})
+
+    assert [r['body']['msg'] for r in record['result']['body']['results']] == ['Success']
+    assert sim.sensaphone.zone('Well#3', '#3 Well Pump')['value'] == 'On'
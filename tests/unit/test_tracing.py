@@ -0,0 +1,89 @@
+import json
+import tracemalloc
+
+import pytest
+
+from melodywoods import runtime
+from melodywoods import tracing
+from melodywoods import profiling
+
+
+@pytest.fixture()
+def records(mocker):
+    records = []
+    mocker.patch.object(tracing, 'sink', records.append)
+    return records
+
+
+def test_handler_emits_emf(records):
+    @tracing.handler('supply')
+    def lambda_handler(event, context):
+        with tracing.span('system_status'):
+            pass
+        with tracing.span('system_status'):
+            pass
+        tracing.retry('system_status')
+        return 'done'
+
+    assert lambda_handler({}, None) == 'done'
+
+    record = json.loads(records[0])
+    metrics = record['_aws']['CloudWatchMetrics'][0]
+    assert metrics['Namespace'] == 'MelodyWoodsWater'
+    assert metrics['Dimensions'] == [['Function']]
+    assert {m['Name'] for m in metrics['Metrics']} == {'system_status', 'system_status_retries', 'invocation'}
+    assert record['Function'] == 'supply'
+    assert len(record['system_status']) == 2
+    assert record['system_status_retries'] == 1
+    # reset after flush
+    assert tracing.spans() == {}
+
+
+def test_handler_flushes_on_error(records):
+    @tracing.handler('email')
+    def lambda_handler(event, context):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        lambda_handler({}, None)
+    assert json.loads(records[0])['Function'] == 'email'
+
+
+def test_sensaphone_calls_traced(mocker):
+    creds = {'session': 'a', 'acctid': 1, 'session_expiration': '2999-01-01 00:00:00'}
+    mocker.patch('pysensaphone.sensaphone_auth.check_valid_session', return_value=creds)
+    mocker.patch('pysensaphone.sensaphone_auth.sensaphone_login', return_value=dict(creds, session='b'))
+    tracing.reset()
+
+    def system_status(c):
+        if c['session'] != 'b':
+            raise TypeError("'bool' object is not subscriptable")
+        return [{'name': 'Well#3'}]
+
+    runtime.call_sensaphone(system_status)
+
+    spans = tracing.spans()
+    assert len(spans['sensaphone_login']) == 2
+    assert len(spans['system_status']) == 2
+    assert tracing.emf_record('supply')['system_status_retries'] == 1
+
+
+def test_profiling_report(records, mocker):
+    reports = []
+    mocker.patch.object(profiling, 'sink', reports.append)
+
+    @tracing.handler('88k_tank')
+    def lambda_handler(event, context):
+        return len([str(i) for i in range(10000)])
+
+    assert lambda_handler({}, None) == 10000
+    assert reports == []
+
+    mocker.patch.object(profiling, 'PROFILING', True)
+    assert lambda_handler({}, None) == 10000
+    report = json.loads(reports[0])
+    assert report['profile'] == '88k_tank'
+    assert report['python_peak_kb'] > 100
+    assert len(report['top_allocations']) <= profiling.PROFILE_TOP
+    assert any('lambda_handler' in spot for spot in report['hot_spots'])
+    assert not tracemalloc.is_tracing()
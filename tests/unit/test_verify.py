@@ -0,0 +1,54 @@
+import pytest
+
+from melodywoods import verify
+from simulator import FakeSensaphone, Simulation, load_event
+
+
+@pytest.fixture()
+def verify_on(mocker):
+    mocker.patch.object(verify, 'VERIFY', True)
+
+
+def test_zone_from_info():
+    response = {'result': {'success': True},
+                'response': {'device': [{'device_id': 3, 'zone': [{'zone_id': 31, 'value': 'On'}]}]}}
+
+    assert verify.zone_from_info(response, 31) == {'zone_id': 31, 'value': 'On'}
+    assert verify.zone_from_info(response, 32) is None
+    assert verify.zone_from_info({'result': {'success': False}}, 31) is None
+
+
+def test_88k_change_is_read_back(verify_on):
+    with Simulation(sensaphone=FakeSensaphone(actuation_delay=2)) as sim:
+        sim.sensaphone.zone('TreatmentPlant', '88k Pump')['value'] = 'On'
+        record = sim.invoke('88k_tank', dict(load_event('88k_tank_test_event.json'), pump='off'))
+
+    assert record['result']['statusCode'] == 200
+    # reads after 1s and 3s, only the one zone is read
+    assert record['result']['body']['data']['verify'] == {'verified': True, 'seconds': 3.0, 'polls': 2,
+                                                          'value': 'Off'}
+    assert record['calls']['system_status'] == 1
+
+
+def test_supply_change_is_read_back(verify_on):
+    event = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "on",
+             "reason": {"type": "email_alarm", "value": True}}
+    with Simulation(sensaphone=FakeSensaphone(actuation_delay=6)) as sim:
+        record = sim.invoke('supply', event)
+
+    check = record['result']['body']['response_data']['verify']
+    # reads after 1s, 3s, 7s
+    assert check == {'verified': True, 'seconds': 7.0, 'polls': 3, 'value': 'On'}
+    assert record['calls']['device_zone_info'] == 3
+    assert record['calls']['system_status'] == 1
+
+
+def test_supply_change_not_confirmed(verify_on):
+    event = {"sentinel_name": "Well#3", "pump_name": "#3 Well Pump", "pump": "on",
+             "reason": {"type": "email_alarm", "value": True}}
+    with Simulation(sensaphone=FakeSensaphone(actuation_delay=60)) as sim:
+        record = sim.invoke('supply', event)
+
+    assert record['result']['statusCode'] == 504
+    assert record['result']['body']['msg'] == 'Output change not confirmed'
+    assert record['result']['body']['response_data']['verify']['verified'] is False